@@ -0,0 +1,78 @@
+"""
+Compare loading a processed file with csv.reader and the column cache.
+
+    python -m benchmarks.column_cache [--years N]
+
+Processes a synthetic 1-minute Lowland.csv, builds its column cache,
+and times getting one column of the whole file into memory by
+
+  csv        reading the processed CSV with csv.reader, as downstream
+             readers do now
+  cache      opening the ColumnCache and summing the column, so every
+             page of it is actually read
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+import blackrock_column_cache
+import blackrock_data_processor as processor
+from blackrock_column_cache import ColumnCache, update_cache
+from benchmarks.synthetic import ENVIRONMENTAL_HEADER, write_toa5
+
+
+def load_csv(path, name):
+    with open(path, newline='') as f:
+        reader = csv.reader(f, quoting=csv.QUOTE_NONNUMERIC)
+        i = next(reader).index(name)
+        return [row[i] for row in reader]
+
+
+def load_cache(filename, name):
+    with ColumnCache(filename) as cache:
+        total = sum(cache.column(name))
+    return total
+
+
+def timed(func, *args):
+    started = time.time()
+    func(*args)
+    return time.time() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--years', type=float, default=3)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(workdir, 'Lowland.csv')
+        outdir = os.path.join(workdir, 'processed')
+        os.mkdir(outdir)
+        write_toa5(src, ENVIRONMENTAL_HEADER, args.years, 1)
+        with mock.patch.object(processor, 'PROCESSED_DATA_DIR', outdir), \
+                mock.patch.object(blackrock_column_cache,
+                                  'PROCESSED_DATA_DIR', outdir):
+            processor.process_environmental_data(
+                workdir, 'Lowland.csv', backend='python')
+            path = os.path.join(outdir, 'Lowland.csv')
+            print('%s: %.0f MB' % (path, os.path.getsize(path) / 1e6))
+            print('%-10s %7.2fs' % ('build', timed(
+                update_cache, 'Lowland.csv')))
+            print('%-10s %7.2fs' % ('csv', timed(
+                load_csv, path, 'AvgTEMP_C')))
+            print('%-10s %7.2fs' % ('cache', timed(
+                load_cache, 'Lowland.csv', 'AvgTEMP_C')))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare the pure-Python and numpy processing backends.
+
+    python -m benchmarks.columnar [--years N]
+
+Times dendrometer_rows, rdh_rows (20-minute data) and
+environmental_rows (1-minute data) from each backend on N years of
+synthetic rows.
+"""
+from __future__ import print_function
+
+import argparse
+import time
+from datetime import datetime
+
+import blackrock_data_processor as processor
+import blackrock_columnar as columnar
+from benchmarks.synthetic import (
+    DENDROMETER_HEADER, ENVIRONMENTAL_HEADER, logger_rows
+)
+
+DBH = [48.0, 40.1, 42.1, 46.0, 42.4]
+VOLTAGES = [20.9, 19.23, 20.93, 316.5, 120.9]
+
+
+def copy_rows(rows):
+    return [list(row) for row in rows]
+
+
+def time_call(func, rows, *args):
+    rows = copy_rows(rows)
+    started = time.time()
+    func(rows, *args)
+    return time.time() - started
+
+
+def compare(name, rows, python_func, numpy_func, *args):
+    python_time = time_call(python_func, rows, *args)
+    numpy_time = time_call(numpy_func, rows, *args)
+    print('%-20s %8d rows  python %7.2fs  numpy %7.2fs  (%.1fx)' % (
+        name, len(rows) - 1, python_time, numpy_time,
+        python_time / max(numpy_time, 1e-9)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--years', type=float, default=3)
+    args = parser.parse_args(argv)
+
+    if columnar.np is None:
+        print('numpy is not installed')
+        return 1
+
+    start_dt = datetime(2016, 9, 10, 17)
+    dendrometer = logger_rows(DENDROMETER_HEADER, args.years, 20)
+    compare('dendrometer_rows', dendrometer, processor.dendrometer_rows,
+            columnar.dendrometer_rows, start_dt)
+
+    processed = processor.dendrometer_rows(
+        copy_rows(dendrometer), start_dt)[1:]
+    compare('rdh_rows', processed, processor.rdh_rows, columnar.rdh_rows,
+            DBH, VOLTAGES)
+
+    environmental = logger_rows(ENVIRONMENTAL_HEADER, args.years, 1)
+    compare('environmental_rows', environmental,
+            processor.environmental_rows, columnar.environmental_rows,
+            start_dt)
+
+
+if __name__ == '__main__':
+    main()
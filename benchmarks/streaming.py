@@ -0,0 +1,85 @@
+"""
+Measure the peak memory of processing a large logger file.
+
+    python -m benchmarks.streaming [--years N]
+
+Writes a synthetic 1-minute Lowland.csv (about 220MB per year), then
+processes it in a fresh child process for each mode and reports the
+child's peak RSS:
+
+  lists      read_toa5_rows and environmental_rows, which hold every
+             row in memory, as the processor used to
+  streaming  process_environmental_data with the python backend
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from benchmarks.synthetic import ENVIRONMENTAL_HEADER, write_toa5
+
+MODES = ('lists', 'streaming')
+
+
+def run_mode(mode, path, outdir):
+    import blackrock_data_processor as processor
+
+    with mock.patch.object(processor, 'PROCESSED_DATA_DIR', outdir):
+        if mode == 'lists':
+            header, rows, position, resumed = processor.read_toa5_rows(path)
+            rows.insert(0, header)
+            newrows = processor.environmental_rows(rows)
+            processor.write_processed_rows(
+                os.path.basename(path), newrows, position)
+        else:
+            processor.process_environmental_data(
+                os.path.dirname(path), os.path.basename(path),
+                backend='python')
+
+
+def measure(mode, path, outdir):
+    """Returns (seconds, peak RSS in MB) of processing path in a child."""
+    started = time.time()
+    child = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.streaming',
+         '--run', mode, path, outdir],
+        stdout=subprocess.DEVNULL)
+    pid, status, rusage = os.wait4(child.pid, 0)
+    if status:
+        raise RuntimeError('%s run failed' % mode)
+    # ru_maxrss is in kilobytes on Linux.
+    return time.time() - started, rusage.ru_maxrss / 1024.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--run', nargs=3, metavar=('MODE', 'PATH', 'OUT'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run:
+        return run_mode(*args.run)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'Lowland.csv')
+        outdir = os.path.join(workdir, 'processed')
+        os.mkdir(outdir)
+        write_toa5(path, ENVIRONMENTAL_HEADER, args.years, 1)
+        print('%s: %.0f MB' % (path, os.path.getsize(path) / 1e6))
+        for mode in MODES:
+            seconds, peak = measure(mode, path, outdir)
+            print('%-10s %7.1fs  peak RSS %8.1f MB' % (mode, seconds, peak))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
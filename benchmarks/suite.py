@@ -0,0 +1,236 @@
+"""
+Time the processing stages end to end, and catch regressions.
+
+    python -m benchmarks.suite [--years N] [--interval MINUTES]
+                               [--backend python|numpy] [--repeat N]
+                               [--output RESULTS.json]
+    python -m benchmarks.suite --compare OLD.json NEW.json
+                               [--threshold FRACTION]
+
+Writes realistic synthetic logger files (the Red_Oak dendrometer
+layout, Mailley's Mill's Hemlock/Pine layout and Lowland's
+environmental one) covering N years of rows every MINUTES minutes,
+then runs each stage on them in a fresh child process:
+
+  dendrometer      process_dendrometer_data on Mnt_Misery_Table20.csv
+  formula          apply_formula_to_processed_dendrometer_data on the
+                   result
+  mailley          process_dendrometer_data on Mailley's Mill's file
+  environmental    process_environmental_data on Lowland.csv
+
+and reports the rows per second, MB per second and the child's peak
+RSS for each. With --repeat, the fastest time and the highest peak
+are kept. --output saves the results as JSON.
+
+--compare reads two saved results, and flags the stages whose time or
+peak RSS grew by more than the threshold (10% by default). It exits
+with status 1 if there are any.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from unittest import mock
+
+from benchmarks.synthetic import (
+    DENDROMETER_HEADER, ENVIRONMENTAL_HEADER, MAILLEY_HEADER, row_count,
+    write_toa5
+)
+
+DBH = [48.0, 40.1, 42.1, 46.0, 42.4]
+VOLTAGES = [20.9, 19.23, 20.93, 316.5, 120.9]
+
+# The files the stages read, and their layouts.
+FILES = [
+    ('Mnt_Misery_Table20.csv', DENDROMETER_HEADER),
+    ('Mailley\'s_Mill_Table20Min.csv', MAILLEY_HEADER),
+    ('Lowland.csv', ENVIRONMENTAL_HEADER),
+]
+# The stages, in the order they run, and the file each reads.
+STAGES = [
+    ('dendrometer', 'Mnt_Misery_Table20.csv'),
+    ('formula', 'Mnt_Misery_Table20.csv'),
+    ('mailley', 'Mailley\'s_Mill_Table20Min.csv'),
+    ('environmental', 'Lowland.csv'),
+]
+THRESHOLD = 0.1
+
+
+def run_stage(stage, workdir, backend):
+    """Runs a stage in this process, and prints how long it took."""
+    import blackrock_data_processor as processor
+
+    src = os.path.join(workdir, 'src')
+    outdir = os.path.join(workdir, 'processed')
+    started = time.time()
+    with mock.patch.object(processor, 'PROCESSED_DATA_DIR', outdir):
+        if stage == 'dendrometer':
+            processor.process_dendrometer_data(
+                src, 'Mnt_Misery_Table20.csv', backend=backend)
+        elif stage == 'formula':
+            processor.apply_formula_to_processed_dendrometer_data(
+                'Mnt_Misery_Table20.csv', DBH, VOLTAGES, backend=backend)
+        elif stage == 'mailley':
+            processor.process_dendrometer_data(
+                src, 'Mailley\'s_Mill_Table20Min.csv', backend=backend,
+                mailley=True)
+        else:
+            processor.process_environmental_data(
+                src, 'Lowland.csv', start_dt=datetime(2016, 9, 10, 17),
+                backend=backend)
+    print(json.dumps({'seconds': time.time() - started}))
+
+
+def measure(stage, workdir, backend):
+    """
+    Returns (seconds, peak RSS in MB) of running a stage in a child
+    process.
+    """
+    child = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.suite',
+         '--stage', stage, workdir, backend],
+        stdout=subprocess.PIPE)
+    output = child.stdout.read()
+    pid, status, rusage = os.wait4(child.pid, 0)
+    if status:
+        raise RuntimeError('the %s stage failed' % stage)
+    seconds = json.loads(output.decode('utf-8').splitlines()[-1])['seconds']
+    # ru_maxrss is in kilobytes on Linux.
+    return seconds, rusage.ru_maxrss / 1024.0
+
+
+def run_suite(workdir, years, interval, backend, repeat):
+    """Returns the results of each stage, keyed by its name."""
+    src = os.path.join(workdir, 'src')
+    os.mkdir(src)
+    for filename, header in FILES:
+        write_toa5(os.path.join(src, filename), header, years, interval,
+                   realistic=True)
+
+    results = {}
+    for n in range(repeat):
+        outdir = os.path.join(workdir, 'processed')
+        shutil.rmtree(outdir, ignore_errors=True)
+        os.mkdir(outdir)
+        for stage, filename in STAGES:
+            seconds, peak = measure(stage, workdir, backend)
+            result = results.setdefault(stage, {
+                'rows': row_count(years, interval),
+                'bytes': os.path.getsize(os.path.join(src, filename)),
+                'seconds': seconds, 'peak_rss_mb': peak})
+            result['seconds'] = min(result['seconds'], seconds)
+            result['peak_rss_mb'] = max(result['peak_rss_mb'], peak)
+
+    for result in results.values():
+        seconds = max(result['seconds'], 1e-9)
+        result['rows_per_second'] = result['rows'] / seconds
+        result['mb_per_second'] = result['bytes'] / 1e6 / seconds
+    return results
+
+
+def print_results(results):
+    for stage, filename in STAGES:
+        result = results[stage]
+        print('%-14s %9d rows %8.2fs %10.0f rows/s %7.1f MB/s '
+              'peak RSS %7.1f MB' % (
+                  stage, result['rows'], result['seconds'],
+                  result['rows_per_second'], result['mb_per_second'],
+                  result['peak_rss_mb']))
+
+
+def regressions(old, new, threshold=THRESHOLD):
+    """
+    Returns a list of (stage, measure, old value, new value) for each
+    stage of the new results that's slower, or peaks higher, than the
+    old by more than threshold.
+    """
+    found = []
+    for stage, filename in STAGES:
+        if stage not in old['stages'] or stage not in new['stages']:
+            continue
+        for key in ('seconds', 'peak_rss_mb'):
+            before = old['stages'][stage][key]
+            after = new['stages'][stage][key]
+            if after > before * (1 + threshold):
+                found.append((stage, key, before, after))
+    return found
+
+
+def compare(old_path, new_path, threshold=THRESHOLD):
+    """
+    Prints the changes between two saved results. Returns 1 if any
+    stage regressed, otherwise 0.
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if old['config'] != new['config']:
+        print('Warning: the runs were configured differently: %s, %s' % (
+            old['config'], new['config']))
+
+    for stage, filename in STAGES:
+        if stage in old['stages'] and stage in new['stages']:
+            before = old['stages'][stage]
+            after = new['stages'][stage]
+            print('%-14s %8.2fs -> %8.2fs  peak RSS %7.1f -> %7.1f MB' % (
+                stage, before['seconds'], after['seconds'],
+                before['peak_rss_mb'], after['peak_rss_mb']))
+
+    found = regressions(old, new, threshold)
+    for stage, key, before, after in found:
+        print('REGRESSION: %s %s went from %.2f to %.2f (+%.0f%%)' % (
+            stage, key, before, after, 100 * (after / before - 1)))
+    return 1 if found else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--interval', type=int, default=20,
+                        help='minutes between rows')
+    parser.add_argument('--backend', default='python',
+                        choices=('python', 'numpy'))
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--stage', nargs=3,
+                        metavar=('STAGE', 'WORKDIR', 'BACKEND'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.stage:
+        return run_stage(*args.stage)
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.threshold)
+
+    config = {'years': args.years, 'interval': args.interval,
+              'backend': args.backend}
+    workdir = tempfile.mkdtemp()
+    try:
+        stages = run_suite(workdir, args.years, args.interval, args.backend,
+                           args.repeat)
+    finally:
+        shutil.rmtree(workdir)
+    print_results(stages)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'created': datetime.now().isoformat(),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'config': config, 'stages': stages},
+                      f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Synthetic logger data for the benchmarks.
+"""
+from __future__ import print_function
+
+import itertools
+import math
+import random
+from datetime import datetime, timedelta
+
+START = datetime(2016, 9, 1)
+
+DENDROMETER_HEADER = ['TIMESTAMP', 'RECORD', 'Battery_Volt_MIN', 'ProgSig'] + [
+    'Red_Oak_%d_%s' % (i, agg)
+    for i in range(1, 6) for agg in ('AVG', 'MAX', 'MIN', 'STD')]
+
+# Mailley's Mill has hemlocks and pines rather than red oaks.
+MAILLEY_HEADER = ['TIMESTAMP', 'RECORD', 'Battery_Volt_MIN', 'ProgSig'] + [
+    '%s_%d_%s' % (tree, i, agg)
+    for tree in ('Hemlock', 'Pine') for i in range(1, 4)
+    for agg in ('AVG', 'MAX', 'MIN', 'STD')]
+
+ENVIRONMENTAL_HEADER = [
+    'TIMESTAMP', 'RECORD', 'AvgTEMP_C', 'MinTEMP_C', 'MaxTEMP_C',
+    'AvgRh', 'MaxRh', 'MinRh', 'AvgVP', 'AvgDewPt', 'TotalPAR',
+    'AvgGSR', 'AvgWspd', 'AvgWdir', 'StdDevWdir', 'MaxWspd',
+    'TotalRain', 'AvgBP', 'MaxBP', 'MinBp', 'AvgST_10', 'AvgST_100',
+    'MinBatt', 'AvgCO2', 'AvgOzone', 'DSTEMPF', 'DSDEPTH', 'DSRETRIES',
+    'SoilM_5cm', 'SoilM_15cm', 'UVB', 'UVTEMP', 'UVA', 'V2mV', 'V2mV2',
+    'Snow1_BATT', 'Snow1_PNLTMP', 'CM3_up', 'CM3_dn', 'CG3_up',
+    'CG3_dn', 'CM_TempC', 'CM3_TempK', 'Net_Rs', 'Net_R1', 'Albedo',
+    'Up_Total', 'Dn_Total', 'Net_Total', 'AvgPAR_Den', 'MaxPAR_Den',
+    'MinPAR_Den']
+
+
+def row_count(years, interval_minutes):
+    return int(years * 365 * 24 * 60 / interval_minutes)
+
+
+def logger_rows(header, years, interval_minutes=20, seed=0):
+    """
+    Returns CSV-style rows (header first) like the processor reads from
+    a TOA5 file, covering the given number of years.
+    """
+    rnd = random.Random(seed)
+    rows = [list(header)]
+    step = timedelta(minutes=interval_minutes)
+    ts = START
+    for n in range(row_count(years, interval_minutes)):
+        rows.append([ts.strftime('%Y-%m-%d %H:%M:%S'), float(n)] + [
+            round(rnd.uniform(0, 500), 3) for name in header[2:]])
+        ts += step
+    return rows
+
+
+# How each kind of column varies: (base, spread of the base across
+# columns of the kind, daily swing, seasonal swing, growth per year,
+# noise), matched on a part of the column's name. The first match
+# wins.
+COLUMN_MODELS = [
+    ('Battery', (12.6, 0.2, 0.3, 0, 0, 0.05)),
+    ('ProgSig', (3245, 0, 0, 0, 0, 0)),
+    ('_STD', (0.4, 0.3, 0.1, 0, 0, 0.05)),
+    # Dendrometer voltages (mV) creep up as the trees grow, and swell
+    # and shrink a little over the day.
+    ('Red_Oak', (150, 140, 1.5, 0, 12, 0.2)),
+    ('Hemlock', (150, 140, 1.5, 0, 8, 0.2)),
+    ('Pine', (150, 140, 1.5, 0, 10, 0.2)),
+    ('TEMP', (9, 0, 5, 12, 0, 0.3)),
+    ('TotalRain', (0, 0, 0, 0, 0, 0)),
+    ('SoilM', (0.3, 0.05, 0, 0.08, 0, 0.005)),
+    ('PAR', (400, 0, 400, 150, 0, 20)),
+    ('', (50, 45, 10, 5, 0, 1)),
+]
+# A column's MAX and MIN are its AVG give or take this much.
+AGGREGATE_OFFSETS = {'MAX': 0.5, 'MIN': -0.5, 'AVG': 0}
+# About one row in this many has a "NAN" cell, as when a sensor drops
+# out.
+NAN_EVERY = 5000
+
+
+def column_model(name):
+    """Returns the (base, daily, seasonal, growth, noise) of a column."""
+    for part, model in COLUMN_MODELS:
+        if part in name:
+            break
+    base, spread, daily, seasonal, growth, noise = model
+    # Spread the columns of a kind out deterministically, keeping the
+    # AVG, MAX and MIN of a sensor together.
+    stem, sep, aggregate = name.rpartition('_')
+    if aggregate in AGGREGATE_OFFSETS:
+        base += AGGREGATE_OFFSETS[aggregate]
+    else:
+        stem = name
+    base += spread * math.sin(sum(map(ord, stem)))
+    return base, daily, seasonal, growth, noise
+
+
+def realistic_values(header, years, interval_minutes, seed=0):
+    """
+    Yields the value fields of each row, as CSV text, of data that
+    looks like the loggers': daily and seasonal cycles, tree growth,
+    noise and the occasional "NAN".
+    """
+    rnd = random.Random(seed)
+    models = [column_model(name) for name in header[2:]]
+    for n in range(row_count(years, interval_minutes)):
+        minutes = n * interval_minutes
+        day = 2 * math.pi * (minutes % 1440) / 1440.0
+        t = minutes / (365 * 1440.0)
+        diurnal = math.sin(day - math.pi / 2)
+        # Warmest in mid-July, 10.5 months after START.
+        season = math.cos(2 * math.pi * (t + 1.5 / 12))
+        r = rnd.random() - 0.5
+        values = [
+            '%.3f' % (base + daily * diurnal + seasonal * season +
+                      growth * t + noise * r)
+            for base, daily, seasonal, growth, noise in models]
+        if rnd.random() * NAN_EVERY < 1:
+            values[rnd.randrange(len(values))] = '"NAN"'
+        yield ','.join(values)
+
+
+def write_toa5(path, header, years, interval_minutes=20, realistic=False,
+               seed=0):
+    """
+    Write a TOA5 file, with the 4-line preamble, covering the given
+    number of years, without holding it in memory. The values are
+    cheap to generate rather than realistic, unless realistic is set.
+    """
+    step = timedelta(minutes=interval_minutes)
+    ts = START
+    if realistic:
+        values = realistic_values(header, years, interval_minutes, seed)
+    else:
+        values = itertools.repeat(
+            ','.join('%.3f' % (i * 7.25) for i in range(len(header) - 2)))
+    with open(path, 'w', newline='') as f:
+        f.write('"TOA5","Synthetic","CR1000","1","CR1000.Std.32",'
+                '"CPU:synthetic.CR1","1","Table"\r\n')
+        f.write(','.join('"%s"' % name for name in header) + '\r\n')
+        f.write(','.join('""' for name in header) + '\r\n')
+        f.write(','.join('"Avg"' for name in header) + '\r\n')
+        for n, fields in zip(range(row_count(years, interval_minutes)),
+                             values):
+            f.write('"%s",%d,%s\r\n' % (
+                ts.strftime('%Y-%m-%d %H:%M:%S'), n, fields))
+            ts += step
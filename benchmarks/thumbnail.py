@@ -0,0 +1,60 @@
+"""
+Compare the per-frame cost of the webcam thumbnail backends.
+
+    python -m benchmarks.thumbnail [photo.jpg] [--frames N]
+
+Without a photo, a synthetic 2592x1944 JPEG (the size of a 5MP webcam
+frame) is used. The 'convert' backend is only timed if CONVERT exists.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from blackrock_thumbnail import make_thumbnails, Image, CONVERT
+
+
+def make_test_photo(path, size=(2592, 1944)):
+    gradient = Image.linear_gradient('L').resize(size)
+    Image.merge('RGB', (gradient, gradient.rotate(90), gradient)).save(
+        path, 'JPEG', quality=90)
+
+
+def time_backend(backend, src, targets, frames):
+    started = time.time()
+    for i in range(frames):
+        make_thumbnails(src, targets, backend=backend)
+    return (time.time() - started) / frames
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('photo', nargs='?')
+    parser.add_argument('--frames', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        src = args.photo
+        if src is None:
+            src = os.path.join(workdir, 'frame.jpg')
+            make_test_photo(src)
+        targets = [(os.path.join(workdir, 'thumb.jpg'), (207, 207))]
+
+        backends = []
+        if Image is not None:
+            backends.append('pillow')
+        if os.path.exists(CONVERT):
+            backends.append('convert')
+        for backend in backends:
+            per_frame = time_backend(backend, src, targets, args.frames)
+            print('%-8s %8.1f ms/frame' % (backend, per_frame * 1000))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
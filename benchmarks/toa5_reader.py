@@ -0,0 +1,70 @@
+"""
+Measure TOA5 parsing throughput with and without pushdown.
+
+    python -m benchmarks.toa5_reader [--years N]
+
+Writes a synthetic 1-minute Lowland.csv and runs it through
+iter_environmental_rows, reading it with TOA5Reader:
+
+  full       converting every field of every row, as the processor
+             used to
+  pushdown   with keep_columns and start_dt, so only the kept fields
+             of the rows from start_dt on are converted
+
+and reports the rows per second read from the file.
+"""
+from __future__ import print_function
+
+import argparse
+import itertools
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+
+import blackrock_data_processor as processor
+from benchmarks.synthetic import (
+    ENVIRONMENTAL_HEADER, START, row_count, write_toa5
+)
+
+
+def run(path, start_dt, pushdown):
+    if pushdown:
+        reader = processor.TOA5Reader(
+            path, keep_columns=processor.ENVIRONMENTAL_COLUMNS,
+            start_dt=start_dt)
+    else:
+        reader = processor.TOA5Reader(path)
+    rows = itertools.chain([reader.header], reader)
+    started = time.time()
+    for row in processor.iter_environmental_rows(rows, start_dt):
+        pass
+    return time.time() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--years', type=float, default=1)
+    parser.add_argument('--skip', type=float, default=0.5,
+                        help='fraction of the rows before start_dt')
+    args = parser.parse_args(argv)
+
+    count = row_count(args.years, 1)
+    start_dt = START + timedelta(minutes=int(count * args.skip))
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'Lowland.csv')
+        write_toa5(path, ENVIRONMENTAL_HEADER, args.years, 1)
+        print('%s: %d rows, %.0f MB, start_dt %s' % (
+            path, count, os.path.getsize(path) / 1e6, start_dt))
+        for name, pushdown in (('full', False), ('pushdown', True)):
+            seconds = run(path, start_dt, pushdown)
+            print('%-10s %7.2fs  %10.0f rows/sec' % (
+                name, seconds, count / seconds))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,505 @@
+#!ve/bin/python
+"""
+Rebuild processed station files from the archived hourly snapshots.
+===================================================================
+blackrock_backfill.py [--start TIMESTAMP] [--end TIMESTAMP]
+                      [--station FILENAME]... [--workers N]
+
+Reprocesses the rows of the given stations (all of STATIONS by
+default) from --start to --end (inclusive, in '%Y-%m-%d %H:%M:%S'
+format), e.g. after their calibration values or the kept columns
+change. Without --start, from the station's start date; without
+--end, through the newest row we have.
+
+The logger files only grow, so every hourly snapshot under
+LOCAL_DIRECTORY_BASE has all the rows up to when it was fetched,
+unless the logger was reset. The range is split into chunks of
+BACKFILL_CHUNK_DAYS, and each chunk is read from the newest snapshot
+that covers its start. The chunks are processed in parallel, in
+BACKFILL_WORKERS processes (one per core by default), into
+BACKFILL_STAGING_DIR.
+
+Each finished chunk is kept there, so if the backfill is interrupted
+or a chunk fails, running it again only does the chunks that aren't
+done. Once all of a station's chunks are done, they're put together
+with the rows of the existing processed file from outside the range,
+and the result is renamed over the processed file. Its checkpoint,
+index, column cache and rollups are then brought up to date, so the
+hourly runs carry on from it.
+
+BACKFILL_STAGING_DIR has to be on the same filesystem as
+PROCESSED_DATA_DIR. Rows the data fetcher appends to a station's
+processed file while it's being backfilled are lost until the next
+full rebuild, so it's best not to backfill while the fetcher is
+processing.
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import os.path
+import shutil
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+from blackrock_column_cache import update_cache
+from blackrock_data_processor import (
+    DENDROMETER_COLUMNS, ENVIRONMENTAL_COLUMNS, TIME_FMT, TOA5Reader,
+    checkpoint_path, columnar_backend, complete_lines, iter_dendrometer_rows,
+    iter_environmental_rows, iter_rdh_rows, load_checkpoint,
+    looks_like_timestamp, parse_timestamp, raw_timestamp, save_checkpoint,
+    save_json
+)
+from blackrock_freshness import newest_timestamp
+from blackrock_query import load_index, seek_offset, timestamp, update_index
+from blackrock_retention import date_subdirectories
+from blackrock_rollup import update_rollups
+from blackrock_stations import STATIONS, column_names, species_averages
+
+try:
+    from local_settings import (
+        LOCAL_DIRECTORY_BASE, PROCESSED_DATA_DIR, BACKFILL_STAGING_DIR,
+        BACKFILL_WORKERS, BACKFILL_CHUNK_DAYS,
+    )
+except ImportError:
+    from example_settings import (
+        LOCAL_DIRECTORY_BASE, PROCESSED_DATA_DIR, BACKFILL_STAGING_DIR,
+        BACKFILL_WORKERS, BACKFILL_CHUNK_DAYS,
+    )
+
+# Stop bisecting a logger file when the range is this small, and read
+# through it.
+BISECT_BYTES = 64 * 1024
+
+
+def snapshot_dirs(path=None, fields=None):
+    """Yields the hourly snapshot directories, oldest first."""
+    path = path or LOCAL_DIRECTORY_BASE
+    fields = fields or []
+    for subdir, subfields in sorted(date_subdirectories(path, fields)):
+        if len(subfields) == 4:
+            yield subdir
+        else:
+            for hour in snapshot_dirs(subdir, subfields):
+                yield hour
+
+
+def first_timestamp(fname):
+    """Returns the timestamp of the first row of a logger file."""
+    with open(fname, 'rb') as f:
+        for line in itertools.islice(f, 4, None):
+            ts = raw_timestamp(line)
+            if ts is not None:
+                return ts
+    return None
+
+
+def snapshot_spans(filename, base=None):
+    """
+    Returns (first timestamp, last timestamp, path) for each snapshot
+    of a logger file. Hard-linked copies are only looked at once.
+    """
+    spans = []
+    seen = {}
+    for path in snapshot_dirs(base):
+        fname = os.path.join(path, filename)
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            continue
+        key = (stat.st_dev, stat.st_ino, stat.st_size)
+        if key not in seen:
+            seen[key] = (first_timestamp(fname), newest_timestamp(fname))
+        first, last = seen[key]
+        if first is not None and last is not None:
+            spans.append((first, last, fname))
+    return spans
+
+
+def pick_snapshot(spans, start):
+    """
+    Returns the path of the newest snapshot that covers the rows from
+    the timestamp start: the one with the most rows after it, of those
+    that begin by then. If none do, the earliest-beginning ones are
+    considered instead.
+    """
+    candidates = [s for s in spans if s[0] <= start]
+    if not candidates:
+        earliest = min(s[0] for s in spans)
+        candidates = [s for s in spans if s[0] == earliest]
+    return max(candidates, key=lambda s: (s[1], s[2]))[2]
+
+
+def chunk_ranges(start_dt, end_dt, last, days):
+    """
+    Returns the [start, end) timestamps of the chunks from start_dt
+    through end_dt, or through the timestamp last if end_dt is None,
+    in which case the last chunk's end is None.
+    """
+    stop = (end_dt or parse_timestamp(last)) + timedelta(seconds=1)
+    step = timedelta(days=days)
+    chunks = []
+    chunk_start = start_dt
+    while chunk_start < stop:
+        chunk_end = min(chunk_start + step, stop)
+        chunks.append([chunk_start.strftime(TIME_FMT),
+                       chunk_end.strftime(TIME_FMT)])
+        chunk_start = chunk_end
+    if end_dt is None and chunks:
+        chunks[-1][1] = None
+    return chunks
+
+
+def next_row(f):
+    """Returns (line start, timestamp) of the next row in f, or None."""
+    line_start = f.tell()
+    for line in iter(f.readline, b''):
+        ts = raw_timestamp(line) if line.endswith(b'\n') else None
+        if ts is not None:
+            return line_start, ts
+        line_start += len(line)
+    return None
+
+
+def position_before(fname, start):
+    """
+    Returns the position (as in a checkpoint) of the last row of a
+    logger file before the timestamp start, or None if there isn't
+    one. The rows are in time order, so the file is bisected.
+    """
+    with open(fname, 'rb') as f:
+        for i in range(4):
+            f.readline()
+        # lo is always the start of the data or of a row before start.
+        lo = f.tell()
+        hi = f.seek(0, os.SEEK_END)
+        while hi - lo > BISECT_BYTES:
+            mid = (lo + hi) // 2
+            f.seek(mid)
+            f.readline()
+            row = next_row(f)
+            if row is None or row[1] >= start:
+                hi = mid
+            else:
+                lo = row[0]
+
+        position = None
+        for line_start, line in complete_lines(f, lo):
+            ts = raw_timestamp(line)
+            if ts is not None:
+                if ts >= start:
+                    break
+                position = {'line_start': line_start,
+                            'offset': line_start + len(line),
+                            'timestamp': ts}
+    return position
+
+
+def rows_before(reader, end):
+    """
+    Yields the reader's rows before the timestamp end, leaving its
+    position at the last of them.
+    """
+    rows = iter(reader)
+    if end is None:
+        for row in rows:
+            yield row
+        return
+    previous = dict(reader.position)
+    for row in rows:
+        if looks_like_timestamp(row[0]) and row[0] >= end:
+            rows.close()
+            reader.position.update(previous)
+            return
+        yield row
+        previous = dict(reader.position)
+
+
+def station_rows(fname, station, start, end):
+    """
+    Returns (header, rows, reader): the processed header and rows of a
+    station's logger file from the timestamp start to before end, as
+    process_station would write them, and the reader they come from.
+    """
+    environmental = station['kind'] == 'environmental'
+    start_dt = parse_timestamp(start)
+    reader = TOA5Reader(
+        fname, position_before(fname, start),
+        ENVIRONMENTAL_COLUMNS if environmental else DENDROMETER_COLUMNS,
+        start_dt)
+    rows = itertools.chain([reader.header], rows_before(reader, end))
+
+    columnar = columnar_backend()
+    if environmental:
+        transform = columnar.environmental_rows if columnar \
+            else iter_environmental_rows
+        newrows = iter(transform(rows, start_dt))
+    else:
+        transform = columnar.dendrometer_rows if columnar \
+            else iter_dendrometer_rows
+        newrows = iter(transform(
+            rows, start_dt, station.get('rename_trees'),
+            species_averages(station)))
+    header = next(newrows)
+    if station.get('dbh_vals'):
+        transform = columnar.rdh_rows if columnar else iter_rdh_rows
+        newrows = transform(
+            newrows, station['dbh_vals'], station['voltage_vals'])
+    return header, newrows, reader
+
+
+def staging_dir(filename):
+    return os.path.join(BACKFILL_STAGING_DIR, filename)
+
+
+def chunk_params(station, snapshot, start, end):
+    """
+    Returns what a chunk's output depends on, which has to match for
+    a chunk from an earlier run to be reused.
+    """
+    return json.loads(json.dumps({
+        'station': station, 'snapshot': snapshot, 'start': start,
+        'end': end, 'columns': [DENDROMETER_COLUMNS, ENVIRONMENTAL_COLUMNS],
+    }, default=str))
+
+
+def load_chunk(job):
+    """Returns the saved result of a chunk, if it's done."""
+    try:
+        with open(job['path'] + '.json', 'r') as f:
+            result = json.load(f)
+    except (IOError, ValueError):
+        return None
+    return result if result['params'] == job['params'] else None
+
+
+def backfill_chunk(job):
+    """
+    Process a chunk into the staging directory. Returns None, or the
+    formatted traceback if it failed.
+    """
+    try:
+        header, rows, reader = station_rows(
+            job['snapshot'], job['station'], job['start'], job['end'])
+        with open(job['path'] + '.tmp', 'w') as csvfile:
+            writer = csv.writer(csvfile, quoting=csv.QUOTE_NONNUMERIC)
+            writer.writerows(rows)
+        os.replace(job['path'] + '.tmp', job['path'])
+        result = {'params': job['params'], 'header': header,
+                  'position': reader.position}
+        save_json(job['path'] + '.json', result)
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+
+def plan_chunks(station, start_dt, end_dt, days, base=None):
+    """Returns the chunk jobs for backfilling a station."""
+    filename = station['filename']
+    spans = snapshot_spans(filename, base)
+    if not spans:
+        raise IOError('no snapshots of %s' % filename)
+    # There's nothing to do before the station's start date, or the
+    # first row we have.
+    start_dt = max(start_dt or station['start_dt'], station['start_dt'],
+                   parse_timestamp(min(s[0] for s in spans)))
+    last = max(s[1] for s in spans)
+
+    jobs = []
+    for start, end in chunk_ranges(start_dt, end_dt, last, days):
+        snapshot = pick_snapshot(spans, start)
+        jobs.append({
+            'filename': filename, 'station': station,
+            'snapshot': snapshot, 'start': start, 'end': end,
+            'path': os.path.join(staging_dir(filename), '%s.csv' % (
+                start.replace('-', '').replace(' ', '').replace(':', ''))),
+            'params': chunk_params(station, snapshot, start, end),
+        })
+    return jobs
+
+
+def splice_offsets(filename, start, end):
+    """
+    Returns (prefix end, suffix start): where the rows of the existing
+    processed file from the timestamp start begin, and where the rows
+    after end begin (None if there are none, or end is None).
+    """
+    fname = os.path.join(PROCESSED_DATA_DIR, filename)
+    if not os.path.exists(fname):
+        return 0, None
+    index = load_index(filename)
+    offsets = []
+    with open(fname, 'rb') as f:
+        for bound, after in ((start, False), (end, True)):
+            if bound is None:
+                offsets.append(None)
+                continue
+            f.seek(seek_offset(f, index, bound))
+            line_start = f.tell()
+            for line in iter(f.readline, b''):
+                ts = raw_timestamp(line)
+                if ts is not None and (ts > bound if after else
+                                       ts >= bound):
+                    break
+                line_start += len(line)
+            else:
+                if after:
+                    # Every row is up to end, so there's no suffix.
+                    line_start = None
+            offsets.append(line_start)
+    prefix_end, suffix_start = offsets
+    return prefix_end or 0, suffix_start
+
+
+def copy_range(src, dst, start, stop=None):
+    with open(src, 'rb') as f:
+        f.seek(start)
+        if stop is None:
+            shutil.copyfileobj(f, dst)
+        else:
+            dst.write(f.read(stop - start))
+
+
+def assemble(station, jobs, start, end):
+    """
+    Put the station's chunks together with the rows of its processed
+    file from outside the range, and swap the result in.
+    """
+    filename = station['filename']
+    outfile = os.path.join(PROCESSED_DATA_DIR, filename)
+    staged = os.path.join(staging_dir(filename), filename)
+    formula = bool(station.get('dbh_vals'))
+    results = [load_chunk(job) for job in jobs]
+    prefix_end, suffix_start = splice_offsets(filename, start, end)
+
+    with open(staged, 'wb') as out:
+        if prefix_end:
+            copy_range(outfile, out, 0, prefix_end)
+        elif not formula:
+            # Files with the formula applied have no header.
+            text = io.StringIO()
+            csv.writer(text, quoting=csv.QUOTE_NONNUMERIC).writerow(
+                results[0]['header'])
+            out.write(text.getvalue().encode('utf-8'))
+        for job in jobs:
+            copy_range(job['path'], out, 0)
+        if suffix_start is not None:
+            copy_range(outfile, out, suffix_start)
+
+    checkpoint = load_checkpoint(filename)
+    if suffix_start is None or checkpoint is None:
+        checkpoint = dict(results[-1]['position'])
+    checkpoint['output_size'] = os.path.getsize(staged)
+    checkpoint['pending_from'] = None if formula else 0
+
+    # Without a checkpoint, the next run rebuilds the file from
+    # scratch, which is safe if we're interrupted before saving ours.
+    if os.path.exists(checkpoint_path(filename)):
+        os.remove(checkpoint_path(filename))
+    os.replace(staged, outfile)
+    save_checkpoint(filename, checkpoint)
+    update_index(filename)
+    update_cache(filename, column_names(station))
+    update_rollups(filename, column_names(station))
+    shutil.rmtree(staging_dir(filename))
+
+
+def run_chunks(jobs, workers):
+    """
+    Process the chunk jobs, workers at a time. Returns a dict mapping
+    the path of each chunk that failed to its error.
+    """
+    errors = {}
+    started = time.time()
+    if workers > 1:
+        # Not forked, for the same reason as process_stations' pool.
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('forkserver')) \
+                as pool:
+            futures = dict((pool.submit(backfill_chunk, job), job)
+                           for job in jobs)
+            results = ((futures[f], f.result()) for f in as_completed(futures))
+            for n, (job, error) in enumerate(results, 1):
+                print('%d/%d chunks done (%.0fs)' % (
+                    n, len(jobs), time.time() - started))
+                if error:
+                    errors[job['path']] = error
+    else:
+        for n, job in enumerate(jobs, 1):
+            error = backfill_chunk(job)
+            print('%d/%d chunks done (%.0fs)' % (
+                n, len(jobs), time.time() - started))
+            if error:
+                errors[job['path']] = error
+    return errors
+
+
+def backfill(filenames=None, start_dt=None, end_dt=None, workers=None,
+             chunk_days=None, base=None):
+    """
+    Backfill the stations named in filenames (all of them by default)
+    from start_dt through end_dt. Returns a dict mapping the filename
+    of each station that couldn't be backfilled to the error.
+    """
+    stations = [s for s in STATIONS
+                if filenames is None or s['filename'] in filenames]
+    workers = workers or BACKFILL_WORKERS or os.cpu_count()
+    start = start_dt.strftime(TIME_FMT) if start_dt else None
+    end = end_dt.strftime(TIME_FMT) if end_dt else None
+
+    errors = {}
+    plans = {}
+    for station in stations:
+        try:
+            plans[station['filename']] = plan_chunks(
+                station, start_dt, end_dt,
+                chunk_days or BACKFILL_CHUNK_DAYS, base)
+        except IOError as e:
+            errors[station['filename']] = str(e)
+        os.makedirs(staging_dir(station['filename']), exist_ok=True)
+
+    jobs = [job for plan in plans.values() for job in plan
+            if load_chunk(job) is None]
+    print('%d chunks to process, in %d workers' % (len(jobs), workers))
+    failed = run_chunks(jobs, workers)
+
+    for station in stations:
+        plan = plans.get(station['filename'])
+        if not plan:
+            continue
+        chunk_errors = [failed[job['path']] for job in plan
+                        if job['path'] in failed]
+        if chunk_errors:
+            errors[station['filename']] = '\n'.join(chunk_errors)
+            continue
+        assemble(station, plan, start, end)
+        print('Backfilled %s' % station['filename'])
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--start', type=timestamp)
+    parser.add_argument('--end', type=timestamp)
+    parser.add_argument('--station', action='append', dest='stations',
+                        help='a station filename, e.g. Lowland.csv')
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args(argv)
+
+    errors = backfill(args.stations, args.start, args.end, args.workers)
+    for filename, error in sorted(errors.items()):
+        print('Failed to backfill %s:\n%s' % (filename, error))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+A content-addressed store for the files in the hourly data directories.
+
+Each distinct file content is kept once, under BLOB_STORE_DIR, named
+by its SHA-256. The files in the hourly directories are hard links to
+those blobs, so an hour where nothing changed costs directory entries
+rather than another copy of every CSV and PNG.
+
+A blob's link count says how many hourly directories still refer to
+it, so once the purge has removed the old directories,
+collect_garbage removes the blobs with no links left but the store's
+own.
+
+BLOB_STORE_DIR has to be on the same filesystem as
+LOCAL_DIRECTORY_BASE, and outside of it. Set it to None to store every
+file in full.
+"""
+from __future__ import print_function
+
+import hashlib
+import os
+import os.path
+
+try:
+    from local_settings import BLOB_STORE_DIR
+except ImportError:
+    from example_settings import BLOB_STORE_DIR
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def blob_path(digest, store_dir=None):
+    return os.path.join(store_dir or BLOB_STORE_DIR, digest[:2], digest)
+
+
+def store_file(path, store_dir=None):
+    """
+    Put the content of path in the store, and make path a hard link to
+    the stored blob.
+
+    If the content is already stored, path is replaced with a link to
+    the existing blob, freeing its copy. Returns True if the content
+    was new.
+    """
+    blob = blob_path(file_digest(path), store_dir)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    try:
+        os.link(path, blob)
+        return True
+    except FileExistsError:
+        pass
+
+    if not os.path.samefile(blob, path):
+        tmp_path = path + '.blob'
+        os.link(blob, tmp_path)
+        os.replace(tmp_path, path)
+    return False
+
+
+def collect_garbage(store_dir=None):
+    """
+    Remove the blobs that no file outside the store links to anymore.
+
+    Returns (blobs removed, bytes freed).
+    """
+    store_dir = store_dir or BLOB_STORE_DIR
+    removed = freed = 0
+    for dirpath, dirnames, filenames in os.walk(store_dir):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            st = os.stat(path)
+            if st.st_nlink == 1:
+                os.remove(path)
+                removed += 1
+                freed += st.st_size
+    return removed, freed
@@ -0,0 +1,243 @@
+"""
+A binary, memory-mapped column cache of the processed station files.
+
+Reading a processed CSV means parsing text and converting floats all
+over again. So next to each processed file, e.g. Lowland.csv, we keep
+Lowland.csv.columns/ with
+
+  header.json   the column names, the number of rows, and how far
+                into the CSV the cache goes
+  timestamps    the row timestamps, as int64 seconds since the epoch
+  column_N      column N (counting from 1, after the timestamp), as
+                float64. Cells that aren't numbers are NaN.
+
+in native byte order. The arrays only ever grow at the end:
+update_cache appends the rows added to the CSV since the last run,
+then records the new row count in header.json, which is what readers
+go by. If the CSV was rewritten, the cache is rebuilt.
+
+ColumnCache maps the arrays into memory, so opening even a multi-year
+cache costs next to nothing, and slicing a column is zero-copy:
+
+    with ColumnCache('Lowland.csv') as cache:
+        lo, hi = cache.time_range(start_dt, end_dt)
+        temps = cache.column('AvgTEMP_C')[lo:hi]
+
+The columns are memoryviews of doubles. With numpy,
+numpy.frombuffer(column) gives an array over the same memory.
+"""
+from __future__ import print_function
+
+import array
+import bisect
+import csv
+import functools
+import json
+import math
+import mmap
+import os
+import os.path
+import shutil
+from datetime import datetime
+
+from blackrock_data_processor import (
+    checkpoint_matches, complete_lines, parse_timestamp, raw_timestamp,
+    save_json
+)
+
+try:
+    from local_settings import PROCESSED_DATA_DIR
+except ImportError:
+    from example_settings import PROCESSED_DATA_DIR
+
+EPOCH = datetime(1970, 1, 1)
+# Rows are appended to the arrays this many at a time.
+BATCH_SIZE = 10000
+
+
+def cache_dir(filename):
+    return os.path.join(PROCESSED_DATA_DIR, filename + '.columns')
+
+
+def load_header(filename):
+    try:
+        with open(os.path.join(cache_dir(filename), 'header.json')) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def save_header(filename, header):
+    save_json(os.path.join(cache_dir(filename), 'header.json'), header)
+
+
+def array_files(header):
+    return ['timestamps'] + [
+        'column_%d' % i for i in range(1, len(header['names']) + 1)]
+
+
+def to_seconds(dt):
+    return int((dt - EPOCH).total_seconds())
+
+
+@functools.lru_cache(maxsize=64)
+def day_seconds(day):
+    return to_seconds(parse_timestamp(day + ' 00:00:00'))
+
+
+def timestamp_seconds(value):
+    """to_seconds of a timestamp in TIME_FMT, a day at a time."""
+    return (day_seconds(value[:10]) + int(value[11:13]) * 3600 +
+            int(value[14:16]) * 60 + int(value[17:19]))
+
+
+def to_float(value):
+    return value if value.__class__ is float else math.nan
+
+
+def read_new_rows(filename, header):
+    """
+    Yields the data rows of the processed file after the header's
+    offset, updating its position as they're consumed. Sets the
+    column names from the CSV header, if it has one.
+    """
+    lines = []
+
+    def decoded_lines(f):
+        for line_start, line in complete_lines(f, header['offset']):
+            lines.append((line_start, line))
+            yield line.decode('utf-8')
+
+    with open(os.path.join(PROCESSED_DATA_DIR, filename), 'rb') as f:
+        # One reader for all the lines, which is much faster than one
+        # per line. It reads a line for each row, so we can tell where
+        # each row starts.
+        for row in csv.reader(decoded_lines(f),
+                              quoting=csv.QUOTE_NONNUMERIC):
+            line_start, line = lines.pop()
+            header['offset'] = line_start + len(line)
+            if raw_timestamp(line) is not None:
+                header['line_start'] = line_start
+                header['timestamp'] = row[0]
+                yield row
+            elif row and line_start == 0:
+                header['names'] = row[1:]
+
+
+def append_batch(filename, header, batch, names=None):
+    """
+    Append a batch of rows to the arrays. names are the column names to
+    use if the CSV has no header.
+    """
+    if header['names'] is None:
+        header['names'] = names or [
+            'COLUMN_%d' % i for i in range(1, len(batch[0]))]
+    columns = [array.array('q', [
+        timestamp_seconds(row[0]) for row in batch])]
+    for i in range(1, len(header['names']) + 1):
+        columns.append(array.array('d', [to_float(row[i]) for row in batch]))
+
+    for name, values in zip(array_files(header), columns):
+        path = os.path.join(cache_dir(filename), name)
+        with open(path, 'ab') as f:
+            # Drop anything an interrupted run appended.
+            f.truncate(header['rows'] * values.itemsize)
+            values.tofile(f)
+
+
+def update_cache(filename, names=None):
+    """
+    Append the rows added to a processed file since the last run to
+    its column cache, or rebuild the cache if the file was rewritten.
+    names are the column names (after the timestamp) to use if the file
+    has no header.
+    """
+    header = load_header(filename)
+    with open(os.path.join(PROCESSED_DATA_DIR, filename), 'rb') as f:
+        if header and not checkpoint_matches(f, header):
+            print('%s was rewritten, rebuilding its column cache' % (
+                filename))
+            header = None
+    if header is None:
+        shutil.rmtree(cache_dir(filename), ignore_errors=True)
+        os.makedirs(cache_dir(filename))
+        header = {'names': None, 'rows': 0, 'line_start': None,
+                  'offset': 0, 'timestamp': None}
+
+    batch = []
+    for row in read_new_rows(filename, header):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            append_batch(filename, header, batch, names)
+            header['rows'] += len(batch)
+            batch = []
+    if batch:
+        append_batch(filename, header, batch, names)
+        header['rows'] += len(batch)
+    save_header(filename, header)
+
+
+class ColumnCache(object):
+    """
+    The column cache of a processed file, mapped into memory.
+
+    names are the column names, timestamps a memoryview of int64
+    seconds since the epoch, and column(name) a memoryview of that
+    column's doubles.
+    """
+
+    def __init__(self, filename):
+        self.header = load_header(filename)
+        if self.header is None:
+            raise IOError('%s has no column cache' % filename)
+        self.names = self.header['names'] or []
+        self.rows = self.header['rows']
+        self.maps = []
+        self.arrays = {}
+        for name, fmt in zip(array_files(self.header),
+                             ['q'] + ['d'] * len(self.names)):
+            self.arrays[name] = self.map(
+                os.path.join(cache_dir(filename), name), fmt)
+        self.timestamps = self.arrays['timestamps']
+
+    def map(self, path, fmt):
+        if not self.rows:
+            return memoryview(array.array(fmt))
+        with open(path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), self.rows * 8, access=mmap.ACCESS_READ)
+        self.maps.append(m)
+        return memoryview(m).cast(fmt)
+
+    def column(self, name):
+        return self.arrays['column_%d' % (self.names.index(name) + 1)]
+
+    def time_range(self, start_dt=None, end_dt=None):
+        """
+        Returns the (start, stop) indices of the rows from start_dt to
+        end_dt, inclusive.
+        """
+        lo, hi = 0, self.rows
+        if start_dt is not None:
+            lo = bisect.bisect_left(self.timestamps, to_seconds(start_dt))
+        if end_dt is not None:
+            hi = bisect.bisect_right(self.timestamps, to_seconds(end_dt))
+        return lo, max(lo, hi)
+
+    def close(self):
+        """
+        Unmap the arrays. A mapping that slices taken from the columns
+        still point into stays open until they're gone.
+        """
+        for view in self.arrays.values():
+            view.release()
+        for m in self.maps:
+            try:
+                m.close()
+            except BufferError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
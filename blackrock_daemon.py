@@ -0,0 +1,135 @@
+#!ve/bin/python
+"""
+Long-running replacement for the fetcher cron jobs.
+===================================================
+blackrock_daemon.py
+
+Started from cron, the webcam fetcher pays for interpreter startup,
+the Google client imports, reading the token and building the Drive
+service every minute, just to download one photo. This runs both
+fetchers from one process instead: it authenticates once, keeps the
+webcam's Drive service warm, and runs
+
+  * blackrock_photo_fetcher every DAEMON_PHOTO_INTERVAL seconds, and
+  * blackrock_data_fetcher (fetching and processing) every
+    DAEMON_DATA_INTERVAL seconds
+
+on the interval boundaries. If a job is still running when its next
+turn comes up, that turn is skipped. Send SIGTERM (or ^C) to stop; the
+daemon waits for running jobs to finish and exits cleanly.
+"""
+from __future__ import print_function
+
+import copy
+import sys
+import signal
+import threading
+import time
+import traceback
+
+from googleapiclient.discovery import build
+
+import blackrock_data_fetcher
+import blackrock_photo_fetcher
+
+try:
+    from local_settings import (
+        DAEMON_PHOTO_INTERVAL, DAEMON_DATA_INTERVAL, DEBUG,
+    )
+except ImportError:
+    from example_settings import (
+        DAEMON_PHOTO_INTERVAL, DAEMON_DATA_INTERVAL, DEBUG,
+    )
+
+
+def next_boundary(now, interval):
+    """Returns the first multiple of interval after now."""
+    return (now // interval + 1) * interval
+
+
+class Job(object):
+    """A function that's run every interval seconds, never overlapping."""
+
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.lock = threading.Lock()
+        self.next_run = next_boundary(time.time(), interval)
+
+    def start(self):
+        """
+        Start a run of the job in a new thread, unless the last one is
+        still going. Returns the thread, or None if the run was skipped.
+        """
+        while self.next_run <= time.time():
+            self.next_run += self.interval
+
+        if not self.lock.acquire(False):
+            print('%s is still running, skipping this run' % self.name)
+            return None
+
+        thread = threading.Thread(target=self.run, name=self.name)
+        thread.start()
+        return thread
+
+    def run(self):
+        started = time.time()
+        try:
+            self.func()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.lock.release()
+        if DEBUG:
+            print('%s took %.2fs' % (self.name, time.time() - started))
+
+
+def run_scheduler(jobs, stop):
+    """
+    Run the jobs on schedule until the stop event is set, then wait for
+    any running jobs to finish.
+    """
+    threads = []
+    while not stop.is_set():
+        job = min(jobs, key=lambda j: j.next_run)
+        if stop.wait(max(0, job.next_run - time.time())):
+            break
+        thread = job.start()
+        threads = [t for t in threads if t.is_alive()]
+        if thread is not None:
+            threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+
+def main(argv=None):
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        print('Got signal %d, stopping.' % signum)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    # The jobs run in threads of their own, and neither the credentials
+    # (which refresh themselves) nor the service's HTTP client are
+    # thread-safe, so each job gets its own copy.
+    creds = blackrock_data_fetcher.get_credentials()
+    photo_service = build('drive', 'v3', credentials=creds)
+    data_creds = copy.copy(creds)
+
+    jobs = [
+        Job('photo fetch', DAEMON_PHOTO_INTERVAL,
+            lambda: blackrock_photo_fetcher.main(service=photo_service)),
+        Job('data fetch', DAEMON_DATA_INTERVAL,
+            lambda: blackrock_data_fetcher.main(creds=data_creds)),
+    ]
+    run_scheduler(jobs, stop)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,36 +20,55 @@ Modified: 2022_06_28, Evan Petersen, CTL
 from __future__ import print_function
 
 import sys
-import io
+import contextvars
+import copy
 import os
 import os.path
+import json
+import shutil
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseDownload
 
-from blackrock_data_processor import (
-    process_dendrometer_data, process_environmental_data,
-    apply_formula_to_processed_dendrometer_data
-)
+import blackrock_metrics
+from blackrock_blobstore import store_file
+from blackrock_data_processor import save_json
+from blackrock_download import download_to_file
+from blackrock_freshness import record_fetched, record_published
+from blackrock_retention import purge_all
+from blackrock_scheduler import call, run_deadline
+from blackrock_drive import build_query, list_files
+from blackrock_stations import STATIONS, process_stations
 
 try:
     from local_settings import (
         SCOPES, DIR_MIMETYPE, ACCEPTED_FILETYPES,
         OL_EXPECTED_FILES_SET, RT_EXPECTED_FILES_SET,
-        LOCAL_DIRECTORY_BASE, PURGE_OLDER_THAN, DEBUG,
+        LOCAL_DIRECTORY_BASE, DEBUG,
         ACCESS_DIR,
+        FETCH_MANIFEST, TAIL_FETCH_FILETYPES, DOWNLOAD_CHUNK_SIZE,
+        FETCH_WORKERS, DRIVE_PAGE_SIZE,
+        BLOB_STORE_DIR, DATA_RUN_DEADLINE,
     )
 except ImportError:
     from example_settings import (
         SCOPES, DIR_MIMETYPE, ACCEPTED_FILETYPES,
         OL_EXPECTED_FILES_SET, RT_EXPECTED_FILES_SET,
-        LOCAL_DIRECTORY_BASE, PURGE_OLDER_THAN, DEBUG,
+        LOCAL_DIRECTORY_BASE, DEBUG,
         ACCESS_DIR,
+        FETCH_MANIFEST, TAIL_FETCH_FILETYPES, DOWNLOAD_CHUNK_SIZE,
+        FETCH_WORKERS, DRIVE_PAGE_SIZE,
+        BLOB_STORE_DIR, DATA_RUN_DEADLINE,
     )
 
 
@@ -95,97 +114,341 @@ def check_format(filename):
     return False
 
 
+def load_manifest():
+    """
+    Returns the manifest of previously fetched files, keyed by name.
+    Each entry has the Drive id, size, md5Checksum and modifiedTime of
+    the file as it was fetched, and the local path it was saved to.
+    """
+    try:
+        with open(FETCH_MANIFEST, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_manifest(manifest):
+    save_json(FETCH_MANIFEST, manifest, indent=1, sort_keys=True)
+
+
+def record_fetch(manifest, file_metadata, local_dir):
+    """
+    Add a file to the manifest if it was downloaded completely.
+    Returns False if it wasn't.
+    """
+    path = os.path.join(local_dir, file_metadata['name'])
+    if not os.path.exists(path) or \
+            os.path.getsize(path) != int(file_metadata.get('size', -1)):
+        manifest.pop(file_metadata['name'], None)
+        return False
+    manifest[file_metadata['name']] = {
+        'id': file_metadata['id'],
+        'size': int(file_metadata['size']),
+        'md5Checksum': file_metadata.get('md5Checksum'),
+        'modifiedTime': file_metadata.get('modifiedTime'),
+        'path': os.path.abspath(path),
+    }
+    return True
+
+
+def md5sum(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def is_append_only(filename):
+    return any(filename.endswith(t) for t in TAIL_FETCH_FILETYPES)
+
+
+def can_tail_fetch(file_metadata, previous):
+    """
+    Returns True if file_metadata looks like previous with more data
+    appended, and the previous local copy is still intact.
+    """
+    if not previous or previous['id'] != file_metadata['id']:
+        return False
+    path = previous['path']
+    return (os.path.exists(path) and
+            os.path.getsize(path) == previous['size'] and
+            int(file_metadata.get('size', -1)) >= previous['size'])
+
+
+def tail_fetch_file(service, file_metadata, local_dir, previous):
+    """
+    Build the local copy of an append-only file from the previous
+    download plus only the bytes added since, fetched with an HTTP
+    Range request.
+
+    The result is checked against the Drive md5Checksum. Returns
+    False if the remote file was truncated or rewritten, in which case
+    the caller should do a full download instead.
+    """
+    if not can_tail_fetch(file_metadata, previous):
+        return False
+
+    local_path = os.path.join(local_dir, file_metadata['name'])
+    partial_path = local_path + '.part'
+    shutil.copyfile(previous['path'], partial_path)
+
+    try:
+        if int(file_metadata['size']) > previous['size']:
+            request = service.files().get_media(fileId=file_metadata['id'])
+            request.headers['Range'] = 'bytes=%d-' % previous['size']
+            with open(partial_path, 'ab') as f:
+                f.write(call(request.execute, 'tail'))
+    except HttpError as error:
+        print(f'An error occurred: {error}')
+
+    if md5sum(partial_path) != file_metadata.get('md5Checksum'):
+        os.remove(partial_path)
+        return False
+
+    os.replace(partial_path, local_path)
+    if DEBUG:
+        print('%s (tail fetched from byte %d)' % (
+            file_metadata['name'], previous['size']))
+    return True
+
+
 def copy_file_to_dir(service, file_metadata, local_dir):
     try:
         request = service.files().get_media(fileId=file_metadata['id'])
-        to_download = io.BytesIO()
-        downloader = MediaIoBaseDownload(to_download, request)
-        done = False
-        while done is False:
-            try:
-                status, done = downloader.next_chunk()
-                if DEBUG:
-                    print(file_metadata['name'])
-                    open(F"{local_dir}/{file_metadata['name']}",
-                         'wb').write(to_download.getvalue())
-            except UnicodeDecodeError as error:
-                print(F"Corrupted File - {file_metadata['name']}  - {error}")
-                done = False
+        if DEBUG:
+            print(file_metadata['name'])
+        download_to_file(
+            request, os.path.join(local_dir, file_metadata['name']),
+            chunksize=DOWNLOAD_CHUNK_SIZE)
     except HttpError as error:
         print(f'An error occurred: {error}')
-        to_download = None
 
 
-def fetch_files(local_dir):
-    creds = get_credentials()
+thread_local = threading.local()
+
+
+def get_thread_service(creds):
+    """
+    Returns a Drive service for the current thread.
+
+    Neither the httplib2 transport behind build() nor the credentials
+    (which refresh themselves) are thread-safe, so each download worker
+    gets its own authorized HTTP client with its own copy of creds.
+    """
+    service = getattr(thread_local, 'service', None)
+    if service is None:
+        http = AuthorizedHttp(copy.copy(creds), http=httplib2.Http())
+        service = build('drive', 'v3', http=http)
+        thread_local.service = service
+    return service
+
+
+def is_unchanged(file_metadata, previous):
+    """
+    Returns True if the manifest entry previous describes the same
+    content as file_metadata, and the local copy is still there.
+    """
+    if not previous:
+        return False
+    return (previous['id'] == file_metadata['id'] and
+            previous['size'] == int(file_metadata.get('size', -1)) and
+            previous['md5Checksum'] == file_metadata.get('md5Checksum') and
+            previous['modifiedTime'] == file_metadata.get('modifiedTime') and
+            os.path.exists(previous['path']) and
+            os.path.getsize(previous['path']) == previous['size'])
+
+
+def link_unchanged_file(file_metadata, local_dir, previous):
+    """
+    Hard-link the previous copy of an unchanged file into local_dir.
+    Returns False if the link couldn't be made.
+    """
+    local_path = os.path.abspath(
+        os.path.join(local_dir, file_metadata['name']))
+    if local_path == previous['path']:
+        return True
+    try:
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        os.link(previous['path'], local_path)
+    except OSError as error:
+        print('couldn\'t link %s: %s' % (local_path, error))
+        return False
+    if DEBUG:
+        print('%s (unchanged)' % file_metadata['name'])
+    return True
+
+
+def fetch_file(service, file_metadata, local_dir, previous):
+    """
+    Get one file into local_dir, linking it from the previous run if
+    it hasn't changed, and fetching only the new bytes of append-only
+    files where possible.
+
+    Returns how it was fetched: 'unchanged', 'tail' or 'full'.
+    """
+    if is_unchanged(file_metadata, previous) and \
+            link_unchanged_file(file_metadata, local_dir, previous):
+        return 'unchanged'
+    if is_append_only(file_metadata['name']) and \
+            tail_fetch_file(service, file_metadata, local_dir, previous):
+        return 'tail'
+    copy_file_to_dir(service, file_metadata, local_dir)
+    return 'full'
+
+
+def fetch_worker(creds, file_metadata, local_dir, previous):
+    """
+    Runs fetch_file in a download worker thread, and puts what was
+    downloaded in the blob store.
+    Returns (how it was fetched, error, seconds taken), where error is
+    None on success.
+    """
+    started = time.time()
+    method = error = None
+    try:
+        service = get_thread_service(creds)
+        method = fetch_file(service, file_metadata, local_dir, previous)
+        # Unchanged files are already linked to their blob.
+        if BLOB_STORE_DIR and method != 'unchanged':
+            store_file(os.path.join(local_dir, file_metadata['name']))
+    except Exception as e:
+        error = e
+    return method, error, time.time() - started
+
+
+def bytes_skipped(method, previous):
+    """Returns how many bytes we didn't download thanks to the manifest."""
+    if method in ('unchanged', 'tail'):
+        return previous['size']
+    return 0
+
+
+def fetch_all(creds, items, local_dir, manifest):
+    """
+    Download items into local_dir with FETCH_WORKERS parallel workers,
+    recording each completed download in the manifest.
+
+    Returns a dict mapping the name of each file that failed to its
+    error. That includes files that were downloaded but couldn't be
+    put in the blob store; those are still recorded in the manifest.
+    """
+    started = time.time()
+    serial_time = 0
+    skipped = {'requests': 0, 'bytes': 0}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        # Each worker runs in a copy of our context, so what it does
+        # is recorded in this run's metrics.
+        futures = dict(
+            (pool.submit(contextvars.copy_context().run, fetch_worker,
+                         creds, item, local_dir,
+                         manifest.get(item['name'])), item)
+            for item in items)
+        for future in as_completed(futures):
+            item = futures[future]
+            method, error, elapsed = future.result()
+            serial_time += elapsed
+            skipped['requests'] += method == 'unchanged'
+            previous_bytes = bytes_skipped(method, manifest.get(item['name']))
+            skipped['bytes'] += previous_bytes
+            if not record_fetch(manifest, item, local_dir):
+                errors[item['name']] = error or 'incomplete download'
+                continue
+            if error is not None:
+                # Downloaded, but store_file failed.
+                errors[item['name']] = error
+            blackrock_metrics.count('files_fetched', method=method)
+            blackrock_metrics.count(
+                'bytes_downloaded', int(item['size']) - previous_bytes,
+                file=item['name'])
+
+    print('Fetched %d files in %.2fs with %d workers '
+          '(%.2fs if fetched one at a time)' % (
+              len(items), time.time() - started, FETCH_WORKERS,
+              serial_time))
+    print('Skipped %(requests)d requests and %(bytes)d bytes of '
+          'unchanged data' % skipped)
+    blackrock_metrics.count('requests_skipped', skipped['requests'])
+    blackrock_metrics.count('bytes_skipped', skipped['bytes'])
+    return errors
+
+
+def fetch_files(local_dir, creds=None):
+    if creds is None:
+        with blackrock_metrics.stage('auth'):
+            creds = get_credentials()
     try:
         service = build('drive', 'v3', credentials=creds)
-        # Call the Drive v3 API
-        results = service.files().list(
-            fields="nextPageToken, files(id, name, mimeType)").execute()
-        items = results.get('files', [])
+        # Call the Drive v3 API. The files are picked by their extension
+        # (see check_format), as Drive doesn't report the same mimetype
+        # for every CSV.
+        with blackrock_metrics.stage('list'):
+            items = list_files(
+                service, build_query(exclude_mimetype=DIR_MIMETYPE),
+                fields='id, name, mimeType, size, md5Checksum, modifiedTime',
+                page_size=DRIVE_PAGE_SIZE)
         if not items:
             if DEBUG:
                 print('No files found.')
             return None
         if DEBUG:
             print('Files:')
-        for item in items:
-            if item['mimeType'] != DIR_MIMETYPE and check_format(item['name']):
-                copy_file_to_dir(service, item, local_dir)
+        items = [item for item in items
+                 if item['mimeType'] != DIR_MIMETYPE and
+                 check_format(item['name'])]
+        manifest = load_manifest()
+        with blackrock_metrics.stage('download'):
+            errors = fetch_all(creds, items, local_dir, manifest)
+        save_manifest(manifest)
+        for name, error in sorted(errors.items()):
+            print('Failed to fetch %s: %s' % (name, error))
     except HttpError as error:
         print(f'An error occurred: {error}')
 
 
-def main(argv=None):
-    # import pdb; pdb.set_trace()
+def check_expected_files(listdir):
+    """Raise an exception if any of the expected files are missing."""
+    if not (set(listdir).issuperset(OL_EXPECTED_FILES_SET)):
+        err = "Data fetching error: Some expected files not found at %s" % (
+            OL_EXPECTED_FILES_SET - set(listdir))
+        raise Exception(err)
+    if not (set(listdir).issuperset(RT_EXPECTED_FILES_SET)):
+        err = "Data fetching error: Some expected files not found at %s" % (
+            RT_EXPECTED_FILES_SET - set(listdir))
+        raise Exception(err)
+
+
+def fetch_data(creds=None):
+    """
+    Fetch the files into this hour's directory, process them, and
+    point 'current' at the directory if everything is there.
+    """
     today = datetime.today()
 
     local_dir = create_local_directories(today)
 
-    fetch_files(local_dir)
-
-    process_dendrometer_data(local_dir, 'Mnt_Misery_Table20.csv')
-    apply_formula_to_processed_dendrometer_data(
-        'Mnt_Misery_Table20.csv',
-        # The DBH (diameter at breast height) for each of these
-        # trees on October 7th, 2016 at 2pm.
-        # Unit is centimeters.
-        [48.0, 40.1, 42.1, 46.0, 42.4],
-        # The dendrometer voltages at that same time.
-        [20.9, 19.23, 20.93, 316.5, 120.9])
-
-    process_dendrometer_data(local_dir, 'White_Oak_Table20.csv',
-                             rename_trees='White_Oak')
-    apply_formula_to_processed_dendrometer_data(
-        'White_Oak_Table20.csv',
-        # The DBH (diameter at breast height) for each of these
-        # trees on October 7th, 2016 at 2pm.
-        # Unit is centimeters.
-        [32.1, 33.3, 46.7, 30.0, 26.7],
-        # The dendrometer voltages at that same time.
-        [160.8, 71.33, 100.4, 277.4, 456.6])
-
-    process_dendrometer_data(local_dir, 'Mailley\'s_Mill_Table20Min.csv')
-    process_environmental_data(local_dir, 'Lowland.csv',
-                               start_dt=datetime(2016, 9, 10, 17))
+    fetch_files(local_dir, creds)
+    filenames = [station['filename'] for station in STATIONS]
+    record_fetched(local_dir, filenames)
+
+    with blackrock_metrics.stage('process'):
+        errors = process_stations(local_dir)
 
     listdir = os.listdir(local_dir)
 
     if DEBUG:
         print("listdir: %s" % listdir)
 
-    # confirm that we downloaded all the files we are expecting.
-    # throw an error and bail (making sure not to relink the 'current'
-    # symlink if things aren't as expected
-    if not (set(listdir).issuperset(OL_EXPECTED_FILES_SET)):
-        err = "Data fetching error: Some expected files not found at %s" % (
-            OL_EXPECTED_FILES_SET - set(listdir))
-        raise Exception(err)
-    if not (set(listdir).issuperset(RT_EXPECTED_FILES_SET)):
-        err = "Data fetching error: Some expected files not found at %s" % (
-            RT_EXPECTED_FILES_SET - set(listdir))
-        raise Exception(err)
+    # confirm that we downloaded all the files we are expecting, and
+    # processed them. throw an error and bail (making sure not to relink
+    # the 'current' symlink if things aren't as expected
+    check_expected_files(listdir)
+    if errors:
+        raise Exception('Data processing error: %s failed\n%s' % (
+            ', '.join(sorted(errors)),
+            '\n'.join(errors[name] for name in sorted(errors))))
 
     # make sure all the images are world readable
     for f in listdir:
@@ -202,15 +465,22 @@ def main(argv=None):
         os.symlink(local_dir, symlink)
     except OSError:
         print('couldn\'t make symlink: %s' % symlink)
+    else:
+        # Only once the data is actually being served.
+        record_published(filenames)
 
-    # purge downloads older than PURGE_OLDER_THAN
-    cmd = "find %s -type f -mtime %s -exec rm -f {} \;" % (
-        LOCAL_DIRECTORY_BASE, PURGE_OLDER_THAN)
     if DEBUG:
         print("Fetched.")
-        print(cmd)
 
-    os.system(cmd)
+    with blackrock_metrics.stage('purge'):
+        purge_all()
+
+
+def main(argv=None, creds=None):
+    # import pdb; pdb.set_trace()
+    with blackrock_metrics.recording('data'), \
+            run_deadline(DATA_RUN_DEADLINE):
+        fetch_data(creds)
 
 
 if __name__ == "__main__":
@@ -1,27 +1,148 @@
 import csv
+import io
+import itertools
+import json
 import math
+import os
 import os.path
 from datetime import datetime
 
+from blackrock_metrics import count, counted, timed
+
 try:
-    from local_settings import PROCESSED_DATA_DIR, LOCAL_DIRECTORY_BASE
+    from local_settings import (
+        PROCESSED_DATA_DIR, LOCAL_DIRECTORY_BASE, PROCESSING_BACKEND,
+    )
 except ImportError:
-    from example_settings import PROCESSED_DATA_DIR, LOCAL_DIRECTORY_BASE
+    from example_settings import (
+        PROCESSED_DATA_DIR, LOCAL_DIRECTORY_BASE, PROCESSING_BACKEND,
+    )
+
+TIME_FMT = '%Y-%m-%d %H:%M:%S'
+
+#
+# The incoming dendrometer CSV's header row looks like this:
+#   "TIMESTAMP", "RECORD", "Battery_Volt_MIN", "ProgSig",
+#   "Red_Oak_1_AVG", "Red_Oak_1_MAX", "Red_Oak_1_MIN", "Red_Oak_1_STD",
+#   "Red_Oak_2_AVG", "Red_Oak_2_MAX", "Red_Oak_2_MIN", "Red_Oak_2_STD",
+#   "Red_Oak_3_AVG", "Red_Oak_3_MAX", "Red_Oak_3_MIN", "Red_Oak_3_STD",
+#   "Red_Oak_4_AVG", "Red_Oak_4_MAX", "Red_Oak_4_MIN", "Red_Oak_4_STD",
+#   "Red_Oak_5_AVG", "Red_Oak_5_MAX", "Red_Oak_5_MIN", "Red_Oak_5_STD"
+#
+# Here are the columns we want to filter to:
+DENDROMETER_COLUMNS = [
+    'TIMESTAMP',
+
+    'Red_Oak_1_AVG', 'Red_Oak_2_AVG', 'Red_Oak_3_AVG',
+    'Red_Oak_4_AVG', 'Red_Oak_5_AVG',
+
+    # Mailley's Mill
+    'Hemlock_1_AVG', 'Hemlock_2_AVG', 'Hemlock_3_AVG',
+    'Pine_1_AVG', 'Pine_2_AVG', 'Pine_3_AVG',
+]
+
+#
+# The incoming environmental CSV's header row looks like this:
+# "TIMESTAMP", "RECORD", "AvgTEMP_C", "MinTEMP_C", "MaxTEMP_C",
+# "AvgRh", "MaxRh", "MinRh", "AvgVP", "AvgDewPt", "TotalPAR",
+# "AvgGSR", "AvgWspd", "AvgWdir", "StdDevWdir", "MaxWspd",
+# "TotalRain", "AvgBP", "MaxBP", "MinBp", "AvgST_10", "AvgST_100",
+# "MinBatt", "AvgCO2", "AvgOzone", "DSTEMPF", "DSDEPTH", "DSRETRIES",
+# "SoilM_5cm", "SoilM_15cm", "UVB", "UVTEMP", "UVA", "V2mV", "V2mV2",
+# "Snow1_BATT", "Snow1_PNLTMP", "CM3_up", "CM3_dn", "CG3_up",
+#  "CG3_dn", "CM_TempC", "CM3_TempK", "Net_Rs", "Net_R1", "Albedo",
+# "Up_Total", "Dn_Total", "Net_Total", "AvgPAR_Den", "MaxPAR_Den",
+# "MinPAR_Den"
+#
+# Here are the columns we want to filter to:
+ENVIRONMENTAL_COLUMNS = [
+    'TIMESTAMP', 'AvgTEMP_C', 'AvgVP', 'TotalRain',
+    'SoilM_5cm', 'AvgPAR_Den'
+]
+
+
+class RunningStats(object):
+    """
+    The count, mean, (population) variance, min and max of a stream of
+    numbers, in one pass and constant memory.
+
+    The variance uses Welford's algorithm, and two RunningStats over
+    different numbers can be merged into the stats of all of them, so
+    partitions of the data can be summarized separately. The mean is
+    the plain running total over the count, so it's the same to the
+    last bit as summing the numbers in order.
+    """
+    __slots__ = ('count', 'total', 'running_mean', 'm2', 'lo', 'hi')
+
+    def __init__(self, values=()):
+        self.count = 0
+        self.total = 0.0
+        self.running_mean = 0.0
+        self.m2 = 0.0
+        self.lo = self.hi = None
+        for x in values:
+            self.update(x)
+
+    def update(self, x):
+        self.count += 1
+        self.total += x
+        delta = x - self.running_mean
+        self.running_mean += delta / self.count
+        self.m2 += delta * (x - self.running_mean)
+        if self.lo is None or x < self.lo:
+            self.lo = x
+        if self.hi is None or x > self.hi:
+            self.hi = x
+
+    def merge(self, other):
+        """Add the numbers summarized by other to these stats."""
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.running_mean - self.running_mean
+        self.running_mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.total += other.total
+        self.count = count
+        self.lo = other.lo if self.lo is None else min(self.lo, other.lo)
+        self.hi = other.hi if self.hi is None else max(self.hi, other.hi)
+
+    def mean(self):
+        return self.total / float(self.count)
+
+    def variance(self):
+        return self.m2 / float(self.count)
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+    def min(self):
+        return self.lo
+
+    def max(self):
+        return self.hi
+
+    def as_list(self):
+        """Returns the stats as a list, e.g. to save as JSON."""
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_list(cls, values):
+        stats = cls()
+        for name, value in zip(cls.__slots__, values):
+            setattr(stats, name, value)
+        return stats
 
 
 def calc_avg(a):
-    """Returns the average of the given list of numbers."""
+    """Returns the average of the given numbers."""
     a = list(map(float, a))
     return sum(a) / float(len(a))
 
 
 def calc_std_dev(a):
-    """Returns the standard deviation of the given list of numbers."""
-    mean = calc_avg(a)
-    distances = []
-    for e in a:
-        distances.append(abs(e - mean) ** 2)
-    return math.sqrt(sum(distances) / float(len(distances)))
+    """Returns the standard deviation of the given numbers."""
+    return RunningStats(map(float, a)).std()
 
 
 def calc_rdh_delta(old_dbh, old_v, current_v):
@@ -45,59 +166,89 @@ def calc_rdh_delta(old_dbh, old_v, current_v):
     return deltaR
 
 
-def filter_columns(keep_columns, rows):
-    """Filter CSV-style data based on a list of column names.
+def iter_filter_columns(keep_columns, rows):
+    """Lazily filter CSV-style rows based on a list of column names.
 
-    Returns a list of lists.
+    The first row is the header. Yields lists.
     """
-    newrows = []
-    keep_indices = []
+    rows = iter(rows)
+    for header in rows:
+        break
+    else:
+        return
 
     # Find the column indices to keep.
-    for i, name in enumerate(rows[0]):
-        if name in keep_columns:
-            keep_indices.append(i)
+    keep_indices = [i for i, name in enumerate(header)
+                    if name in keep_columns]
 
-    for i, row in enumerate(rows):
-        newrow = []
-        for keep_idx in keep_indices:
-            newrow.append(row[keep_idx])
-        newrows.append(newrow)
+    yield [header[keep_idx] for keep_idx in keep_indices]
+    for row in rows:
+        yield [row[keep_idx] for keep_idx in keep_indices]
 
-    return newrows
 
+def filter_columns(keep_columns, rows):
+    """Filter CSV-style data based on a list of column names.
 
-def filter_rows(rows, start_dt=None, end_dt=None,
-                time_fmt='%Y-%m-%d %H:%M:%S'):
-    """Return only rows in the given timeframe.
+    Returns a list of lists.
+    """
+    return list(iter_filter_columns(keep_columns, rows))
 
-    Assumes that the first column of each row is a timestamp of
-    the format time_fmt.
+
+def parse_timestamp(value, time_fmt=TIME_FMT):
     """
-    if start_dt is None and end_dt is None:
-        return rows
+    Same as datetime.strptime(value, time_fmt), with a fast path that
+    slices the fields out of timestamps in the loggers' TIME_FMT.
+    """
+    if time_fmt == TIME_FMT and len(value) == 19 and \
+            value[4] == value[7] == '-' and value[10] == ' ' and \
+            value[13] == value[16] == ':' and value.isascii():
+        fields = (value[0:4], value[5:7], value[8:10],
+                  value[11:13], value[14:16], value[17:19])
+        if ''.join(fields).isdigit():
+            return datetime(*map(int, fields))
+    return datetime.strptime(value, time_fmt)
+
+
+def iter_filter_rows(rows, start_dt=None, end_dt=None, time_fmt=TIME_FMT):
+    """Lazily yield only the rows in the given timeframe.
 
-    newrows = []
+    See filter_rows.
+    """
     for row in rows:
-        dt = row[0]
         try:
-            dt = datetime.strptime(dt, time_fmt)
+            dt = parse_timestamp(row[0], time_fmt)
         except ValueError:
-            newrows.append(row)
+            yield row
             continue
 
         test1 = start_dt is None or start_dt <= dt
         test2 = end_dt is None or end_dt >= dt
 
         if test1 and test2:
-            newrows.append(row)
+            yield row
 
-    return newrows
 
+def looks_like_timestamp(value):
+    """A quick check that value is shaped like a TIME_FMT timestamp."""
+    return value.__class__ is str and len(value) == 19 and \
+        value[10] == ' ' and value[13] == ':'
 
-def match_replace(rows, oldname, newname):
-    """Replace every instance of oldname with newname within the rows."""
-    newrows = []
+
+def filter_rows(rows, start_dt=None, end_dt=None, time_fmt=TIME_FMT):
+    """Return only rows in the given timeframe.
+
+    Assumes that the first column of each row is a timestamp of
+    the format time_fmt. Rows that don't start with a timestamp, like
+    the header, are kept.
+    """
+    if start_dt is None and end_dt is None:
+        return rows
+
+    return list(iter_filter_rows(rows, start_dt, end_dt, time_fmt))
+
+
+def iter_match_replace(rows, oldname, newname):
+    """Lazily replace every instance of oldname with newname."""
     for row in rows:
         newrow = []
         for cell in row:
@@ -106,54 +257,300 @@ def match_replace(rows, oldname, newname):
             except AttributeError:
                 pass
             newrow.append(cell)
-        newrows.append(newrow)
-    return newrows
+        yield newrow
 
 
-def process_dendrometer_data(path, filename, rename_trees=None):
-    fname = os.path.join(path, filename)
-    rows = []
-    with open(fname, 'r') as csvfile:
-        reader = csv.reader(csvfile, quoting=csv.QUOTE_NONNUMERIC)
-        for row in reader:
-            rows += [row]
-
-    # Remove blank rows
-    # The incoming CSV contains a few rows near the beginning that we don't
-    # want.
-    del rows[0]
-    del rows[1]
-    del rows[1]
-
-    #
-    # The incoming CSV's header row looks like this:
-    #   "TIMESTAMP", "RECORD", "Battery_Volt_MIN", "ProgSig",
-    #   "Red_Oak_1_AVG", "Red_Oak_1_MAX", "Red_Oak_1_MIN", "Red_Oak_1_STD",
-    #   "Red_Oak_2_AVG", "Red_Oak_2_MAX", "Red_Oak_2_MIN", "Red_Oak_2_STD",
-    #   "Red_Oak_3_AVG", "Red_Oak_3_MAX", "Red_Oak_3_MIN", "Red_Oak_3_STD",
-    #   "Red_Oak_4_AVG", "Red_Oak_4_MAX", "Red_Oak_4_MIN", "Red_Oak_4_STD",
-    #   "Red_Oak_5_AVG", "Red_Oak_5_MAX", "Red_Oak_5_MIN", "Red_Oak_5_STD"
-    #
-    # Here are the columns we want to filter to:
-    keep_columns = [
-        'TIMESTAMP',
-
-        'Red_Oak_1_AVG', 'Red_Oak_2_AVG', 'Red_Oak_3_AVG',
-        'Red_Oak_4_AVG', 'Red_Oak_5_AVG',
-
-        # Mailley's Mill
-        'Hemlock_1_AVG', 'Hemlock_2_AVG', 'Hemlock_3_AVG',
-        'Pine_1_AVG', 'Pine_2_AVG', 'Pine_3_AVG',
-    ]
-    newrows = filter_columns(keep_columns, rows)
+def match_replace(rows, oldname, newname):
+    """Replace every instance of oldname with newname within the rows."""
+    return list(iter_match_replace(rows, oldname, newname))
 
-    if rename_trees:
-        newrows = filter_rows(newrows, datetime(2016, 9, 16, 15))
-        newrows = match_replace(newrows, 'Red_Oak', rename_trees)
+
+def checkpoint_path(filename):
+    """Returns the path of the checkpoint kept next to a processed file."""
+    return os.path.join(PROCESSED_DATA_DIR, filename + '.checkpoint')
+
+
+def load_checkpoint(filename):
+    """Returns the saved checkpoint for filename, or None."""
+    try:
+        with open(checkpoint_path(filename), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def save_json(path, obj, **kwargs):
+    """
+    Write obj to path as JSON (kwargs go to json.dump). It's written
+    next to path and renamed over it, so readers never see a partly
+    written file.
+    """
+    with open(path + '.tmp', 'w') as f:
+        json.dump(obj, f, **kwargs)
+    os.replace(path + '.tmp', path)
+
+
+def save_checkpoint(filename, checkpoint):
+    save_json(checkpoint_path(filename), checkpoint)
+
+
+def parse_csv_line(line):
+    """Parse a single raw CSV line, converting unquoted fields to float."""
+    for row in csv.reader([line.decode('utf-8')],
+                          quoting=csv.QUOTE_NONNUMERIC):
+        return row
+    return []
+
+
+def complete_lines(f, offset):
+    """
+    Yields (line start, line) for each complete (newline-terminated)
+    line of the binary file f from offset on. It stops at a line that's
+    still being written.
+    """
+    f.seek(offset)
+    line_start = offset
+    for line in iter(f.readline, b''):
+        if not line.endswith(b'\n'):
+            return
+        yield line_start, line
+        line_start += len(line)
+
+
+def checkpoint_matches(f, checkpoint):
+    """
+    Returns True if the open source file still has the row recorded in
+    the checkpoint at the recorded offset, i.e. the file has only been
+    appended to since the checkpoint was taken.
+    """
+    f.seek(0, os.SEEK_END)
+    if f.tell() < checkpoint['offset']:
+        return False
+    if checkpoint['line_start'] is None:
+        return True
+
+    f.seek(checkpoint['line_start'])
+    try:
+        row = parse_csv_line(f.readline())
+    except ValueError:
+        return False
+    return (f.tell() == checkpoint['offset'] and
+            row[:1] == [checkpoint['timestamp']])
+
+
+def convert_field(field):
+    """Convert a raw CSV field the way csv.QUOTE_NONNUMERIC does."""
+    if field[:1] == '"':
+        return field[1:-1].replace('""', '"')
+    if not field:
+        return ''
+    return float(field)
+
+
+def raw_timestamp(line):
+    """
+    Returns the quoted timestamp a raw CSV line starts with, or None if
+    it doesn't start with one in TIME_FMT.
+    """
+    if line[:1] == b'"' and line[20:21] == b'"':
+        value = line[1:20].decode('utf-8', 'replace')
+        if looks_like_timestamp(value):
+            return value
+    return None
+
+
+class TOA5Reader(object):
+    """
+    Iterates over the data rows of a TOA5 logger file, one line at a
+    time.
+
+    header is the column header. If a checkpoint is given and still
+    matches the file, only the rows appended after it are read, and
+    resumed is True. When resuming, only complete (newline-terminated)
+    lines are consumed, so a row that's still being written is picked
+    up on the next run. Otherwise a last line with no newline is read
+    too; if it's added to later, the checkpoint taken after it no
+    longer matches and the next run rebuilds.
+
+    If keep_columns is given, the header and rows are filtered to
+    those columns as filter_columns would, and only the kept fields
+    are converted. If start_dt is given, the rows before it are
+    skipped without being parsed at all, as filter_rows would drop
+    them.
+
+    position describes the last row read, and is updated in place as
+    the rows are iterated over. The rows read and kept (not skipped)
+    are counted into the current run's metrics once they've been
+    iterated over.
+    """
+
+    def __init__(self, fname, checkpoint=None, keep_columns=None,
+                 start_dt=None):
+        self.fname = fname
+        with open(fname, 'rb') as f:
+            # The first line is the logger description, the second is
+            # the column header and the next two are units and
+            # aggregations.
+            preamble = [f.readline() for i in range(4)]
+            self.header = parse_csv_line(preamble[1])
+            self.position = {
+                'line_start': None, 'offset': f.tell(), 'timestamp': None}
+            self.resumed = bool(checkpoint) and \
+                checkpoint_matches(f, checkpoint)
+
+        if self.resumed:
+            self.position.update(
+                (k, checkpoint[k]) for k in list(self.position))
+
+        self.width = len(self.header)
+        self.indices = None
+        if keep_columns is not None:
+            self.indices = [i for i, name in enumerate(self.header)
+                            if name in keep_columns]
+            self.header = [self.header[i] for i in self.indices]
+        self.start = start_dt.strftime(TIME_FMT) if start_dt else None
+
+    def parse(self, line):
+        """Returns the (kept) fields of a raw line."""
+        if self.indices is None:
+            return parse_csv_line(line)
+
+        fields = line.decode('utf-8').rstrip('\r\n').split(',')
+        if len(fields) != self.width:
+            # Quoted commas, or a short row: let the csv module
+            # sort it out.
+            row = parse_csv_line(line)
+            return [row[i] for i in self.indices] if row else row
+        return [convert_field(fields[i]) for i in self.indices]
+
+    def __iter__(self):
+        skipping = self.start is not None
+        skipped = kept = 0
+        try:
+            with open(self.fname, 'rb') as f:
+                f.seek(self.position['offset'])
+                line_start = f.tell()
+                for line in iter(f.readline, b''):
+                    if self.resumed and not line.endswith(b'\n'):
+                        break
+                    if skipping:
+                        # The rows are in time order, so stop looking at
+                        # the first one that's in the timeframe.
+                        ts = raw_timestamp(line)
+                        if ts is not None and ts < self.start:
+                            self.position.update(
+                                line_start=line_start,
+                                offset=line_start + len(line),
+                                timestamp=ts)
+                            line_start += len(line)
+                            skipped += 1
+                            continue
+                        skipping = ts is None
+                    row = self.parse(line)
+                    if row:
+                        self.position.update(
+                            line_start=line_start,
+                            offset=line_start + len(line),
+                            timestamp=row[0])
+                        kept += 1
+                        yield row
+                    line_start += len(line)
+        finally:
+            station = os.path.basename(self.fname)
+            count('rows_read', skipped + kept, station=station)
+            count('rows_kept', kept, station=station)
+
+
+def read_toa5_rows(fname, checkpoint=None):
+    """
+    Read the column header and data rows of a TOA5 logger file.
+
+    Returns (header, rows, position, resumed); see TOA5Reader.
+    """
+    reader = TOA5Reader(fname, checkpoint)
+    rows = list(reader)
+    return reader.header, rows, reader.position, reader.resumed
+
+
+def load_resumable_checkpoint(filename):
+    """
+    Returns the checkpoint for filename if the processed output it
+    refers to is still intact, or None if a full rebuild is needed.
+    """
+    checkpoint = load_checkpoint(filename)
+    outfile = os.path.join(PROCESSED_DATA_DIR, filename)
+    if checkpoint is None or not os.path.exists(outfile) or \
+            os.path.getsize(outfile) < checkpoint['output_size']:
+        return None
+    return checkpoint
+
+
+def write_processed_rows(filename, newrows, position, previous=None,
+                         formula_applied=False):
+    """
+    Write the processed rows to PROCESSED_DATA_DIR and save the
+    checkpoint for the next incremental run.
+
+    A full rebuild is written next to the old file and renamed over it.
+    When resuming from a previous checkpoint, the new rows are appended
+    to the published output in a single write of complete rows, so
+    readers (which only go by complete lines) never see part of one.
+    If an interrupted run left anything past the checkpoint's
+    output_size, that's cut off first. The checkpoint is only saved
+    once the rows are written, so a run that dies part way is redone.
+
+    pending_from records where the rows that haven't had the RDH
+    formula applied yet begin. If formula_applied, there are none, and
+    the header is left out as apply_formula_to_processed_dendrometer_data
+    would.
+    """
+    outfile = os.path.join(PROCESSED_DATA_DIR, filename)
+    newrows = iter(newrows)
+    header = next(newrows, None)
+    if previous:
+        text = io.StringIO()
+        writer = csv.writer(text, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerows(counted(newrows, 'rows_written', station=filename))
+        if os.path.getsize(outfile) > previous['output_size']:
+            os.truncate(outfile, previous['output_size'])
+        with open(outfile, 'ab') as f:
+            f.write(text.getvalue().encode('utf-8'))
+        pending_from = previous['pending_from']
+        if pending_from is None:
+            pending_from = previous['output_size']
     else:
-        newrows = filter_rows(newrows, datetime(2016, 9, 10, 17))
+        tmpfile = outfile + '.tmp'
+        with open(tmpfile, 'w') as csvfile:
+            writer = csv.writer(csvfile, quoting=csv.QUOTE_NONNUMERIC)
+            if header is not None and not formula_applied:
+                writer.writerow(header)
+            writer.writerows(
+                counted(newrows, 'rows_written', station=filename))
+        os.replace(tmpfile, outfile)
+        pending_from = 0
+
+    checkpoint = dict(position)
+    checkpoint['output_size'] = os.path.getsize(outfile)
+    checkpoint['pending_from'] = None if formula_applied else pending_from
+    save_checkpoint(filename, checkpoint)
+
+    print('Wrote to %s' % outfile)
 
-    if 'Mailley' in filename:
+
+def iter_dendrometer_rows(rows, start_dt, rename_trees=None,
+                          mailley=False):
+    """
+    Lazily filter the dendrometer rows (header first) to
+    DENDROMETER_COLUMNS and start_dt, rename the Red_Oak columns to
+    rename_trees if given, and add the site (or Mailley's Mill Hemlock
+    and Pine) averages.
+    """
+    newrows = iter_filter_columns(DENDROMETER_COLUMNS, rows)
+    newrows = iter_filter_rows(newrows, start_dt)
+    if rename_trees:
+        newrows = iter_match_replace(newrows, 'Red_Oak', rename_trees)
+
+    if mailley:
         for i, row in enumerate(newrows):
             if i == 0:
                 row.append('Hemlock AVG')
@@ -161,6 +558,7 @@ def process_dendrometer_data(path, filename, rename_trees=None):
             else:
                 row.append(calc_avg([row[1], row[2], row[3]]))
                 row.append(calc_avg([row[4], row[5], row[6]]))
+            yield row
     else:
         for i, row in enumerate(newrows):
             if i == 0:
@@ -168,88 +566,253 @@ def process_dendrometer_data(path, filename, rename_trees=None):
             else:
                 row.append(calc_avg([row[1], row[2], row[3],
                                      row[4], row[5]]))
+            yield row
 
-    outfile = os.path.join(PROCESSED_DATA_DIR, filename)
-    with open(outfile, 'w') as csvfile:
-        writer = csv.writer(csvfile, quoting=csv.QUOTE_NONNUMERIC)
-        for row in newrows:
-            writer.writerow(row)
 
-    print('Wrote to %s' % outfile)
+def dendrometer_names(rename_trees=None, mailley=False):
+    """
+    Returns the names iter_dendrometer_rows gives the columns after
+    the timestamp, for the files with the RDH formula applied, which
+    have no header to say.
+    """
+    names = [name for name in DENDROMETER_COLUMNS[1:]
+             if name.startswith('Red_Oak') != mailley]
+    if rename_trees:
+        names = [name.replace('Red_Oak', rename_trees) for name in names]
+    if mailley:
+        return names + ['Hemlock AVG', 'Pine AVG']
+    return names + ['Site AVG']
+
+
+def dendrometer_rows(rows, start_dt, rename_trees=None, mailley=False):
+    """See iter_dendrometer_rows. Returns a list of lists."""
+    return list(iter_dendrometer_rows(rows, start_dt, rename_trees, mailley))
+
+
+def iter_environmental_rows(rows, start_dt=None, end_dt=None):
+    """
+    Lazily filter the environmental rows (header first) to
+    ENVIRONMENTAL_COLUMNS and the given timeframe.
+    """
+    newrows = iter_filter_columns(ENVIRONMENTAL_COLUMNS, rows)
+    return iter_filter_rows(newrows, start_dt, end_dt)
+
+
+def environmental_rows(rows, start_dt=None, end_dt=None):
+    """See iter_environmental_rows. Returns a list of lists."""
+    return list(iter_environmental_rows(rows, start_dt, end_dt))
 
 
+def iter_rdh_rows(rows, dbh_vals, voltage_vals):
+    """
+    Lazily replace the dendrometer voltages in processed rows (without
+    the header) with RDH deltas. Cells that aren't numbers, like the
+    loggers' "NAN", are left as they are.
+    """
+    for row in rows:
+        for i, x in enumerate(row):
+            if i > 0 and i < 6 and x.__class__ is not str:
+                # If this isn't the first column (the timestamp),
+                # and it's not the last column (the site average),
+                # then calculate the rdh delta for this value.
+                row[i] = calc_rdh_delta(
+                    dbh_vals[i - 1],
+                    voltage_vals[i - 1],
+                    x)
+        yield row
+
+
+def rdh_rows(rows, dbh_vals, voltage_vals):
+    """See iter_rdh_rows. Returns a list of lists."""
+    return list(iter_rdh_rows(rows, dbh_vals, voltage_vals))
+
+
+def columnar_backend(backend=None):
+    """
+    Returns the blackrock_columnar module if the 'numpy' backend is
+    selected (by default, with PROCESSING_BACKEND) and numpy is
+    installed, otherwise None.
+    """
+    if (backend or PROCESSING_BACKEND) != 'numpy':
+        return None
+    import blackrock_columnar
+    if blackrock_columnar.np is None:
+        return None
+    return blackrock_columnar
+
+
+def read_dendrometer_data(path, filename, rename_trees=None,
+                          incremental=False, backend=None, start_dt=None,
+                          mailley=None):
+    """
+    Read a dendrometer logger file (only the new rows if incremental)
+    and run it through dendrometer_rows, with Mailley's Mill's Hemlock
+    and Pine averages if mailley. mailley defaults to whether it's
+    Mailley's Mill's file.
+
+    start_dt defaults to when the station's dendrometers were set up.
+
+    Returns (newrows, position, previous), where newrows is an
+    iterator of rows, header first, position is updated as newrows is
+    consumed, and previous is the checkpoint that was resumed from, if
+    any.
+    """
+    fname = os.path.join(path, filename)
+    previous = load_resumable_checkpoint(filename) if incremental else None
+    if mailley is None:
+        mailley = 'Mailley' in filename
+    if start_dt is None and rename_trees:
+        start_dt = datetime(2016, 9, 16, 15)
+    elif start_dt is None:
+        start_dt = datetime(2016, 9, 10, 17)
+
+    reader = TOA5Reader(fname, previous, DENDROMETER_COLUMNS, start_dt)
+    rows = itertools.chain([reader.header], reader)
+
+    columnar = columnar_backend(backend)
+    transform = columnar.dendrometer_rows if columnar \
+        else iter_dendrometer_rows
+    newrows = transform(rows, start_dt, rename_trees, mailley)
+    return newrows, reader.position, previous if reader.resumed else None
+
+
+@timed
+def process_dendrometer_data(path, filename, rename_trees=None,
+                             incremental=False, backend=None,
+                             start_dt=None, mailley=None):
+    """
+    Process a dendrometer logger file into PROCESSED_DATA_DIR.
+
+    With incremental=True, only the rows added since the last run are
+    processed and appended to the existing output. The result is the
+    same as a full rebuild, which is still done when there's no usable
+    checkpoint or when incremental is False.
+
+    backend is 'python' or 'numpy', defaulting to PROCESSING_BACKEND.
+    The python backend streams the rows from the logger file to the
+    output, so memory use doesn't grow with the file.
+
+    Rows before start_dt are left out, and mailley is for Mailley's
+    Mill's file; see read_dendrometer_data.
+    """
+    newrows, position, previous = read_dendrometer_data(
+        path, filename, rename_trees, incremental, backend, start_dt,
+        mailley)
+    write_processed_rows(filename, newrows, position, previous)
+
+
+@timed
+def process_dendrometer_data_with_formula(
+        path, filename, dbh_vals, voltage_vals, rename_trees=None,
+        incremental=False, backend=None, start_dt=None, mailley=None):
+    """
+    Equivalent to process_dendrometer_data followed by
+    apply_formula_to_processed_dendrometer_data, in a single pass.
+
+    The processed file isn't read back and rewritten, and the result
+    is published with one rename.
+    """
+    checkpoint = load_checkpoint(filename)
+    if checkpoint and checkpoint['pending_from'] is not None:
+        # Some rows are still waiting for the formula, so rebuild.
+        incremental = False
+
+    newrows, position, previous = read_dendrometer_data(
+        path, filename, rename_trees, incremental, backend, start_dt,
+        mailley)
+    newrows = iter(newrows)
+    header = next(newrows)
+
+    columnar = columnar_backend(backend)
+    transform = columnar.rdh_rows if columnar else iter_rdh_rows
+    newrows = itertools.chain(
+        [header], transform(newrows, dbh_vals, voltage_vals))
+
+    write_processed_rows(filename, newrows, position, previous,
+                         formula_applied=True)
+
+
+def copy_bytes(src, dst, length, chunk_size=1024 * 1024):
+    """Copy the next length bytes of the file src to dst."""
+    while length > 0:
+        chunk = src.read(min(length, chunk_size))
+        if not chunk:
+            break
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def read_processed_rows(f):
+    """Returns a reader of the rows of a processed file opened 'rb'."""
+    return csv.reader(io.TextIOWrapper(f, encoding='utf-8', newline=''),
+                      quoting=csv.QUOTE_NONNUMERIC)
+
+
+@timed
 def apply_formula_to_processed_dendrometer_data(
-        filename, dbh_vals, voltage_vals):
+        filename, dbh_vals, voltage_vals, backend=None):
+    """
+    Replace the dendrometer voltages in a processed file with RDH
+    deltas.
+
+    Only the rows written since the formula was last applied (as
+    recorded in the checkpoint) are converted, so this is safe to run
+    after both full and incremental processing. The rows before them
+    are copied as they are, and the result is renamed into place.
+    """
     fname = os.path.join(PROCESSED_DATA_DIR, filename)
-    rows = []
-    with open(fname, 'r') as csvfile:
-        reader = csv.reader(csvfile, quoting=csv.QUOTE_NONNUMERIC)
-        for row in reader:
-            rows += [row]
-
-    with open(fname, 'w') as csvfile:
-        writer = csv.writer(csvfile, quoting=csv.QUOTE_NONNUMERIC)
-        for j, row in enumerate(rows):
+    checkpoint = load_checkpoint(filename)
+    start = 0
+    if checkpoint:
+        if checkpoint['pending_from'] is None:
+            print('RDH delta already applied to %s' % fname)
+            return
+        start = checkpoint['pending_from']
+
+    columnar = columnar_backend(backend)
+    transform = columnar.rdh_rows if columnar else iter_rdh_rows
+
+    tmpfile = fname + '.tmp'
+    with open(fname, 'rb') as f:
+        with open(tmpfile, 'wb') as out:
+            copy_bytes(f, out, start)
+        rows = read_processed_rows(f)
+        if not start:
             # Skip the header row
-            if j == 0:
-                continue
-            for i, x in enumerate(row):
-                if i > 0 and i < 6:
-                    # If this isn't the first column (the timestamp),
-                    # and it's not the last column (the site average),
-                    # then calculate the rdh delta for this value.
-                    row[i] = calc_rdh_delta(
-                        dbh_vals[i - 1],
-                        voltage_vals[i - 1],
-                        x)
-            writer.writerow(row)
+            next(rows, None)
+        with open(tmpfile, 'a') as csvfile:
+            writer = csv.writer(csvfile, quoting=csv.QUOTE_NONNUMERIC)
+            writer.writerows(transform(rows, dbh_vals, voltage_vals))
+    os.replace(tmpfile, fname)
+
+    if checkpoint:
+        checkpoint['output_size'] = os.path.getsize(fname)
+        checkpoint['pending_from'] = None
+        save_checkpoint(filename, checkpoint)
 
     print('Calculated RDH delta and wrote to %s' % fname)
 
 
-def process_environmental_data(path, filename, start_dt=None, end_dt=None):
+@timed
+def process_environmental_data(path, filename, start_dt=None, end_dt=None,
+                               incremental=False, backend=None):
+    """
+    Process an environmental logger file into PROCESSED_DATA_DIR.
+
+    See process_dendrometer_data for what incremental and backend do.
+    """
     fname = os.path.join(path, filename)
-    rows = []
-    with open(fname, 'r') as csvfile:
-        reader = csv.reader(csvfile, quoting=csv.QUOTE_NONNUMERIC)
-        for row in reader:
-            rows += [row]
-
-    # Remove blank rows
-    # The incoming CSV contains a few rows near the beginning that we don't
-    # want.
-    del rows[0]
-    del rows[1]
-    del rows[1]
-
-    #
-    # The incoming CSV's header row looks like this:
-    # "TIMESTAMP", "RECORD", "AvgTEMP_C", "MinTEMP_C", "MaxTEMP_C",
-    # "AvgRh", "MaxRh", "MinRh", "AvgVP", "AvgDewPt", "TotalPAR",
-    # "AvgGSR", "AvgWspd", "AvgWdir", "StdDevWdir", "MaxWspd",
-    # "TotalRain", "AvgBP", "MaxBP", "MinBp", "AvgST_10", "AvgST_100",
-    # "MinBatt", "AvgCO2", "AvgOzone", "DSTEMPF", "DSDEPTH", "DSRETRIES",
-    # "SoilM_5cm", "SoilM_15cm", "UVB", "UVTEMP", "UVA", "V2mV", "V2mV2",
-    # "Snow1_BATT", "Snow1_PNLTMP", "CM3_up", "CM3_dn", "CG3_up",
-    #  "CG3_dn", "CM_TempC", "CM3_TempK", "Net_Rs", "Net_R1", "Albedo",
-    # "Up_Total", "Dn_Total", "Net_Total", "AvgPAR_Den", "MaxPAR_Den",
-    # "MinPAR_Den"
-    #
-    # Here are the columns we want to filter to:
-    keep_columns = [
-        'TIMESTAMP', 'AvgTEMP_C', 'AvgVP', 'TotalRain',
-        'SoilM_5cm', 'AvgPAR_Den'
-    ]
-    newrows = filter_columns(keep_columns, rows)
-    newrows = filter_rows(newrows, start_dt, end_dt)
+    previous = load_resumable_checkpoint(filename) if incremental else None
+    reader = TOA5Reader(fname, previous, ENVIRONMENTAL_COLUMNS, start_dt)
+    rows = itertools.chain([reader.header], reader)
 
-    outfile = os.path.join(PROCESSED_DATA_DIR, filename)
-    with open(outfile, 'w') as csvfile:
-        writer = csv.writer(csvfile, quoting=csv.QUOTE_NONNUMERIC)
-        for row in newrows:
-            writer.writerow(row)
+    columnar = columnar_backend(backend)
+    transform = columnar.environmental_rows if columnar \
+        else iter_environmental_rows
+    newrows = transform(rows, start_dt, end_dt)
 
-    print('Wrote to %s' % outfile)
+    write_processed_rows(filename, newrows, reader.position,
+                         previous if reader.resumed else None)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,53 @@
+"""
+Streaming downloads of Google Drive media to local files.
+
+The downloaded bytes are written to a temporary file in the target
+directory as each chunk arrives, so memory use is bounded by the chunk
+size no matter how large the file is. When the download completes the
+temporary file is fsync'ed and renamed over the target, so readers
+never see a partially written file.
+"""
+from __future__ import print_function
+
+import os
+import os.path
+import tempfile
+
+from blackrock_scheduler import call
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def download_to_file(request, local_path, chunksize=DEFAULT_CHUNK_SIZE,
+                     downloader_class=None):
+    """
+    Download a media request (e.g. from files().get_media()) to
+    local_path.
+
+    downloader_class defaults to googleapiclient's MediaIoBaseDownload.
+    Returns the number of bytes written.
+    """
+    if downloader_class is None:
+        from googleapiclient.http import MediaIoBaseDownload
+        downloader_class = MediaIoBaseDownload
+
+    directory, name = os.path.split(os.path.abspath(local_path))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix='.%s.' % name, suffix='.part', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            downloader = downloader_class(f, request, chunksize=chunksize)
+            done = False
+            while done is False:
+                # A chunk that comes back corrupted is retried like any
+                # other transient error; see blackrock_scheduler.
+                status, done = call(downloader.next_chunk, 'download')
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, local_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return size
@@ -0,0 +1,90 @@
+"""
+Helpers for finding files on Google Drive.
+
+Instead of pulling metadata for the whole Drive and filtering it here,
+build_query() narrows the listing down on the server side, and
+list_files() follows nextPageToken so no page of results is missed.
+The photo fetcher keeps a small name -> file id cache, so most runs
+don't need to list anything at all.
+"""
+import json
+import time
+
+from blackrock_data_processor import save_json
+from blackrock_scheduler import call
+
+DEFAULT_PAGE_SIZE = 1000
+
+
+def quote(value):
+    """Quote a string for use in a Drive query."""
+    return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+def build_query(mimetypes=None, names=None, exclude_mimetype=None):
+    """
+    Returns a Drive files().list() query matching files that aren't
+    trashed, have one of the given mimetypes and/or one of the given
+    names, and don't have exclude_mimetype (e.g. the folder type).
+    """
+    terms = ['trashed = false']
+    if exclude_mimetype:
+        terms.append('mimeType != %s' % quote(exclude_mimetype))
+    if mimetypes:
+        terms.append('(%s)' % ' or '.join(
+            'mimeType = %s' % quote(m) for m in mimetypes))
+    if names:
+        terms.append('(%s)' % ' or '.join(
+            'name = %s' % quote(n) for n in names))
+    return ' and '.join(terms)
+
+
+def list_files(service, q, fields='id, name, mimeType',
+               page_size=DEFAULT_PAGE_SIZE):
+    """
+    Returns the metadata of every file matching the query q, following
+    nextPageToken through all the result pages.
+
+    fields lists the file fields to fetch.
+    """
+    items = []
+    page_token = None
+    while True:
+        results = call(service.files().list(
+            q=q, pageSize=page_size, pageToken=page_token,
+            fields='nextPageToken, files(%s)' % fields).execute, 'list')
+        items.extend(results.get('files', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return items
+
+
+def load_file_id(cache_path, name, max_age):
+    """
+    Returns the cached Drive file id for name, or None if it isn't
+    cached or was cached more than max_age seconds ago.
+    """
+    try:
+        with open(cache_path, 'r') as f:
+            entry = json.load(f)[name]
+    except (IOError, ValueError, KeyError):
+        return None
+    if time.time() - entry['cached_at'] > max_age:
+        return None
+    return entry['id']
+
+
+def save_file_id(cache_path, name, file_id):
+    """Cache the Drive file id for name. A file_id of None clears it."""
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        cache = {}
+
+    if file_id is None:
+        cache.pop(name, None)
+    else:
+        cache[name] = {'id': file_id, 'cached_at': time.time()}
+
+    save_json(cache_path, cache)
@@ -0,0 +1,220 @@
+#!ve/bin/python
+"""
+How stale the published station data is.
+=========================================
+blackrock_freshness.py [--window DAYS]
+
+For each station file, every data fetcher run records
+
+  timestamp     the newest TIMESTAMP row in the logger file
+  fetched_at    when the fetcher first saw that row
+  published_at  when the run that processed it pointed 'current' at
+                the new directory
+
+in FRESHNESS_FILE. Each time a new row is published, its fetch lag
+(fetched_at - timestamp) and publish lag (published_at - timestamp)
+are kept as a sample, for FRESHNESS_WINDOW days.
+
+Run as a script, this reports the p50 and p95 of each station's lags
+over the window, a histogram of the publish lag, and how old the
+newest row is. Stations whose newest row is older than STALE_AFTER
+seconds are flagged as stalled, and the exit status is 1 if there are
+any.
+
+The loggers' clocks are taken to be in the same timezone as ours.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import os.path
+import sys
+import time
+from datetime import datetime
+
+from blackrock_data_processor import TIME_FMT, raw_timestamp, save_json
+
+try:
+    from local_settings import (
+        FRESHNESS_FILE, FRESHNESS_WINDOW, STALE_AFTER,
+    )
+except ImportError:
+    from example_settings import (
+        FRESHNESS_FILE, FRESHNESS_WINDOW, STALE_AFTER,
+    )
+
+# How far from the end of a logger file to look for its newest row.
+TAIL_BYTES = 64 * 1024
+# The upper edges of the histogram buckets, in seconds.
+HISTOGRAM_BUCKETS = [
+    (5 * 60, '<=5m'), (15 * 60, '<=15m'), (30 * 60, '<=30m'),
+    (60 * 60, '<=1h'), (2 * 60 * 60, '<=2h'), (6 * 60 * 60, '<=6h'),
+    (24 * 60 * 60, '<=1d'), (float('inf'), '>1d')]
+
+
+def load_state(path=None):
+    try:
+        with open(path or FRESHNESS_FILE, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_state(state, path=None):
+    save_json(path or FRESHNESS_FILE, state, indent=1, sort_keys=True)
+
+
+def newest_timestamp(fname):
+    """
+    Returns the timestamp of the last complete row of a logger file,
+    or None if there isn't one near the end.
+    """
+    try:
+        with open(fname, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - TAIL_BYTES))
+            lines = f.read().splitlines(True)
+    except IOError:
+        return None
+    for line in reversed(lines):
+        ts = raw_timestamp(line) if line.endswith(b'\n') else None
+        if ts is not None:
+            return ts
+    return None
+
+
+def seconds_between(earlier, later):
+    return (datetime.strptime(later, TIME_FMT) -
+            datetime.strptime(earlier, TIME_FMT)).total_seconds()
+
+
+def record_fetched(local_dir, filenames, now=None, path=None):
+    """
+    Note the newest row of each of the station files fetched to
+    local_dir, and when we first saw it.
+    """
+    now = (now or datetime.now()).strftime(TIME_FMT)
+    state = load_state(path)
+    for filename in filenames:
+        ts = newest_timestamp(os.path.join(local_dir, filename))
+        station = state.setdefault(filename, {'timestamp': None,
+                                              'samples': []})
+        if ts is not None and ts != station['timestamp']:
+            station.update(timestamp=ts, fetched_at=now, published_at=None)
+    save_state(state, path)
+
+
+def record_published(filenames, now=None, path=None):
+    """
+    Note that the stations' newest rows have been published, and keep
+    the lags of the ones that weren't before.
+    """
+    now = now or datetime.now()
+    published = time.mktime(now.timetuple())
+    cutoff = published - FRESHNESS_WINDOW * 86400
+    now = now.strftime(TIME_FMT)
+    state = load_state(path)
+    for filename in filenames:
+        station = state.get(filename)
+        if not station or not station['timestamp']:
+            continue
+        if station['published_at'] is None:
+            # Samples are [when, fetch lag, publish lag].
+            station['published_at'] = now
+            station['samples'].append([
+                published,
+                seconds_between(station['timestamp'], station['fetched_at']),
+                seconds_between(station['timestamp'], now)])
+        station['samples'] = [
+            s for s in station['samples'] if s[0] >= cutoff]
+    save_state(state, path)
+
+
+def percentile(values, p):
+    """Returns the nearest-rank p'th percentile of values."""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = max(1, int(-(-p * len(values) // 100)))
+    return values[rank - 1]
+
+
+def histogram(values):
+    """Returns the count of values in each of HISTOGRAM_BUCKETS."""
+    counts = [0] * len(HISTOGRAM_BUCKETS)
+    for value in values:
+        for i, (edge, label) in enumerate(HISTOGRAM_BUCKETS):
+            if value <= edge:
+                counts[i] += 1
+                break
+    return counts
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 60 * 60:
+        return '%.0fm' % (seconds / 60)
+    return '%.1fh' % (seconds / 3600)
+
+
+def station_status(station, now, window):
+    """
+    Returns the status of a station: the age of its newest row, the
+    p50 and p95 of its lags over the last window days, and whether
+    it's stalled.
+    """
+    cutoff = time.mktime(now.timetuple()) - window * 86400
+    samples = [s for s in station['samples'] if s[0] >= cutoff]
+    age = None
+    if station['timestamp']:
+        age = seconds_between(station['timestamp'], now.strftime(TIME_FMT))
+    return {
+        'age': age,
+        'stalled': age is None or age > STALE_AFTER,
+        'samples': len(samples),
+        'fetch_p50': percentile([s[1] for s in samples], 50),
+        'fetch_p95': percentile([s[1] for s in samples], 95),
+        'publish_p50': percentile([s[2] for s in samples], 50),
+        'publish_p95': percentile([s[2] for s in samples], 95),
+        'histogram': histogram([s[2] for s in samples]),
+    }
+
+
+def print_status(state, now=None, window=None):
+    """
+    Print the status of each station. Returns the number of stalled
+    stations.
+    """
+    now = now or datetime.now()
+    window = window or FRESHNESS_WINDOW
+    print('%-32s %7s %7s %7s %7s %7s %5s' % (
+        'station', 'age', 'fet p50', 'fet p95', 'pub p50', 'pub p95', 'n'))
+    stalled = 0
+    for filename, station in sorted(state.items()):
+        status = station_status(station, now, window)
+        stalled += status['stalled']
+        print('%-32s %7s %7s %7s %7s %7s %5d%s' % (
+            filename, format_seconds(status['age']),
+            format_seconds(status['fetch_p50']),
+            format_seconds(status['fetch_p95']),
+            format_seconds(status['publish_p50']),
+            format_seconds(status['publish_p95']),
+            status['samples'], '  STALLED' if status['stalled'] else ''))
+        print('    publish lag: %s' % ' '.join(
+            '%s:%d' % (label, n) for (edge, label), n in
+            zip(HISTOGRAM_BUCKETS, status['histogram'])))
+    return stalled
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--window', type=float, default=FRESHNESS_WINDOW,
+                        help='days of lag samples to report on')
+    args = parser.parse_args(argv)
+    return 1 if print_status(load_state(), window=args.window) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
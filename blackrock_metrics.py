@@ -0,0 +1,271 @@
+"""
+Timings and counts of the fetch and processing runs.
+
+Each run of a fetcher is recorded: how long each stage took (auth,
+listing, downloads, processing each station, the purge...), and
+counters like the bytes downloaded per file, the rows read, kept and
+written per station, and the retries. At the end of the run the
+record is written to METRICS_DIR as
+
+  blackrock_<job>.json  the run record, stages in the order they ran
+  blackrock_<job>.prom  the same as Prometheus metrics, for the node
+                        exporter's textfile collector
+
+replacing the last run's. Set METRICS_DIR to None to turn this off;
+stage() and count() then only check that there's no run going.
+
+    with recording('data'):
+        with stage('list'):
+            items = list_files(...)
+        count('bytes_downloaded', size, file=name)
+
+The run is kept in a context variable, so the photo and data fetchers
+can be recorded at the same time from the daemon's threads. Threads
+started for a run need to be given its context (see
+contextvars.copy_context), and worker processes record their own Run
+and send its snapshot() back to be merge()d.
+"""
+from __future__ import print_function
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import os
+import os.path
+import threading
+import time
+
+try:
+    from local_settings import METRICS_DIR
+except ImportError:
+    from example_settings import METRICS_DIR
+
+current = contextvars.ContextVar('current_run', default=None)
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Run(object):
+    """The stages and counters of a run."""
+
+    def __init__(self, job):
+        self.job = job
+        self.started = time.time()
+        self.stages = []
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def add_stage(self, name, started, seconds, labels):
+        with self.lock:
+            self.stages.append(dict(
+                labels, stage=name, started=started - self.started,
+                seconds=seconds))
+
+    def add(self, name, value, labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self):
+        """Returns the stages and counters, as JSON-friendly data."""
+        with self.lock:
+            return {
+                'started': self.started,
+                'stages': list(self.stages),
+                'counters': [
+                    dict(labels, name=name, value=value)
+                    for (name, labels), value in self.counters.items()],
+            }
+
+    def merge(self, snapshot):
+        """Add the stages and counters of another run's snapshot."""
+        offset = snapshot['started'] - self.started
+        for entry in snapshot['stages']:
+            entry = dict(entry)
+            entry['started'] += offset
+            with self.lock:
+                self.stages.append(entry)
+        for entry in snapshot['counters']:
+            labels = dict(entry)
+            name, value = labels.pop('name'), labels.pop('value')
+            self.add(name, value, labels)
+
+    def record(self, error=None):
+        """Returns the run record."""
+        record = self.snapshot()
+        record.update(job=self.job, seconds=time.time() - self.started,
+                      error=None if error is None else str(error))
+        return record
+
+
+@contextlib.contextmanager
+def recording(job, metrics_dir=None):
+    """
+    Record the run of job in the block, and write it out at the end,
+    even if the block raises.
+    """
+    metrics_dir = metrics_dir or METRICS_DIR
+    if not metrics_dir:
+        yield None
+        return
+    run = Run(job)
+    token = current.set(run)
+    error = None
+    try:
+        yield run
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current.reset(token)
+        write_run(metrics_dir, run.record(error))
+
+
+@contextlib.contextmanager
+def collecting(job):
+    """
+    Record into a fresh Run for job in the block, as a worker does,
+    and give it back. Yields None if job is None.
+    """
+    if job is None:
+        yield None
+        return
+    run = Run(job)
+    token = current.set(run)
+    try:
+        yield run
+    finally:
+        current.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name, **labels):
+    """Time the block as a stage of the current run."""
+    run = current.get()
+    if run is None:
+        yield
+        return
+    started = time.time()
+    try:
+        yield
+    finally:
+        run.add_stage(name, started, time.time() - started, labels)
+
+
+def timed(func):
+    """
+    Time each call of func as a stage named after it. If it has a
+    filename argument, that's the stage's station label.
+    """
+    params = list(inspect.signature(func).parameters)
+    position = params.index('filename') if 'filename' in params else None
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if current.get() is None:
+            return func(*args, **kwargs)
+        labels = {}
+        if position is not None:
+            labels['station'] = kwargs['filename'] \
+                if position >= len(args) else args[position]
+        with stage(func.__name__, **labels):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def count(name, value=1, **labels):
+    """Add value to a counter of the current run."""
+    run = current.get()
+    if run is not None:
+        run.add(name, value, labels)
+
+
+def counted(rows, name, **labels):
+    """
+    Returns rows, counting them into a counter of the current run as
+    they're consumed.
+    """
+    run = current.get()
+    if run is None:
+        return rows
+
+    def counting():
+        n = 0
+        try:
+            for row in rows:
+                n += 1
+                yield row
+        finally:
+            run.add(name, n, labels)
+    return counting()
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def format_labels(labels):
+    return ','.join('%s="%s"' % (k, escape(v)) for k, v in labels)
+
+
+def prometheus_lines(record):
+    """Returns the run record in the Prometheus text format."""
+    job = [('job', record['job'])]
+    lines = [
+        '# HELP blackrock_run_seconds How long the last run took.',
+        '# TYPE blackrock_run_seconds gauge',
+        'blackrock_run_seconds{%s} %r' % (
+            format_labels(job), record['seconds']),
+        '# HELP blackrock_run_success Whether the last run succeeded.',
+        '# TYPE blackrock_run_success gauge',
+        'blackrock_run_success{%s} %d' % (
+            format_labels(job), record['error'] is None),
+        '# HELP blackrock_run_timestamp_seconds When the last run started.',
+        '# TYPE blackrock_run_timestamp_seconds gauge',
+        'blackrock_run_timestamp_seconds{%s} %r' % (
+            format_labels(job), record['started']),
+    ]
+
+    stages = {}
+    for entry in record['stages']:
+        labels = dict(entry)
+        seconds = labels.pop('seconds')
+        labels.pop('started')
+        key = label_key(labels)
+        stages[key] = stages.get(key, 0) + seconds
+    lines.extend([
+        '# HELP blackrock_stage_seconds Time spent in each stage of the '
+        'last run.',
+        '# TYPE blackrock_stage_seconds gauge'])
+    lines.extend('blackrock_stage_seconds{%s} %r' % (
+        format_labels(job + list(key)), seconds)
+        for key, seconds in sorted(stages.items()))
+
+    counters = {}
+    for entry in record['counters']:
+        labels = dict(entry)
+        name, value = labels.pop('name'), labels.pop('value')
+        counters.setdefault(name, []).append((label_key(labels), value))
+    for name, values in sorted(counters.items()):
+        lines.append('# TYPE blackrock_%s gauge' % name)
+        lines.extend('blackrock_%s{%s} %r' % (
+            name, format_labels(job + list(key)), value)
+            for key, value in sorted(values))
+    return lines
+
+
+def write_run(metrics_dir, record):
+    """Write the run record and its Prometheus metrics to metrics_dir."""
+    os.makedirs(metrics_dir, exist_ok=True)
+    base = os.path.join(metrics_dir, 'blackrock_%s' % record['job'])
+    for path, text in (
+            (base + '.json', json.dumps(record, indent=1, sort_keys=True)),
+            (base + '.prom', '\n'.join(prometheus_lines(record)) + '\n')):
+        with open(path + '.tmp', 'w') as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
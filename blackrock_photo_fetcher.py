@@ -20,10 +20,8 @@ Jonah Bossewitch, CCNMTL
 from __future__ import print_function
 
 import sys
-import io
 import os
 import os.path
-from subprocess import call
 import datetime
 
 from google.auth.transport.requests import Request
@@ -31,19 +29,30 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseDownload
+
+import blackrock_metrics
+from blackrock_download import download_to_file
+from blackrock_scheduler import run_deadline
+from blackrock_thumbnail import make_thumbnails
+from blackrock_drive import (
+    build_query, list_files, load_file_id, save_file_id
+)
 
 try:
     from local_settings import (
         SCOPES, REMOTE_FILENAME,
         LOCAL_WEBCAM_DIRECTORY_BASE,
-        LOCAL_FILENAME_PREFIX, CONVERT, DEBUG,
+        LOCAL_FILENAME_PREFIX, THUMBNAIL_SIZES, DEBUG, DOWNLOAD_CHUNK_SIZE,
+        DRIVE_PAGE_SIZE, PHOTO_ID_CACHE, PHOTO_ID_CACHE_TTL,
+        PHOTO_RUN_DEADLINE,
     )
 except ImportError:
     from example_settings import (
         SCOPES, REMOTE_FILENAME,
         LOCAL_WEBCAM_DIRECTORY_BASE,
-        LOCAL_FILENAME_PREFIX, CONVERT, DEBUG,
+        LOCAL_FILENAME_PREFIX, THUMBNAIL_SIZES, DEBUG, DOWNLOAD_CHUNK_SIZE,
+        DRIVE_PAGE_SIZE, PHOTO_ID_CACHE, PHOTO_ID_CACHE_TTL,
+        PHOTO_RUN_DEADLINE,
     )
 
 
@@ -84,31 +93,48 @@ def get_credentials():
 def copy_photo_to_dir(service, file_metadata, local_path):
     try:
         request = service.files().get_media(fileId=file_metadata['id'])
-        to_download = io.BytesIO()
-        downloader = MediaIoBaseDownload(to_download, request)
-        done = False
-        while done is False:
-            try:
-                status, done = downloader.next_chunk()
-                if DEBUG:
-                    print(file_metadata['name'])
-                    open(local_path, 'wb').write(to_download.getvalue())
-            except UnicodeDecodeError as error:
-                print(F"Corrupted File - {file_metadata['name']}  - {error}")
-                done = False
+        if DEBUG:
+            print(file_metadata['name'])
+        with blackrock_metrics.stage('download'):
+            size = download_to_file(
+                request, local_path, chunksize=DOWNLOAD_CHUNK_SIZE)
+        blackrock_metrics.count(
+            'bytes_downloaded', size, file=file_metadata['name'])
     except HttpError as error:
         print(f'An error occurred: {error}')
-        to_download = None
 
 
-def fetch_image(local_path):
-    creds = get_credentials()
+def fetch_cached_image(service, local_path):
+    """
+    Download the photo using its cached file id, without listing the
+    Drive. Returns False if there's no cached id or it didn't work.
+    """
+    file_id = load_file_id(
+        PHOTO_ID_CACHE, REMOTE_FILENAME, PHOTO_ID_CACHE_TTL)
+    if file_id is None:
+        return False
+
+    copy_photo_to_dir(
+        service, {'id': file_id, 'name': REMOTE_FILENAME}, local_path)
+    if os.path.exists(local_path):
+        return True
+
+    save_file_id(PHOTO_ID_CACHE, REMOTE_FILENAME, None)
+    return False
+
+
+def fetch_image(local_path, service=None):
     try:
-        service = build('drive', 'v3', credentials=creds)
+        if service is None:
+            with blackrock_metrics.stage('auth'):
+                service = build('drive', 'v3', credentials=get_credentials())
+        if fetch_cached_image(service, local_path):
+            return None
         # Call the Drive v3 API
-        results = service.files().list(
-             fields="nextPageToken, files(id, name, mimeType)").execute()
-        items = results.get('files', [])
+        with blackrock_metrics.stage('list'):
+            items = list_files(
+                service, build_query(names=[REMOTE_FILENAME]),
+                page_size=DRIVE_PAGE_SIZE)
         if not items:
             if DEBUG:
                 print('No files found.')
@@ -118,11 +144,16 @@ def fetch_image(local_path):
         for item in items:
             if item['name'] == REMOTE_FILENAME:
                 copy_photo_to_dir(service, item, local_path)
+                save_file_id(PHOTO_ID_CACHE, REMOTE_FILENAME, item['id'])
     except HttpError as error:
         print(f'An error occurred: {error}')
 
 
-def main(argv=None):
+def fetch_photo(service=None):
+    """
+    Fetch the photo into today's directory, make its thumbnails, and
+    point the current links at them.
+    """
     today = datetime.datetime.today()
 
     local_dir = create_local_directories(today)
@@ -130,40 +161,43 @@ def main(argv=None):
     hour_min = today.strftime("%H_%M")
 
     new_filename = "%s_%s.jpg" % (LOCAL_FILENAME_PREFIX, hour_min)
-    new_thumbname = "%s_%s_thumb.jpg" % (LOCAL_FILENAME_PREFIX, hour_min)
-
     local_path = "%s/%s" % (local_dir, new_filename)
-    local_thumb_path = "%s/%s" % (local_dir, new_thumbname)
-    fetch_image(local_path)
-
-    # create a thumbnail
-    call([CONVERT,
-          '-resize',
-          '207x207',
-          local_path,
-          local_thumb_path,
-          ])
-
-    # make sure the images are world readable
-    os.chmod(local_path, 0o644)
-    os.chmod(local_thumb_path, 0o644)
-
-    # create a symlink to the most current image
-    symlink = LOCAL_WEBCAM_DIRECTORY_BASE + "/current.jpg"
-    symlink_thumb = LOCAL_WEBCAM_DIRECTORY_BASE + "/current_thumb.jpg"
-
-    try:
-        os.remove(symlink)
-        os.remove(symlink_thumb)
-    except OSError:
-        pass
-
-    os.symlink(local_path, symlink)
-    os.symlink(local_thumb_path, symlink_thumb)
+    fetch_image(local_path, service)
+
+    # create the thumbnails, e.g. Black_Rock_12_30_thumb.jpg
+    thumb_paths = dict(
+        (suffix, "%s/%s_%s_%s.jpg" % (
+            local_dir, LOCAL_FILENAME_PREFIX, hour_min, suffix))
+        for suffix in THUMBNAIL_SIZES)
+    with blackrock_metrics.stage('thumbnails'):
+        make_thumbnails(local_path, [
+            (thumb_paths[suffix], size)
+            for suffix, size in THUMBNAIL_SIZES.items()])
+
+    # make sure the images are world readable, and create symlinks to
+    # the most current images
+    links = [(local_path, "current.jpg")] + [
+        (path, "current_%s.jpg" % suffix)
+        for suffix, path in thumb_paths.items()]
+    for path, name in links:
+        os.chmod(path, 0o644)
+
+        symlink = LOCAL_WEBCAM_DIRECTORY_BASE + "/" + name
+        try:
+            os.remove(symlink)
+        except OSError:
+            pass
+        os.symlink(path, symlink)
 
     if DEBUG:
         print("Fetched.")
 
 
+def main(argv=None, service=None):
+    with blackrock_metrics.recording('photo'), \
+            run_deadline(PHOTO_RUN_DEADLINE):
+        fetch_photo(service)
+
+
 if __name__ == "__main__":
     sys.exit(main())
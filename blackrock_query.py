@@ -0,0 +1,157 @@
+#!ve/bin/python
+"""
+Time range queries over the processed station files.
+====================================================
+blackrock_query.py FILENAME [--start TIMESTAMP] [--end TIMESTAMP]
+
+Writes the rows of PROCESSED_DATA_DIR/FILENAME between the two
+timestamps (inclusive, in '%Y-%m-%d %H:%M:%S' format) to stdout as
+CSV, header first if the file has one.
+
+To avoid scanning the whole file, each processed file has a sparse
+index next to it (FILENAME.index) with the byte offset of every
+INDEX_INTERVAL'th row and its timestamp. A query looks up the last
+indexed row before the start of the range, seeks straight there and
+reads forward until the end of the range. update_index brings the
+index up to date with the rows added since it was last run, and is
+called after processing.
+
+A stale or missing index only makes queries slower, never wrong: the
+indexed offset is checked before it's used, and rows past the end of
+the index are scanned.
+"""
+from __future__ import print_function
+
+import argparse
+import bisect
+import csv
+import json
+import os
+import os.path
+import sys
+from datetime import datetime
+
+from blackrock_data_processor import (
+    TIME_FMT, checkpoint_matches, complete_lines, parse_csv_line,
+    raw_timestamp, save_json
+)
+
+try:
+    from local_settings import PROCESSED_DATA_DIR
+except ImportError:
+    from example_settings import PROCESSED_DATA_DIR
+
+# Index the offset of every this many rows.
+INDEX_INTERVAL = 256
+
+
+def index_path(filename):
+    return os.path.join(PROCESSED_DATA_DIR, filename + '.index')
+
+
+def empty_index():
+    return {'line_start': None, 'offset': 0, 'timestamp': None,
+            'rows': 0, 'entries': []}
+
+
+def load_index(filename):
+    """Returns the index of filename, or an empty one."""
+    try:
+        with open(index_path(filename), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return empty_index()
+
+
+def save_index(filename, index):
+    save_json(index_path(filename), index)
+
+
+def update_index(filename):
+    """
+    Index the rows added to a processed file since the index was last
+    updated, or rebuild the index if the file has been rewritten.
+    """
+    index = load_index(filename)
+    with open(os.path.join(PROCESSED_DATA_DIR, filename), 'rb') as f:
+        if index['offset'] and not checkpoint_matches(f, index):
+            index = empty_index()
+        for line_start, line in complete_lines(f, index['offset']):
+            ts = raw_timestamp(line)
+            if ts is not None:
+                if index['rows'] % INDEX_INTERVAL == 0:
+                    index['entries'].append([ts, line_start])
+                index['rows'] += 1
+                index['line_start'] = line_start
+                index['timestamp'] = ts
+            index['offset'] = line_start + len(line)
+    save_index(filename, index)
+
+
+def seek_offset(f, index, start):
+    """
+    Returns the offset of the last indexed row before the timestamp
+    start, if it's still where the index says, otherwise 0.
+    """
+    entries = index['entries']
+    i = bisect.bisect_left(entries, [start]) - 1
+    if i < 0:
+        return 0
+    ts, offset = entries[i]
+    f.seek(offset)
+    if raw_timestamp(f.readline()) != ts:
+        return 0
+    return offset
+
+
+def query(filename, start_dt=None, end_dt=None):
+    """
+    Yields the rows of a processed file with timestamps from start_dt
+    to end_dt, inclusive. Either end can be left open.
+
+    Like the loggers' files, the processed rows are expected to be in
+    time order.
+    """
+    start = start_dt.strftime(TIME_FMT) if start_dt else ''
+    end = end_dt.strftime(TIME_FMT) if end_dt else None
+    with open(os.path.join(PROCESSED_DATA_DIR, filename), 'rb') as f:
+        offset = seek_offset(f, load_index(filename), start)
+        for _, line in complete_lines(f, offset):
+            ts = raw_timestamp(line)
+            if ts is None or ts < start:
+                continue
+            if end is not None and ts > end:
+                break
+            yield parse_csv_line(line)
+
+
+def read_header(filename):
+    """Returns the header of a processed file, or None if it has none."""
+    with open(os.path.join(PROCESSED_DATA_DIR, filename), 'rb') as f:
+        line = f.readline()
+    if not line.endswith(b'\n') or raw_timestamp(line) is not None:
+        return None
+    return parse_csv_line(line)
+
+
+def timestamp(value):
+    """Parses a TIME_FMT timestamp argument, e.g. for argparse."""
+    return datetime.strptime(value, TIME_FMT)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('filename')
+    parser.add_argument('--start', type=timestamp)
+    parser.add_argument('--end', type=timestamp)
+    args = parser.parse_args(argv)
+
+    writer = csv.writer(sys.stdout, quoting=csv.QUOTE_NONNUMERIC)
+    header = read_header(args.filename)
+    if header:
+        writer.writerow(header)
+    writer.writerows(query(args.filename, args.start, args.end))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
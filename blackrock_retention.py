@@ -0,0 +1,174 @@
+#!ve/bin/python
+"""
+Purge the downloads that are past their retention period.
+=========================================================
+blackrock_retention.py [--dry-run]
+
+Both download trees are organized by date: the data fetcher's as
+LOCAL_DIRECTORY_BASE/YYYY/MM/DD/HH and the webcam's as
+LOCAL_WEBCAM_DIRECTORY_BASE/YYYY/MM/DD. So a file's age is in its path,
+and there's no need to stat every file to find the old ones. Instead
+we walk down the date levels, and as soon as a directory's whole
+period (a year, month, day or hour) ended more than the retention
+period ago, it's removed in one go without looking inside.
+
+Anything else in the base directories (like the 'current' symlinks)
+is left alone, as is any directory a 'current' symlink points into.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import os.path
+import shutil
+import sys
+from datetime import datetime, timedelta
+
+from blackrock_blobstore import collect_garbage
+
+try:
+    from local_settings import (
+        LOCAL_DIRECTORY_BASE, PURGE_OLDER_THAN,
+        LOCAL_WEBCAM_DIRECTORY_BASE, WEBCAM_PURGE_OLDER_THAN,
+        BLOB_STORE_DIR, DEBUG,
+    )
+except ImportError:
+    from example_settings import (
+        LOCAL_DIRECTORY_BASE, PURGE_OLDER_THAN,
+        LOCAL_WEBCAM_DIRECTORY_BASE, WEBCAM_PURGE_OLDER_THAN,
+        BLOB_STORE_DIR, DEBUG,
+    )
+
+# The width of the directory names at each level: year, month, day
+# and hour.
+DATE_WIDTHS = [4, 2, 2, 2]
+
+
+def retention_days(value):
+    """Reads a retention period like find's -mtime, e.g. '+30' or 30."""
+    return int(str(value).lstrip('+'))
+
+
+def period_end(fields):
+    """
+    Returns when the period named by the date fields (year, then
+    month, day and hour, as far as they go) ends.
+    """
+    start = datetime(*(fields + [1, 1, 0][len(fields) - 1:]))
+    if len(fields) == 1:
+        return start.replace(year=start.year + 1)
+    if len(fields) == 2:
+        return (start + timedelta(days=31)).replace(day=1)
+    if len(fields) == 3:
+        return start + timedelta(days=1)
+    return start + timedelta(hours=1)
+
+
+def date_subdirectories(path, fields):
+    """
+    Yields (path, fields) for the subdirectories of path named like
+    the next date level down.
+    """
+    width = DATE_WIDTHS[len(fields)]
+    try:
+        entries = os.scandir(path)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            if len(entry.name) != width or not entry.name.isdigit() or \
+                    not entry.is_dir(follow_symlinks=False):
+                continue
+            try:
+                period_end(fields + [int(entry.name)])
+            except ValueError:
+                continue
+            yield entry.path, fields + [int(entry.name)]
+
+
+def protected_paths(base):
+    """Returns the real paths the symlinks at the top of base point to."""
+    paths = set()
+    for entry in os.scandir(base):
+        if entry.is_symlink():
+            paths.add(os.path.realpath(entry.path))
+    return paths
+
+
+def is_protected(path, protected):
+    path = os.path.realpath(path)
+    return any(p == path or p.startswith(path + os.sep) for p in protected)
+
+
+def expired_directories(path, depth, cutoff, protected=(), fields=None):
+    """
+    Yields the largest date directories under path, down to depth
+    levels, whose period ended before cutoff and that have none of
+    the protected paths in them.
+    """
+    fields = fields or []
+    for subdir, subfields in sorted(date_subdirectories(path, fields)):
+        expired = period_end(subfields) <= cutoff
+        if expired and not is_protected(subdir, protected):
+            yield subdir
+        elif len(subfields) < depth:
+            for expired in expired_directories(
+                    subdir, depth, cutoff, protected, subfields):
+                yield expired
+
+
+def purge_tree(base, depth, older_than, dry_run=False, now=None):
+    """
+    Remove the date directories under base whose period ended more
+    than older_than days before now.
+
+    Returns the directories that were (or with dry_run, would be)
+    removed.
+    """
+    if not base or not os.path.isdir(base):
+        return []
+    cutoff = (now or datetime.now()) - timedelta(
+        days=retention_days(older_than))
+
+    removed = []
+    for path in expired_directories(base, depth, cutoff,
+                                    protected_paths(base)):
+        if not dry_run:
+            shutil.rmtree(path)
+        removed.append(path)
+    return removed
+
+
+def purge_all(dry_run=False, now=None):
+    """
+    Purge both download trees, and the blobs the data tree no longer
+    links to. Returns the directories removed.
+    """
+    removed = purge_tree(LOCAL_DIRECTORY_BASE, 4, PURGE_OLDER_THAN,
+                         dry_run, now)
+    if WEBCAM_PURGE_OLDER_THAN is not None:
+        removed += purge_tree(LOCAL_WEBCAM_DIRECTORY_BASE, 3,
+                              WEBCAM_PURGE_OLDER_THAN, dry_run, now)
+
+    if DEBUG or dry_run:
+        for path in removed:
+            print('%s %s' % ('Would remove' if dry_run else 'Removed', path))
+
+    if BLOB_STORE_DIR and not dry_run:
+        blobs, freed = collect_garbage()
+        if DEBUG:
+            print('Removed %d unreferenced blobs (%d bytes)' % (
+                blobs, freed))
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only report what would be removed')
+    args = parser.parse_args(argv)
+    purge_all(args.dry_run)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Hourly and daily rollups of the processed station files.
+
+For every processed file in PROCESSED_DATA_DIR, e.g. Lowland.csv, this
+keeps ROLLUP_DATA_DIR/Lowland_hourly.csv and Lowland_daily.csv, with
+one row per hour or day:
+
+  TIMESTAMP, COUNT, <column>_MIN, <column>_MAX, <column>_MEAN,
+  <column>_STD, ... for every processed column
+
+The mean and standard deviation are those calc_avg and calc_std_dev
+give for the column's values in the period. Cells that aren't numbers
+(like the loggers' "NAN") are left out, and a column with no numbers
+in a period gets empty cells. Rows go in the period their timestamp
+falls in.
+
+The rollups are updated incrementally: a state file remembers how far
+into the processed file we've read, and the RunningStats of the
+periods that are still open. Each run reads only the new rows, appends
+the periods they closed and rewrites the last row for the open period.
+If the processed file was rewritten since, the rollups are rebuilt.
+
+Dendrometer files should be rolled up once the RDH formula has been
+applied to them, as process_dendrometer_data_with_formula does.
+"""
+from __future__ import print_function
+
+import csv
+import json
+import os
+import os.path
+import shutil
+
+from blackrock_data_processor import (
+    RunningStats, checkpoint_matches, complete_lines, parse_csv_line,
+    parse_timestamp, save_json
+)
+
+try:
+    from local_settings import PROCESSED_DATA_DIR, ROLLUP_DATA_DIR
+except ImportError:
+    from example_settings import PROCESSED_DATA_DIR, ROLLUP_DATA_DIR
+
+# Each period, and how much of the timestamp names it.
+PERIODS = [('hourly', len('YYYY-MM-DD HH')), ('daily', len('YYYY-MM-DD'))]
+STATISTICS = ['MIN', 'MAX', 'MEAN', 'STD']
+
+
+def rollup_path(filename, period):
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(ROLLUP_DATA_DIR, '%s_%s.csv' % (stem, period))
+
+
+def state_path(filename):
+    return os.path.join(ROLLUP_DATA_DIR, filename + '.rollup')
+
+
+def load_state(filename):
+    """
+    Returns the rollup state for filename, or a fresh one if there
+    isn't any.
+    """
+    try:
+        with open(state_path(filename), 'r') as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        return {
+            'line_start': None, 'offset': 0, 'timestamp': None,
+            'names': None,
+            'periods': dict(
+                (period, {'size': 0, 'key': None, 'count': 0, 'columns': []})
+                for period, n in PERIODS),
+        }
+    for bucket in state['periods'].values():
+        bucket['columns'] = [
+            RunningStats.from_list(c) for c in bucket['columns']]
+    return state
+
+
+def save_state(filename, state):
+    save_json(state_path(filename), state, default=RunningStats.as_list)
+
+
+def rollup_row(bucket):
+    """Returns the rollup row for the period in bucket."""
+    key = bucket['key']
+    row = [key + '0000-00-00 00:00:00'[len(key):], bucket['count']]
+    for stats in bucket['columns']:
+        if stats.count:
+            row.extend([stats.min(), stats.max(), stats.mean(), stats.std()])
+        else:
+            row.extend([''] * len(STATISTICS))
+    return row
+
+
+def rollup_header(names):
+    return ['TIMESTAMP', 'COUNT'] + [
+        '%s_%s' % (name, stat) for name in names for stat in STATISTICS]
+
+
+def is_data_row(row):
+    try:
+        parse_timestamp(row[0])
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def read_new_rows(filename, state):
+    """
+    Yields the complete rows of the processed file after the state's
+    offset, updating the state's position as they're consumed.
+
+    The header (if the file has one) sets the state's column names.
+    """
+    with open(os.path.join(PROCESSED_DATA_DIR, filename), 'rb') as f:
+        for line_start, line in complete_lines(f, state['offset']):
+            row = parse_csv_line(line)
+            state['offset'] = line_start + len(line)
+            if row and is_data_row(row):
+                state['line_start'] = line_start
+                state['timestamp'] = row[0]
+                yield row
+            elif row and line_start == 0:
+                state['names'] = row[1:]
+
+
+def add_row(bucket, row, n):
+    """
+    Adds a row to the period bucket. Returns the rollup row of the
+    period it closed, if any.
+    """
+    closed = None
+    key = row[0][:n]
+    if key != bucket['key']:
+        if bucket['count']:
+            closed = rollup_row(bucket)
+        bucket.update(key=key, count=0,
+                      columns=[RunningStats() for value in row[1:]])
+    bucket['count'] += 1
+    for stats, value in zip(bucket['columns'], row[1:]):
+        # Leave out "NAN" and the like.
+        if value.__class__ is float:
+            stats.update(value)
+    return closed
+
+
+def write_rollup(path, bucket, closed, names):
+    """
+    Append the closed periods' rows to the rollup file at path, and
+    replace its last row with the open period's.
+    """
+    tmpfile = path + '.tmp'
+    if bucket['size']:
+        shutil.copyfile(path, tmpfile)
+        os.truncate(tmpfile, bucket['size'])
+    with open(tmpfile, 'a' if bucket['size'] else 'w') as csvfile:
+        writer = csv.writer(csvfile, quoting=csv.QUOTE_NONNUMERIC)
+        if not bucket['size']:
+            writer.writerow(rollup_header(names))
+        writer.writerows(closed)
+        csvfile.flush()
+        bucket['size'] = csvfile.tell()
+        if bucket['count']:
+            writer.writerow(rollup_row(bucket))
+    os.replace(tmpfile, path)
+
+
+def update_rollups(filename, names=None):
+    """
+    Bring the hourly and daily rollups of a processed file up to date
+    with it. names are the column names (after the timestamp) to use if
+    the file has no header.
+    """
+    state = load_state(filename)
+    fname = os.path.join(PROCESSED_DATA_DIR, filename)
+    with open(fname, 'rb') as f:
+        if state['offset'] and not checkpoint_matches(f, state):
+            print('%s was rewritten, rebuilding its rollups' % fname)
+            os.remove(state_path(filename))
+            state = load_state(filename)
+
+    closed = dict((period, []) for period, n in PERIODS)
+    count = 0
+    for row in read_new_rows(filename, state):
+        count += 1
+        for period, n in PERIODS:
+            closed_row = add_row(state['periods'][period], row, n)
+            if closed_row:
+                closed[period].append(closed_row)
+        if state['names'] is None:
+            state['names'] = names or [
+                'COLUMN_%d' % i for i in range(1, len(row))]
+
+    os.makedirs(ROLLUP_DATA_DIR, exist_ok=True)
+    if count:
+        for period, n in PERIODS:
+            write_rollup(rollup_path(filename, period),
+                         state['periods'][period], closed[period],
+                         state['names'])
+        print('Rolled up %d rows of %s' % (count, fname))
+    save_state(filename, state)
@@ -0,0 +1,225 @@
+"""
+Scheduling of Google Drive API calls.
+
+Every Drive call (listing, downloading, tail fetching) goes through
+call(), which
+
+  - waits for a token from a token bucket shared by all the threads in
+    the process, so the download workers (and the photo fetcher, when
+    the daemon runs both) stay within DRIVE_REQUEST_RATE together,
+  - retries throttling (429, or 403 rateLimitExceeded), 5xx errors,
+    dropped connections and corrupted download chunks, waiting as long
+    as Retry-After says, or with exponential backoff and full jitter,
+  - and gives up once the run's deadline (see run_deadline) would
+    pass, rather than let an hourly run overrun the next one.
+
+The bucket is adaptive: each time Drive throttles us its rate is
+halved, and each call that succeeds wins some of it back, up to
+DRIVE_REQUEST_RATE. So we get as much throughput as the quota allows,
+without hammering Drive while it's pushing back.
+"""
+from __future__ import print_function
+
+import contextlib
+import contextvars
+import email.utils
+import json
+import random
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from blackrock_metrics import count
+
+try:
+    from local_settings import (
+        DEBUG, DRIVE_REQUEST_RATE, DRIVE_REQUEST_BURST, DRIVE_MAX_RETRIES,
+        DRIVE_BACKOFF_BASE, DRIVE_BACKOFF_MAX,
+    )
+except ImportError:
+    from example_settings import (
+        DEBUG, DRIVE_REQUEST_RATE, DRIVE_REQUEST_BURST, DRIVE_MAX_RETRIES,
+        DRIVE_BACKOFF_BASE, DRIVE_BACKOFF_MAX,
+    )
+
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+# The throttled rate never drops below DRIVE_REQUEST_RATE divided by
+# this.
+MAX_SLOWDOWN = 16
+
+# When the current run's Drive calls have to be done by, as a
+# time.monotonic() value, or None.
+deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class TokenBucket(object):
+    """
+    Hands out tokens at rate a second, with bursts of up to burst, to
+    any number of threads.
+    """
+
+    def __init__(self, rate, burst):
+        self.max_rate = self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    def acquire(self, until=None):
+        """
+        Wait for a token. Returns False straight away if there won't be
+        one before until (a time.monotonic() value).
+        """
+        with self.lock:
+            now = self.refill()
+            # Take the token now, even if it's not there yet, so the
+            # threads waiting on the bucket are served in turn.
+            wait = max(0, 1 - self.tokens) / self.rate
+            if until is not None and now + wait > until:
+                return False
+            self.tokens -= 1
+        if wait:
+            time.sleep(wait)
+        return True
+
+    def throttled(self):
+        """Halve the rate, as Drive told us to slow down."""
+        with self.lock:
+            self.refill()
+            self.rate = max(self.max_rate / MAX_SLOWDOWN, self.rate / 2)
+
+    def succeeded(self):
+        """Win back some of the rate after a successful call."""
+        if self.rate < self.max_rate:
+            with self.lock:
+                self.refill()
+                self.rate = min(self.max_rate,
+                                self.rate + self.max_rate / 20)
+
+
+drive_bucket = TokenBucket(DRIVE_REQUEST_RATE, DRIVE_REQUEST_BURST)
+
+
+@contextlib.contextmanager
+def run_deadline(seconds):
+    """
+    Have the Drive calls made in this context (including in threads
+    started with a copy of it) give up rather than run past seconds
+    from now. None means no deadline.
+    """
+    token = deadline.set(
+        None if seconds is None else time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        deadline.reset(token)
+
+
+def error_reason(error):
+    """Returns the reason given in a Drive error response, if any."""
+    try:
+        return json.loads(error.content)['error']['errors'][0]['reason']
+    except (ValueError, TypeError, KeyError, IndexError):
+        return None
+
+
+def classify(error):
+    """
+    Returns 'throttled' or 'transient' if the failed call is worth
+    retrying, otherwise None.
+    """
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status == 429 or (status == 403 and
+                             error_reason(error) in RATE_LIMIT_REASONS):
+            return 'throttled'
+        return 'transient' if status >= 500 else None
+    # A corrupted download chunk (UnicodeDecodeError) is worth another
+    # try too.
+    if isinstance(error, (ConnectionError, TimeoutError,
+                          UnicodeDecodeError)):
+        return 'transient'
+    return None
+
+
+def retry_after(error):
+    """
+    Returns how many seconds the Retry-After header of an error
+    response asks us to wait, or None.
+    """
+    value = getattr(error, 'resp', {}).get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        date = email.utils.parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0, email.utils.mktime_tz(date) - time.time())
+
+
+def backoff(attempt):
+    """Returns a random wait before retry number attempt (from 0)."""
+    return random.uniform(
+        0, min(DRIVE_BACKOFF_MAX, DRIVE_BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_delay(error, attempt, bucket):
+    """
+    Returns how long to wait before retrying a call that failed with
+    error, or None if it shouldn't be retried.
+    """
+    kind = classify(error)
+    if kind is None or attempt >= DRIVE_MAX_RETRIES:
+        return None
+    if kind == 'throttled':
+        bucket.throttled()
+    delay = retry_after(error)
+    return backoff(attempt) if delay is None else delay
+
+
+def call(func, operation, bucket=None):
+    """
+    Returns func(), a Drive call such as request.execute, scheduled
+    and retried as described above. operation labels the retries in
+    the run's metrics.
+
+    The last error is raised if the call can't be retried (any more,
+    or before the deadline), and DeadlineExceeded if the deadline
+    passes before it can be made at all.
+    """
+    bucket = bucket or drive_bucket
+    until = deadline.get()
+    attempt = 0
+    while True:
+        if not bucket.acquire(until):
+            raise DeadlineExceeded('no time left for a Drive %s' % operation)
+        try:
+            result = func()
+        except Exception as error:
+            delay = retry_delay(error, attempt, bucket)
+            if delay is None or (until is not None and
+                                 time.monotonic() + delay > until):
+                raise
+            if DEBUG:
+                print('Retrying Drive %s in %.1fs: %s' % (
+                    operation, delay, error))
+            count('retries', operation=operation)
+            time.sleep(delay)
+            attempt += 1
+        else:
+            bucket.succeeded()
+            return result
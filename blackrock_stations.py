@@ -0,0 +1,193 @@
+"""
+The station files we process, and the process pool that runs them.
+
+Each station is a dict naming its logger file and how to process it:
+
+  filename      the logger file, as fetched from Drive
+  kind          'dendrometer' or 'environmental'
+  start_dt      rows before this are left out
+  rename_trees  the prefix for the tree columns, if they need renaming
+  averages      'site' (the default) to add the average of all the
+                trees, or 'species' for one per species, as Mailley's
+                Mill has Hemlocks and Pines
+  dbh_vals, voltage_vals
+                the calibration for the RDH formula, if it's applied
+
+Adding a station means adding an entry to STATIONS. The stations are
+independent of each other, so process_stations processes them in
+parallel, in PROCESSING_WORKERS processes.
+"""
+from __future__ import print_function
+
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import blackrock_metrics
+from blackrock_column_cache import update_cache
+from blackrock_data_processor import (
+    dendrometer_names, process_dendrometer_data,
+    process_dendrometer_data_with_formula, process_environmental_data
+)
+from blackrock_query import update_index
+from blackrock_rollup import update_rollups
+
+try:
+    from local_settings import (
+        DEBUG, INCREMENTAL_PROCESSING, PROCESSING_WORKERS
+    )
+except ImportError:
+    from example_settings import (
+        DEBUG, INCREMENTAL_PROCESSING, PROCESSING_WORKERS
+    )
+
+STATIONS = [
+    {
+        'filename': 'Mnt_Misery_Table20.csv',
+        'kind': 'dendrometer',
+        'start_dt': datetime(2016, 9, 10, 17),
+        # The DBH (diameter at breast height) for each of these
+        # trees on October 7th, 2016 at 2pm.
+        # Unit is centimeters.
+        'dbh_vals': [48.0, 40.1, 42.1, 46.0, 42.4],
+        # The dendrometer voltages at that same time.
+        'voltage_vals': [20.9, 19.23, 20.93, 316.5, 120.9],
+    },
+    {
+        'filename': 'White_Oak_Table20.csv',
+        'kind': 'dendrometer',
+        'start_dt': datetime(2016, 9, 16, 15),
+        'rename_trees': 'White_Oak',
+        # The DBH (diameter at breast height) for each of these
+        # trees on October 7th, 2016 at 2pm.
+        # Unit is centimeters.
+        'dbh_vals': [32.1, 33.3, 46.7, 30.0, 26.7],
+        # The dendrometer voltages at that same time.
+        'voltage_vals': [160.8, 71.33, 100.4, 277.4, 456.6],
+    },
+    {
+        'filename': 'Mailley\'s_Mill_Table20Min.csv',
+        'kind': 'dendrometer',
+        'start_dt': datetime(2016, 9, 10, 17),
+        'averages': 'species',
+    },
+    {
+        'filename': 'Lowland.csv',
+        'kind': 'environmental',
+        'start_dt': datetime(2016, 9, 10, 17),
+    },
+]
+
+
+def species_averages(station):
+    """Whether the station's trees are averaged by species."""
+    return station.get('averages', 'site') == 'species'
+
+
+def column_names(station):
+    """
+    Returns the names of the columns after the timestamp in a station's
+    processed file, for when the file has no header, or None.
+    """
+    if station['kind'] != 'dendrometer':
+        return None
+    return dendrometer_names(station.get('rename_trees'),
+                             species_averages(station))
+
+
+def process_station(local_dir, station):
+    """
+    Process a station's file fetched to local_dir into
+    PROCESSED_DATA_DIR, and update its index, column cache and rollups.
+    """
+    filename = station['filename']
+    if station['kind'] == 'environmental':
+        process_environmental_data(
+            local_dir, filename, start_dt=station['start_dt'],
+            incremental=INCREMENTAL_PROCESSING)
+    elif station.get('dbh_vals'):
+        process_dendrometer_data_with_formula(
+            local_dir, filename, station['dbh_vals'],
+            station['voltage_vals'],
+            rename_trees=station.get('rename_trees'),
+            incremental=INCREMENTAL_PROCESSING,
+            start_dt=station['start_dt'],
+            mailley=species_averages(station))
+    else:
+        process_dendrometer_data(
+            local_dir, filename, rename_trees=station.get('rename_trees'),
+            incremental=INCREMENTAL_PROCESSING,
+            start_dt=station['start_dt'],
+            mailley=species_averages(station))
+
+    with blackrock_metrics.stage('index', station=filename):
+        update_index(filename)
+    with blackrock_metrics.stage('cache', station=filename):
+        update_cache(filename, column_names(station))
+    with blackrock_metrics.stage('rollup', station=filename):
+        update_rollups(filename, column_names(station))
+
+
+def station_worker(local_dir, station, job=None):
+    """
+    Runs process_station in a worker process.
+    Returns (error, seconds taken, metrics), where error is None on
+    success, or the formatted traceback, since that survives the trip
+    back from the worker better than the exception does. If job is
+    given, metrics is a snapshot of the station's stages and counters
+    for that job's run, otherwise None.
+    """
+    started = time.time()
+    error = None
+    with blackrock_metrics.collecting(job) as run:
+        try:
+            process_station(local_dir, station)
+        except Exception:
+            error = traceback.format_exc()
+    return error, time.time() - started, run and run.snapshot()
+
+
+def process_stations(local_dir, stations=None, workers=None):
+    """
+    Process the stations' files fetched to local_dir, workers at a
+    time. A station failing doesn't stop the others.
+
+    Returns a dict mapping the filename of each station that failed
+    to its error.
+    """
+    if stations is None:
+        stations = STATIONS
+    if workers is None:
+        workers = PROCESSING_WORKERS
+    started = time.time()
+    run = blackrock_metrics.current.get()
+    job = run and run.job
+    if workers > 1:
+        # Not forked, as the daemon runs the photo fetcher in another
+        # thread, and forking while a thread holds a lock can leave the
+        # child stuck on it.
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('forkserver')) \
+                as pool:
+            futures = [pool.submit(station_worker, local_dir, station, job)
+                       for station in stations]
+            results = [future.result() for future in futures]
+    else:
+        results = [station_worker(local_dir, station, job)
+                   for station in stations]
+
+    errors = {}
+    for station, (error, elapsed, snapshot) in zip(stations, results):
+        if snapshot:
+            run.merge(snapshot)
+        if DEBUG:
+            print('Processed %s in %.2fs' % (station['filename'], elapsed))
+        if error:
+            errors[station['filename']] = error
+    if DEBUG:
+        print('Processed %d stations in %.2fs with %d workers' % (
+            len(stations), time.time() - started, workers))
+    return errors
@@ -0,0 +1,76 @@
+"""
+Thumbnails for the webcam photos.
+
+The default backend resizes in-process with Pillow. JPEG draft mode
+lets libjpeg do most of the downscaling with DCT scaling while it
+decodes, so a full-resolution frame is never decoded, and every
+configured size is cut from that one decode. If Pillow isn't
+installed, or THUMBNAIL_BACKEND is 'convert', we fall back to running
+ImageMagick's CONVERT once per size.
+"""
+import math
+from subprocess import call
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    from local_settings import CONVERT, THUMBNAIL_BACKEND, THUMBNAIL_QUALITY
+except ImportError:
+    from example_settings import (
+        CONVERT, THUMBNAIL_BACKEND, THUMBNAIL_QUALITY
+    )
+
+# Decode at no less than this multiple of the largest thumbnail, so
+# the final resize still has enough pixels to filter.
+REDUCING_GAP = 2
+
+
+def fit_size(size, box):
+    """Returns size scaled down to fit in box, keeping its aspect ratio."""
+    scale = min(float(box[0]) / size[0], float(box[1]) / size[1], 1)
+    return (max(1, int(round(size[0] * scale))),
+            max(1, int(round(size[1] * scale))))
+
+
+def make_thumbnails_pillow(src, targets):
+    """
+    Write a thumbnail of src for each (path, (width, height)) in
+    targets, from a single draft-mode decode.
+    """
+    with Image.open(src) as im:
+        largest = max((fit_size(im.size, box) for path, box in targets),
+                      key=lambda s: s[0] * s[1])
+        im.draft('RGB', (math.ceil(largest[0] * REDUCING_GAP),
+                         math.ceil(largest[1] * REDUCING_GAP)))
+        im = im.convert('RGB')
+
+    for path, box in targets:
+        thumb = im.resize(fit_size(im.size, box), Image.LANCZOS)
+        thumb.save(path, 'JPEG', quality=THUMBNAIL_QUALITY)
+
+
+def make_thumbnails_convert(src, targets):
+    for path, (width, height) in targets:
+        call([CONVERT,
+              '-resize',
+              '%dx%d' % (width, height),
+              src,
+              path,
+              ])
+
+
+def make_thumbnails(src, targets, backend=None):
+    """
+    Write a thumbnail of src for each (path, (width, height)) in
+    targets, fitting the image within width x height.
+
+    backend is 'pillow' or 'convert', defaulting to THUMBNAIL_BACKEND.
+    """
+    backend = backend or THUMBNAIL_BACKEND
+    if backend == 'pillow' and Image is not None:
+        make_thumbnails_pillow(src, targets)
+    else:
+        make_thumbnails_convert(src, targets)
@@ -3,6 +3,8 @@
 DIR_MIMETYPE = 'application/vnd.google-apps.folder'
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 ACCEPTED_FILETYPES = ['.csv', '.png']
+# How many files to ask Drive for per page when listing.
+DRIVE_PAGE_SIZE = 1000
 
 OL_EXPECTED_FILES_SET = set(
     ('OL_Air-Soil-7Day.png', 'OL_Air-Soil-24Hr.png', 'OL_Air-Soil-30Day.png',
@@ -21,8 +23,49 @@ RT_EXPECTED_FILES_SET = set(
 
 LOCAL_DIRECTORY_BASE = '/tmp/blackrock/'
 
+# Where to remember the size and checksum of each file we last fetched.
+FETCH_MANIFEST = '/tmp/blackrock_manifest.json'
+# Files that only ever grow at the end. Only the new bytes of these are
+# downloaded each run.
+TAIL_FETCH_FILETYPES = ['.csv']
+# Downloads are streamed to disk this many bytes at a time.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# How many files to download from Drive at once.
+FETCH_WORKERS = 8
+# Drive calls are limited to this many a second, shared by all the
+# threads of a process, in bursts of up to DRIVE_REQUEST_BURST. The rate
+# is halved whenever Drive throttles us, and recovers as calls succeed.
+DRIVE_REQUEST_RATE = 10
+DRIVE_REQUEST_BURST = 20
+# Drive calls that failed in a way that might not happen again
+# (throttling, 5xx errors, dropped connections) are retried up to this
+# many times. Unless Drive says how long to wait, the backoff is random,
+# up to DRIVE_BACKOFF_BASE seconds doubling with each retry, capped at
+# DRIVE_BACKOFF_MAX.
+DRIVE_MAX_RETRIES = 8
+DRIVE_BACKOFF_BASE = 1
+DRIVE_BACKOFF_MAX = 64
+# Drive calls give up rather than wait past this many seconds into a
+# data or photo fetcher run.
+DATA_RUN_DEADLINE = 30 * 60
+PHOTO_RUN_DEADLINE = 45
+# Each distinct file content is stored once here, and the hourly
+# directories hard-link to it. Must be on the same filesystem as
+# LOCAL_DIRECTORY_BASE, but not inside it. None stores every file in
+# full.
+BLOB_STORE_DIR = '/tmp/blackrock_blobs/'
+
 CONVERT = '/usr/bin/convert'
+# 'pillow' makes webcam thumbnails in-process, 'convert' runs CONVERT.
+# We fall back to CONVERT if Pillow isn't installed.
+THUMBNAIL_BACKEND = 'pillow'
+THUMBNAIL_QUALITY = 85
+# The webcam thumbnails to make, as filename suffix: (width, height).
+# Each one also gets a current_<suffix>.jpg symlink.
+THUMBNAIL_SIZES = {'thumb': (207, 207)}
 
+# Downloads are removed this many days after the hour they were
+# fetched in.
 PURGE_OLDER_THAN = '+30'
 
 DEBUG = True
@@ -30,7 +73,45 @@ DEBUG = True
 REMOTE_FILENAME = 'Lodge.jpg'
 LOCAL_WEBCAM_DIRECTORY_BASE = ''
 LOCAL_FILENAME_PREFIX = 'Black_Rock'
+# Webcam photos are removed this many days after the day they were
+# taken. None keeps them forever.
+WEBCAM_PURGE_OLDER_THAN = '+30'
+# The webcam photo's Drive file id is cached here so we don't have to
+# list the Drive every minute. It's looked up again after
+# PHOTO_ID_CACHE_TTL seconds, in case the file is replaced.
+PHOTO_ID_CACHE = '/tmp/blackrock_photo_id.json'
+PHOTO_ID_CACHE_TTL = 60 * 60
 
 PROCESSED_DATA_DIR = '/tmp/processed/'
+# Only process the rows added to the logger files since the last run.
+# Set to False to rebuild the processed files from scratch every hour.
+INCREMENTAL_PROCESSING = True
+# 'python' or 'numpy'. The numpy backend gives the same output, faster,
+# and is only used if numpy is installed.
+PROCESSING_BACKEND = 'python'
+# How many station files to process at once, each in its own process.
+PROCESSING_WORKERS = 4
+# Hourly and daily min/max/mean/std of each processed file go here.
+ROLLUP_DATA_DIR = '/tmp/processed/rollups/'
+# Each fetcher run writes a JSON record of its stage timings and
+# counters here, and the same as a Prometheus textfile-collector file.
+# None turns this off.
+METRICS_DIR = None
+# Where the data fetcher keeps track of how fresh each station's data
+# is, how many days of lag samples it keeps, and how old (in seconds) a
+# station's newest row can be before it's reported as stalled.
+FRESHNESS_FILE = '/tmp/blackrock_freshness.json'
+FRESHNESS_WINDOW = 7
+STALE_AFTER = 2 * 60 * 60
+# blackrock_backfill.py processes into this directory, which has to be
+# on the same filesystem as PROCESSED_DATA_DIR, in chunks of this many
+# days, this many at once (None for one per core).
+BACKFILL_STAGING_DIR = '/tmp/processed/backfill/'
+BACKFILL_CHUNK_DAYS = 30
+BACKFILL_WORKERS = None
+# How often blackrock_daemon.py runs each fetcher, in seconds.
+DAEMON_PHOTO_INTERVAL = 60
+DAEMON_DATA_INTERVAL = 60 * 60
+
 # Explicit Directory required for cron job during production
 ACCESS_DIR = '/Users/<user_profile>/blackrock_fetcher/'
@@ -0,0 +1,194 @@
+"""
+A local stand-in for the Drive v3 API, for testing how we cope with
+throttling and errors.
+
+FakeDrive serves files().list() and files().get_media() (with Range
+requests) over HTTP on localhost, and service() returns a real
+googleapiclient Drive service pointed at it. Errors are injected with
+fail(), and quota sets a requests-per-second limit beyond which
+requests are refused with 403 rateLimitExceeded, as Drive does.
+"""
+import collections
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import httplib2
+from googleapiclient.discovery import build
+
+FILES_PATH = '/drive/v3/files'
+
+
+class Fault(object):
+    def __init__(self, status, reason, retry_after, path, after):
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+        self.path = path
+        self.after = after
+
+
+class FakeDrive(object):
+    """
+    files maps each file id to its (name, content). Use as a context
+    manager, or call start() and stop().
+    """
+
+    def __init__(self, files=None, quota=None):
+        self.files = dict(files or {})
+        self.quota = quota
+        self.faults = []
+        self.requests = []
+        self.recent = collections.deque()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.server.drive = self
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.server.serve_forever,
+            kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def service(self):
+        """Returns a Drive service (for one thread) that talks to us."""
+        return build('drive', 'v3', http=httplib2.Http(),
+                     static_discovery=True,
+                     client_options={'api_endpoint': self.url + '/drive/v3/'})
+
+    def fail(self, status, times=1, reason=None, retry_after=None,
+             path=None, after=0):
+        """
+        Fail the next times requests (to path, if given, after letting
+        after of them through) with status. reason is the Drive error
+        reason, e.g. 'rateLimitExceeded'.
+        """
+        for i in range(times):
+            self.faults.append(
+                Fault(status, reason, retry_after, path, after))
+
+    def statuses(self, path=None):
+        """Returns the statuses of the requests made (to path)."""
+        return [status for p, status in self.requests
+                if path is None or p == path]
+
+    def check(self, path):
+        """Returns the Fault to respond to a request with, or None."""
+        with self.lock:
+            for fault in self.faults:
+                if fault.path in (None, path):
+                    if fault.after:
+                        fault.after -= 1
+                        break
+                    self.faults.remove(fault)
+                    return fault
+            if self.quota is None:
+                return None
+            now = time.monotonic()
+            while self.recent and self.recent[0] <= now - 1:
+                self.recent.popleft()
+            if len(self.recent) >= self.quota:
+                return Fault(403, 'rateLimitExceeded', None, path, 0)
+            self.recent.append(now)
+        return None
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        drive = self.server.drive
+        url = urlsplit(self.path)
+        self.url_path = url.path
+        params = parse_qs(url.query)
+        fault = drive.check(url.path)
+        if fault:
+            self.send_fault(fault)
+        elif url.path == FILES_PATH:
+            self.send_list(params)
+        elif url.path.startswith(FILES_PATH + '/') and \
+                params.get('alt') == ['media']:
+            self.send_media(url.path[len(FILES_PATH) + 1:])
+        else:
+            self.send_json(404, error_body(404, 'notFound'))
+
+    def start_response(self, status):
+        # Noted before the client can see the response.
+        drive = self.server.drive
+        with drive.lock:
+            drive.requests.append((self.url_path, status))
+        self.send_response(status)
+
+    def send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode('utf-8')
+        self.start_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_fault(self, fault):
+        headers = []
+        if fault.retry_after is not None:
+            headers.append(('Retry-After', str(fault.retry_after)))
+        self.send_json(fault.status, error_body(
+            fault.status, fault.reason or 'backendError'), headers)
+
+    def send_list(self, params):
+        files = [{'id': file_id, 'name': name}
+                 for file_id, (name, content) in
+                 sorted(self.server.drive.files.items())]
+        page_size = int(params.get('pageSize', ['100'])[0])
+        start = int(params.get('pageToken', ['0'])[0])
+        body = {'files': files[start:start + page_size]}
+        if start + page_size < len(files):
+            body['nextPageToken'] = str(start + page_size)
+        self.send_json(200, body)
+
+    def send_media(self, file_id):
+        if file_id not in self.server.drive.files:
+            self.send_json(404, error_body(404, 'notFound'))
+            return
+        content = self.server.drive.files[file_id][1]
+        status = 200
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match:
+            status = 206
+            first = int(match.group(1))
+            last = int(match.group(2) or len(content) - 1)
+            part = content[first:last + 1]
+        else:
+            part = content
+        self.start_response(status)
+        self.send_header('Content-Length', str(len(part)))
+        if match:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+                first, first + len(part) - 1, len(content)))
+        self.end_headers()
+        self.wfile.write(part)
+
+
+def error_body(status, reason):
+    return {'error': {'code': status, 'message': reason, 'errors': [
+        {'domain': 'usageLimits', 'reason': reason, 'message': reason}]}}
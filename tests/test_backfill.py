@@ -0,0 +1,251 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import blackrock_backfill
+from blackrock_backfill import (
+    backfill, chunk_ranges, pick_snapshot, position_before
+)
+from blackrock_data_processor import TIME_FMT, load_checkpoint
+from blackrock_stations import STATIONS, process_station
+from tests.test_data_processor import (
+    DENDROMETER_HEADER, ENVIRONMENTAL_HEADER, toa5_lines
+)
+
+
+def station(filename, **changes):
+    station = dict([s for s in STATIONS if s['filename'] == filename][0])
+    station.update(changes)
+    return station
+
+
+class TestBackfill(unittest.TestCase):
+    start = datetime(2016, 9, 16, 12)
+    headers = {'Lowland.csv': ENVIRONMENTAL_HEADER,
+               'White_Oak_Table20.csv': DENDROMETER_HEADER}
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.out = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base)
+        self.addCleanup(shutil.rmtree, self.out)
+        self.staging = os.path.join(self.out, 'backfill')
+        for name, value in (
+                ('blackrock_data_processor.PROCESSED_DATA_DIR', self.out),
+                ('blackrock_query.PROCESSED_DATA_DIR', self.out),
+                ('blackrock_column_cache.PROCESSED_DATA_DIR', self.out),
+                ('blackrock_rollup.PROCESSED_DATA_DIR', self.out),
+                ('blackrock_rollup.ROLLUP_DATA_DIR',
+                 os.path.join(self.out, 'rollups')),
+                ('blackrock_stations.DEBUG', False),
+                ('blackrock_backfill.PROCESSED_DATA_DIR', self.out),
+                ('blackrock_backfill.BACKFILL_STAGING_DIR', self.staging),
+                ('blackrock_backfill.LOCAL_DIRECTORY_BASE', self.base)):
+            patcher = mock.patch(name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Hourly snapshots of the growing logger files.
+        for day, count in ((17, 60), (18, 150), (19, 200)):
+            self.newest = self.write_snapshot(day, count)
+
+    def write_snapshot(self, day, count):
+        path = os.path.join(self.base, '2016', '09', '%02d' % day, '00')
+        os.makedirs(path)
+        for filename, header in self.headers.items():
+            with open(os.path.join(path, filename), 'w', newline='') as f:
+                f.write(toa5_lines(header, self.start, count))
+        return path
+
+    def read(self, filename):
+        with open(os.path.join(self.out, filename), 'rb') as f:
+            return f.read()
+
+    def processed(self, path, stations):
+        """Returns the output and checkpoints of processing from scratch."""
+        shutil.rmtree(self.out)
+        os.mkdir(self.out)
+        result = {}
+        for s in stations:
+            process_station(path, s)
+            result[s['filename']] = (
+                self.read(s['filename']), load_checkpoint(s['filename']))
+        return result
+
+    def backfilled(self, stations):
+        return dict((s['filename'], (self.read(s['filename']),
+                                     load_checkpoint(s['filename'])))
+                    for s in stations)
+
+    def test_full_backfill(self):
+        stations = [station('Lowland.csv'), station('White_Oak_Table20.csv')]
+        filenames = [s['filename'] for s in stations]
+        for workers in (1, 2):
+            shutil.rmtree(self.out)
+            os.mkdir(self.out)
+            self.assertEqual(backfill(filenames, workers=workers,
+                                      chunk_days=0.5), {})
+            result = self.backfilled(stations)
+            self.assertEqual(os.listdir(self.staging), [])
+            self.assertTrue(os.path.exists(os.path.join(
+                self.out, 'Lowland.csv.index')))
+            self.assertEqual(result, self.processed(self.newest, stations))
+
+        # The hourly runs carry on from the backfill.
+        shutil.rmtree(self.out)
+        os.mkdir(self.out)
+        backfill(filenames, workers=1)
+        newer = self.write_snapshot(20, 230)
+        for s in stations:
+            process_station(newer, s)
+        self.assertEqual(self.backfilled(stations),
+                         self.processed(newer, stations))
+
+    def test_range(self):
+        old = station('White_Oak_Table20.csv')
+        new = station('White_Oak_Table20.csv',
+                      voltage_vals=[150.0, 70.0, 100.0, 270.0, 450.0])
+        new_lines = self.processed(self.newest, [new])[
+            new['filename']][0].splitlines(True)
+        old_output, old_checkpoint = self.processed(
+            self.newest, [old])[old['filename']]
+
+        start = datetime(2016, 9, 17, 3)
+        end = datetime(2016, 9, 17, 20)
+        with mock.patch.object(blackrock_backfill, 'STATIONS', [new]):
+            self.assertEqual(backfill(start_dt=start, end_dt=end,
+                                      workers=1, chunk_days=0.25), {})
+        lines = self.read(old['filename']).splitlines(True)
+
+        start, end = start.strftime(TIME_FMT), end.strftime(TIME_FMT)
+        expected = [
+            new_line if start <= old_line[1:20].decode() <= end
+            else old_line for old_line, new_line in zip(
+                old_output.splitlines(True), new_lines)]
+        self.assertNotEqual(lines, old_output.splitlines(True))
+        self.assertEqual(lines, expected)
+        # The rows after the range came from the old checkpoint.
+        checkpoint = load_checkpoint(old['filename'])
+        self.assertEqual(checkpoint['timestamp'], old_checkpoint['timestamp'])
+        self.assertEqual(checkpoint['output_size'], len(b''.join(lines)))
+
+    def test_range_past_processed_data(self):
+        stations = [station('Lowland.csv'), station('White_Oak_Table20.csv')]
+        first = os.path.join(self.base, '2016', '09', '17', '00')
+        for s in stations:
+            process_station(first, s)
+        # The range ends after the last row processed so far, so none
+        # of the old rows are kept after it, nor is the old checkpoint.
+        self.assertEqual(backfill(
+            [s['filename'] for s in stations],
+            start_dt=datetime(2016, 9, 16, 12),
+            end_dt=datetime(2016, 9, 18), workers=1), {})
+        for s in stations:
+            self.assertEqual(load_checkpoint(s['filename'])['timestamp'],
+                             '2016-09-18 00:00:00')
+            process_station(self.newest, s)
+        self.assertEqual(self.backfilled(stations),
+                         self.processed(self.newest, stations))
+
+    def test_resume(self):
+        s = station('Lowland.csv')
+        station_rows = blackrock_backfill.station_rows
+
+        def failing(fname, station, start, end):
+            if start == '2016-09-17 12:00:00':
+                raise ValueError('bad chunk')
+            return station_rows(fname, station, start, end)
+
+        with mock.patch.object(blackrock_backfill, 'station_rows',
+                               side_effect=failing):
+            errors = backfill(['Lowland.csv'], workers=1, chunk_days=0.5)
+        self.assertIn('bad chunk', errors['Lowland.csv'])
+        self.assertFalse(os.path.exists(os.path.join(self.out, 'Lowland.csv')))
+        chunks = os.listdir(os.path.join(self.staging, 'Lowland.csv'))
+        self.assertEqual(len(chunks), 2 * 5)
+
+        with mock.patch.object(blackrock_backfill, 'station_rows',
+                               side_effect=station_rows) as rows:
+            self.assertEqual(backfill(['Lowland.csv'], workers=1,
+                                      chunk_days=0.5), {})
+        self.assertEqual(rows.call_count, 1)
+        self.assertEqual(self.backfilled([s]),
+                         self.processed(self.newest, [s]))
+
+    def test_changed_chunk_is_redone(self):
+        station_rows = blackrock_backfill.station_rows
+
+        def failing(fname, station, start, end):
+            if start == '2016-09-18 12:00:00':
+                raise ValueError('bad chunk')
+            return station_rows(fname, station, start, end)
+
+        with mock.patch.object(blackrock_backfill, 'station_rows',
+                               side_effect=failing):
+            backfill(['Lowland.csv'], workers=1, chunk_days=1)
+        # As if the first chunk was read from another snapshot.
+        fname = os.path.join(
+            self.staging, 'Lowland.csv', '20160916120000.csv.json')
+        with open(fname) as f:
+            result = json.load(f)
+        result['params']['snapshot'] = 'elsewhere'
+        with open(fname, 'w') as f:
+            json.dump(result, f)
+
+        with mock.patch.object(blackrock_backfill, 'backfill_chunk',
+                               return_value='failed') as chunk:
+            backfill(['Lowland.csv'], workers=1, chunk_days=1)
+        self.assertEqual(
+            [c[0][0]['start'] for c in chunk.call_args_list],
+            ['2016-09-16 12:00:00', '2016-09-18 12:00:00'])
+
+    def test_position_before(self):
+        fname = os.path.join(self.newest, 'Lowland.csv')
+        with open(fname, 'rb') as f:
+            lines = f.readlines()
+        line_starts = [sum(len(line) for line in lines[:i])
+                       for i in range(len(lines))]
+        with mock.patch.object(blackrock_backfill, 'BISECT_BYTES', 100):
+            self.assertIsNone(position_before(fname, '2016-09-16 12:00:00'))
+            for n in (1, 2, 57, 199, 200, 300):
+                expected = {
+                    'line_start': line_starts[min(n, 200) + 3],
+                    'offset': line_starts[min(n, 200) + 3] +
+                    len(lines[min(n, 200) + 3]),
+                    'timestamp': (self.start + timedelta(
+                        minutes=20 * (min(n, 200) - 1))).strftime(TIME_FMT),
+                }
+                ts = self.start + timedelta(minutes=20 * n)
+                for start in (ts, ts - timedelta(minutes=1)):
+                    self.assertEqual(
+                        position_before(fname, start.strftime(TIME_FMT)),
+                        expected)
+
+    def test_pick_snapshot(self):
+        spans = [
+            ('2016-09-01 00:00:00', '2016-09-05 00:00:00', 'a'),
+            ('2016-09-01 00:00:00', '2016-09-10 00:00:00', 'b'),
+            # The logger was reset.
+            ('2016-09-09 00:00:00', '2016-09-20 00:00:00', 'c'),
+        ]
+        self.assertEqual(pick_snapshot(spans, '2016-09-02 00:00:00'), 'b')
+        self.assertEqual(pick_snapshot(spans, '2016-09-12 00:00:00'), 'c')
+        self.assertEqual(pick_snapshot(spans, '2016-08-01 00:00:00'), 'b')
+
+    def test_chunk_ranges(self):
+        start = datetime(2016, 9, 1)
+        self.assertEqual(
+            chunk_ranges(start, datetime(2016, 9, 2, 12), None, 1), [
+                ['2016-09-01 00:00:00', '2016-09-02 00:00:00'],
+                ['2016-09-02 00:00:00', '2016-09-02 12:00:01']])
+        self.assertEqual(
+            chunk_ranges(start, None, '2016-09-02 12:00:00', 1), [
+                ['2016-09-01 00:00:00', '2016-09-02 00:00:00'],
+                ['2016-09-02 00:00:00', None]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.suite import STAGES, run_suite
+
+
+class TestSuite(unittest.TestCase):
+
+    def test_run_suite(self):
+        # Five weeks of minutely data, enough for the synthetic "NAN"s
+        # to land in the dendrometer voltages, runs through every stage.
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        results = run_suite(workdir, 0.1, 1, 'python', 1)
+        self.assertEqual(sorted(results),
+                         sorted(stage for stage, filename in STAGES))
+        for result in results.values():
+            self.assertEqual(result['rows'], 52560)
+            self.assertGreater(result['rows_per_second'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
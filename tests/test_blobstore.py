@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from blackrock_blobstore import collect_garbage, store_file
+
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base)
+        self.store = os.path.join(self.base, 'blobs')
+
+    def write_hour(self, hour, files):
+        d = os.path.join(self.base, 'data', hour)
+        os.makedirs(d)
+        paths = []
+        for name, content in files.items():
+            path = os.path.join(d, name)
+            with open(path, 'wb') as f:
+                f.write(content)
+            paths.append(path)
+        return paths
+
+    def blobs(self):
+        return sorted(name for dirpath, dirnames, filenames
+                      in os.walk(self.store) for name in filenames)
+
+    def test_identical_content_is_stored_once(self):
+        first = self.write_hour('00', {'a.png': b'chart', 'b.csv': b'1,2\n'})
+        second = self.write_hour('01', {'a.png': b'chart', 'b.csv': b'1,3\n'})
+
+        self.assertEqual([store_file(p, self.store) for p in first],
+                         [True, True])
+        self.assertEqual([store_file(p, self.store) for p in second],
+                         [False, True])
+        self.assertEqual(len(self.blobs()), 3)
+
+        self.assertTrue(os.path.samefile(first[0], second[0]))
+        self.assertFalse(os.path.samefile(first[1], second[1]))
+        with open(second[0], 'rb') as f:
+            self.assertEqual(f.read(), b'chart')
+
+        # Storing a file again is harmless.
+        self.assertFalse(store_file(second[0], self.store))
+        self.assertEqual(os.stat(second[0]).st_nlink, 3)
+
+    def test_collect_garbage(self):
+        first = self.write_hour('00', {'a.png': b'chart', 'b.csv': b'1,2\n'})
+        second = self.write_hour('01', {'a.png': b'chart', 'b.csv': b'1,3\n'})
+        for path in first + second:
+            store_file(path, self.store)
+
+        self.assertEqual(collect_garbage(self.store), (0, 0))
+
+        # Purge the first hour.
+        for path in first:
+            os.remove(path)
+        self.assertEqual(collect_garbage(self.store), (1, 4))
+        self.assertEqual(len(self.blobs()), 2)
+        with open(second[1], 'rb') as f:
+            self.assertEqual(f.read(), b'1,3\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import csv
+import math
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import blackrock_column_cache
+from blackrock_column_cache import (
+    EPOCH, ColumnCache, cache_dir, update_cache
+)
+from blackrock_columnar import np
+
+
+class TestColumnCache(unittest.TestCase):
+    start = datetime(2016, 9, 16, 12)
+    header = ['TIMESTAMP', 'AvgTEMP_C', 'TotalRain']
+
+    def setUp(self):
+        self.out = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out)
+        for name, value in (('PROCESSED_DATA_DIR', self.out),
+                            ('BATCH_SIZE', 7)):
+            patcher = mock.patch.object(blackrock_column_cache, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.rows = []
+
+    def write_rows(self, first, count, header=True, mode='a'):
+        rows = [[(self.start + timedelta(minutes=20 * n)).strftime(
+            '%Y-%m-%d %H:%M:%S'), n * 0.5, 'NAN' if n % 10 == 3 else -n * 1.0]
+            for n in range(first, first + count)]
+        with open(os.path.join(self.out, 'Lowland.csv'), mode) as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
+            if header:
+                writer.writerow(self.header)
+            writer.writerows(rows)
+        self.rows += rows
+
+    def assertCached(self, names=None):
+        with ColumnCache('Lowland.csv') as cache:
+            self.assertEqual(cache.names, names or self.header[1:])
+            self.assertEqual(cache.rows, len(self.rows))
+            self.assertEqual(
+                [(EPOCH + timedelta(seconds=t)).strftime('%Y-%m-%d %H:%M:%S')
+                 for t in cache.timestamps],
+                [row[0] for row in self.rows])
+            for i, name in enumerate(cache.names, 1):
+                self.assertEqual(
+                    [repr(x) for x in cache.column(name)],
+                    [repr(row[i] if row[i] != 'NAN' else math.nan)
+                     for row in self.rows])
+
+    def test_incremental_matches_rebuild(self):
+        self.write_rows(0, 20)
+        update_cache('Lowland.csv')
+        self.assertCached()
+        for first, count in ((20, 1), (21, 30)):
+            self.write_rows(first, count, header=False)
+            update_cache('Lowland.csv')
+            self.assertCached()
+        incremental = dict(
+            (name, open(os.path.join(cache_dir('Lowland.csv'), name),
+                        'rb').read())
+            for name in ('timestamps', 'column_1', 'column_2'))
+
+        shutil.rmtree(cache_dir('Lowland.csv'))
+        update_cache('Lowland.csv')
+        for name, data in incremental.items():
+            with open(os.path.join(cache_dir('Lowland.csv'), name),
+                      'rb') as f:
+                self.assertEqual(f.read(), data)
+
+    def test_interrupted_append(self):
+        self.write_rows(0, 10)
+        update_cache('Lowland.csv')
+        with open(os.path.join(cache_dir('Lowland.csv'), 'column_1'),
+                  'ab') as f:
+            f.write(b'half a row')
+        self.write_rows(10, 5, header=False)
+        update_cache('Lowland.csv')
+        self.assertCached()
+
+    def test_rewritten_file(self):
+        self.write_rows(0, 10)
+        update_cache('Lowland.csv')
+        self.rows = []
+        self.write_rows(500, 4, header=False, mode='w')
+        update_cache('Lowland.csv')
+        self.assertCached(['COLUMN_1', 'COLUMN_2'])
+
+    def test_names_for_headerless_file(self):
+        self.write_rows(0, 10, header=False)
+        update_cache('Lowland.csv', ['Site AVG', 'TotalRain'])
+        self.assertCached(['Site AVG', 'TotalRain'])
+        # A header takes precedence.
+        shutil.rmtree(cache_dir('Lowland.csv'))
+        self.rows = []
+        self.write_rows(0, 10, mode='w')
+        update_cache('Lowland.csv', ['Site AVG', 'TotalRain'])
+        self.assertCached()
+
+    def test_time_range(self):
+        self.write_rows(0, 30)
+        update_cache('Lowland.csv')
+        with ColumnCache('Lowland.csv') as cache:
+            self.assertEqual(cache.time_range(), (0, 30))
+            self.assertEqual(cache.time_range(
+                datetime(2016, 9, 16, 13), datetime(2016, 9, 16, 14)),
+                (3, 7))
+            self.assertEqual(cache.time_range(
+                datetime(2016, 9, 16, 13, 5), datetime(2016, 9, 16, 13, 10)),
+                (4, 4))
+            self.assertEqual(
+                list(cache.column('AvgTEMP_C')[3:7]), [1.5, 2.0, 2.5, 3.0])
+            if np is not None:
+                column = np.frombuffer(cache.column('AvgTEMP_C'))
+                self.assertEqual(column[3:7].sum(), 9.0)
+                del column
+
+    def test_empty(self):
+        with open(os.path.join(self.out, 'Lowland.csv'), 'w') as f:
+            f.write('"TIMESTAMP","AvgTEMP_C","TotalRain"\r\n')
+        update_cache('Lowland.csv')
+        with ColumnCache('Lowland.csv') as cache:
+            self.assertEqual(cache.rows, 0)
+            self.assertEqual(cache.time_range(datetime(2016, 1, 1)), (0, 0))
+        self.assertRaises(IOError, ColumnCache, 'Mnt_Misery.csv')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import copy
+import random
+import unittest
+from datetime import datetime, timedelta
+
+import blackrock_data_processor as processor
+from blackrock_columnar import np
+
+if np is not None:
+    import blackrock_columnar as columnar
+
+
+def random_rows(header, count, start=datetime(2016, 9, 10, 12)):
+    rnd = random.Random(count)
+    rows = [list(header)]
+    for n in range(count):
+        ts = start + timedelta(minutes=20 * n)
+        rows.append([ts.strftime('%Y-%m-%d %H:%M:%S')] + [
+            rnd.uniform(-500, 500) for name in header[1:]])
+    # The logger writes "NAN" for missing readings.
+    rows[count // 2][3] = 'NAN'
+    return rows
+
+
+DENDROMETER_HEADER = ['TIMESTAMP', 'RECORD', 'Battery_Volt_MIN'] + [
+    'Red_Oak_%d_%s' % (i, agg)
+    for i in range(1, 6) for agg in ('AVG', 'MAX')]
+MAILLEY_HEADER = ['TIMESTAMP', 'RECORD'] + [
+    '%s_%d_AVG' % (tree, i)
+    for tree in ('Hemlock', 'Pine') for i in range(1, 4)]
+ENVIRONMENTAL_HEADER = [
+    'TIMESTAMP', 'RECORD', 'AvgTEMP_C', 'MinTEMP_C', 'AvgVP', 'TotalRain',
+    'SoilM_5cm', 'AvgPAR_Den', 'MaxPAR_Den']
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class TestColumnarParity(unittest.TestCase):
+    def assertSameOutput(self, python_func, numpy_func, rows, *args):
+        expected = python_func(copy.deepcopy(rows), *args)
+        actual = numpy_func(copy.deepcopy(rows), *args)
+        # Compare reprs, so NaNs compare equal and floats must match
+        # to the last bit.
+        self.assertEqual(repr(actual), repr(expected))
+
+    def test_dendrometer_rows(self):
+        rows = random_rows(DENDROMETER_HEADER, 500)
+        start_dt = datetime(2016, 9, 12, 5)
+        for rename_trees in (None, 'White_Oak'):
+            self.assertSameOutput(
+                processor.dendrometer_rows, columnar.dendrometer_rows,
+                rows, start_dt, rename_trees)
+
+    def test_mailley_rows(self):
+        self.assertSameOutput(
+            processor.dendrometer_rows, columnar.dendrometer_rows,
+            random_rows(MAILLEY_HEADER, 500), datetime(2016, 9, 10, 17),
+            None, True)
+
+    def test_environmental_rows(self):
+        rows = random_rows(ENVIRONMENTAL_HEADER, 500)
+        # A row whose timestamp can't be parsed is kept, as with
+        # filter_rows.
+        rows[10][0] = 'not a timestamp'
+        for start_dt, end_dt in ((None, None),
+                                 (datetime(2016, 9, 11), None),
+                                 (datetime(2016, 9, 11),
+                                  datetime(2016, 9, 13, 0, 20))):
+            self.assertSameOutput(
+                processor.environmental_rows, columnar.environmental_rows,
+                rows, start_dt, end_dt)
+
+    def test_rdh_rows(self):
+        rows = processor.dendrometer_rows(
+            random_rows(DENDROMETER_HEADER, 500), datetime(2016, 9, 10, 17))
+        rows = rows[1:]
+        # The "NAN" is passed through.
+        self.assertIn('NAN', sum(processor.rdh_rows(
+            copy.deepcopy(rows), [1] * 5, [1] * 5), []))
+        self.assertSameOutput(
+            processor.rdh_rows, columnar.rdh_rows, rows,
+            [32.1, 33.3, 46.7, 30.0, 26.7],
+            [160.8, 71.33, 100.4, 277.4, 456.6])
+        self.assertEqual(columnar.rdh_rows([], [], []), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import signal
+import threading
+import time
+import unittest
+from unittest import mock
+
+from google.oauth2.credentials import Credentials
+
+import blackrock_daemon
+from blackrock_daemon import Job, next_boundary, run_scheduler
+
+
+class TestNextBoundary(unittest.TestCase):
+    def test_next_boundary(self):
+        self.assertEqual(next_boundary(125, 60), 180)
+        self.assertEqual(next_boundary(120, 60), 180)
+        self.assertEqual(next_boundary(0, 3600), 3600)
+        self.assertEqual(next_boundary(3599.5, 3600), 3600)
+
+
+class TestJob(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(blackrock_daemon, 'DEBUG', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_overlapping_run_is_skipped(self):
+        release = threading.Event()
+        runs = []
+
+        def func():
+            runs.append(time.time())
+            release.wait(5)
+
+        job = Job('slow', 60, func)
+        thread = job.start()
+        self.assertIsNotNone(thread)
+        with mock.patch('sys.stdout'):
+            self.assertIsNone(job.start())
+        release.set()
+        thread.join()
+        self.assertEqual(len(runs), 1)
+
+        thread = job.start()
+        self.assertIsNotNone(thread)
+        thread.join()
+        self.assertEqual(len(runs), 2)
+
+    def test_failed_run_releases_the_job(self):
+        job = Job('broken', 60, mock.Mock(side_effect=ValueError('boom')))
+        with mock.patch('traceback.print_exc'):
+            job.start().join()
+            thread = job.start()
+            self.assertIsNotNone(thread)
+            thread.join()
+        self.assertEqual(job.func.call_count, 2)
+
+    def test_next_run_skips_missed_boundaries(self):
+        job = Job('job', 60, mock.Mock())
+        job.next_run = time.time() - 150
+        job.start().join()
+        self.assertGreater(job.next_run, time.time())
+        self.assertLessEqual(job.next_run, time.time() + 60)
+
+
+class TestRunScheduler(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(blackrock_daemon, 'DEBUG', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_runs_until_stopped(self):
+        stop = threading.Event()
+        runs = []
+        finished = []
+
+        def func():
+            runs.append(time.time())
+            time.sleep(0.05)
+            finished.append(time.time())
+
+        job = Job('quick', 0.1, func)
+        threading.Timer(0.45, stop.set).start()
+        started = time.time()
+        run_scheduler([job], stop)
+        self.assertLess(time.time() - started, 1)
+        self.assertGreaterEqual(len(runs), 3)
+        # The running job was waited for.
+        self.assertEqual(len(finished), len(runs))
+
+    def test_stopped_before_the_first_run(self):
+        stop = threading.Event()
+        stop.set()
+        func = mock.Mock()
+        run_scheduler([Job('job', 3600, func)], stop)
+        self.assertFalse(func.called)
+
+    def test_sigterm_stops_the_daemon(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        events = []
+        jobs = []
+
+        def scheduler(scheduled, stop):
+            jobs.extend(scheduled)
+            events.append([job.name for job in jobs])
+            os.kill(os.getpid(), signal.SIGTERM)
+            events.append(stop.wait(5))
+
+        with mock.patch.multiple(
+                blackrock_daemon, run_scheduler=scheduler,
+                build=mock.DEFAULT) as patched, \
+                mock.patch('blackrock_data_fetcher.main') as data_main, \
+                mock.patch('blackrock_data_fetcher.get_credentials',
+                           return_value=Credentials('token')) as creds, \
+                mock.patch('sys.stdout'):
+            self.assertEqual(blackrock_daemon.main(), 0)
+            jobs[1].func()
+        self.assertEqual(events, [['photo fetch', 'data fetch'], True])
+        # The credentials are loaded once, and each job gets its own copy.
+        self.assertEqual(creds.call_count, 1)
+        photo_creds = patched['build'].call_args[1]['credentials']
+        data_creds = data_main.call_args[1]['creds']
+        self.assertIsNot(photo_creds, data_creds)
+        self.assertEqual(photo_creds.token, data_creds.token)
+
+
+if __name__ == '__main__':
+    unittest.main()
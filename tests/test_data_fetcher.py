@@ -0,0 +1,332 @@
+import errno
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from google.oauth2.credentials import Credentials
+
+import blackrock_data_fetcher
+from blackrock_data_fetcher import (
+    bytes_skipped, fetch_all, fetch_file, fetch_files, get_thread_service,
+    is_unchanged, link_unchanged_file, tail_fetch_file
+)
+from blackrock_metrics import collecting
+
+
+class FakeMediaRequest(object):
+    """Stands in for files().get_media(), honoring the Range header."""
+
+    def __init__(self, content):
+        self.content = content
+        self.headers = {}
+
+    def execute(self):
+        first = int(self.headers['Range'][len('bytes='):-1])
+        return self.content[first:]
+
+
+class FakeFiles(object):
+    def __init__(self, files):
+        self.files = files
+        self.requests = []
+
+    def get_media(self, fileId):
+        request = FakeMediaRequest(self.files[fileId])
+        self.requests.append(request)
+        return request
+
+
+class FakeService(object):
+    def __init__(self, files):
+        self._files = FakeFiles(files)
+
+    def files(self):
+        return self._files
+
+
+class TestTailFetch(unittest.TestCase):
+    content = b''.join(b'"2016-09-16 12:%02d:00",%d\r\n' % (i, i)
+                       for i in range(60))
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.previous_path = os.path.join(self.dir, 'previous.csv')
+        with open(self.previous_path, 'wb') as f:
+            f.write(self.content[:1000])
+        self.local_dir = os.path.join(self.dir, 'new')
+        os.mkdir(self.local_dir)
+        self.previous = {
+            'id': 'a', 'path': self.previous_path, 'size': 1000}
+
+    def metadata(self, content):
+        return {'id': 'a', 'name': 'Lowland.csv', 'size': len(content),
+                'md5Checksum': hashlib.md5(content).hexdigest()}
+
+    def test_range_request(self):
+        service = FakeService({'a': self.content})
+        self.assertTrue(tail_fetch_file(
+            service, self.metadata(self.content), self.local_dir,
+            self.previous))
+        self.assertEqual(
+            [r.headers['Range'] for r in service.files().requests],
+            ['bytes=1000-'])
+        with open(os.path.join(self.local_dir, 'Lowland.csv'), 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_rewritten_file_falls_back(self):
+        # The start of the file changed, so the checksum doesn't match
+        # what we'd build from the previous copy.
+        rewritten = b'X' + self.content[1:]
+        service = FakeService({'a': rewritten})
+        self.assertFalse(tail_fetch_file(
+            service, self.metadata(rewritten), self.local_dir,
+            self.previous))
+        self.assertEqual(os.listdir(self.local_dir), [])
+
+    def test_truncated_file_falls_back(self):
+        service = FakeService({'a': self.content[:500]})
+        self.assertFalse(tail_fetch_file(
+            service, self.metadata(self.content[:500]), self.local_dir,
+            self.previous))
+        self.assertEqual(service.files().requests, [])
+
+
+class TestFetchFile(unittest.TestCase):
+    content = b'"2016-09-16 12:00:00",1\r\n' * 50
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.old_dir = os.path.join(self.dir, 'old')
+        self.local_dir = os.path.join(self.dir, 'new')
+        os.mkdir(self.old_dir)
+        os.mkdir(self.local_dir)
+        self.previous = self.write_previous(self.content)
+        self.downloads = []
+        patcher = mock.patch.multiple(
+            blackrock_data_fetcher, DEBUG=False,
+            download_to_file=self.fake_download)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_previous(self, content):
+        path = os.path.join(self.old_dir, 'Lowland.csv')
+        with open(path, 'wb') as f:
+            f.write(content)
+        return {'id': 'a', 'path': path, 'size': len(content),
+                'md5Checksum': hashlib.md5(content).hexdigest(),
+                'modifiedTime': '2016-09-16T12:00:00.000Z'}
+
+    def fake_download(self, request, local_path, chunksize):
+        self.downloads.append(local_path)
+        with open(local_path, 'wb') as f:
+            f.write(request.content)
+
+    def metadata(self, content, **changes):
+        metadata = {
+            'id': 'a', 'name': 'Lowland.csv', 'size': str(len(content)),
+            'md5Checksum': hashlib.md5(content).hexdigest(),
+            'modifiedTime': '2016-09-16T12:00:00.000Z'}
+        metadata.update(changes)
+        return metadata
+
+    def fetch(self, content, **changes):
+        service = FakeService({'a': content})
+        return fetch_file(service, self.metadata(content, **changes),
+                          self.local_dir, self.previous)
+
+    def read(self):
+        with open(os.path.join(self.local_dir, 'Lowland.csv'), 'rb') as f:
+            return f.read()
+
+    def test_unchanged(self):
+        self.assertTrue(is_unchanged(self.metadata(self.content),
+                                     self.previous))
+        self.assertEqual(self.fetch(self.content), 'unchanged')
+        self.assertEqual(self.downloads, [])
+        self.assertEqual(
+            os.stat(os.path.join(self.local_dir, 'Lowland.csv')).st_ino,
+            os.stat(self.previous['path']).st_ino)
+        self.assertEqual(bytes_skipped('unchanged', self.previous),
+                         len(self.content))
+
+    def test_changed(self):
+        for changes in ({'id': 'b'}, {'md5Checksum': 'x'},
+                        {'modifiedTime': '2016-09-16T13:00:00.000Z'}):
+            self.assertFalse(is_unchanged(
+                self.metadata(self.content, **changes), self.previous))
+        self.assertFalse(is_unchanged(self.metadata(self.content), None))
+        os.remove(self.previous['path'])
+        self.assertFalse(is_unchanged(self.metadata(self.content),
+                                      self.previous))
+
+    def test_link_replaces_existing_file(self):
+        with open(os.path.join(self.local_dir, 'Lowland.csv'), 'wb') as f:
+            f.write(b'stale')
+        self.assertTrue(link_unchanged_file(
+            self.metadata(self.content), self.local_dir, self.previous))
+        self.assertEqual(self.read(), self.content)
+
+    def test_tail(self):
+        content = self.content + b'"2016-09-16 12:20:00",2\r\n'
+        self.assertEqual(self.fetch(
+            content, modifiedTime='2016-09-16T13:00:00.000Z'), 'tail')
+        self.assertEqual(self.downloads, [])
+        self.assertEqual(self.read(), content)
+        self.assertEqual(bytes_skipped('tail', self.previous),
+                         len(self.content))
+
+    def test_full(self):
+        # Rewritten from the start, so it can't be tail fetched.
+        content = b'X' + self.content
+        self.assertEqual(self.fetch(content), 'full')
+        self.assertEqual(len(self.downloads), 1)
+        self.assertEqual(self.read(), content)
+        self.assertEqual(bytes_skipped('full', self.previous), 0)
+
+
+class TestFetchAll(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.threads = set()
+
+    def fake_worker(self, creds, item, local_dir, previous):
+        self.threads.add(threading.current_thread().name)
+        time.sleep(0.1)
+        if item['name'] == 'broken.csv':
+            return None, IOError('connection reset'), 0.1
+        with open(os.path.join(local_dir, item['name']), 'wb') as f:
+            f.write(b'x' * int(item['size']))
+        return 'full', None, 0.1
+
+    def test_parallel_fetch(self):
+        items = [{'id': str(i), 'name': 'file%d.csv' % i, 'size': i}
+                 for i in range(7)]
+        items.append({'id': '7', 'name': 'broken.csv', 'size': 10})
+        manifest = {}
+        stdout = io.StringIO()
+        started = time.time()
+        with mock.patch.multiple(
+                blackrock_data_fetcher, FETCH_WORKERS=4, DEBUG=False,
+                fetch_worker=self.fake_worker), \
+                mock.patch('sys.stdout', stdout):
+            errors = fetch_all('creds', items, self.dir, manifest)
+        self.assertLess(time.time() - started, 0.4)
+        self.assertEqual(len(self.threads), 4)
+        self.assertEqual(list(errors), ['broken.csv'])
+        self.assertIsInstance(errors['broken.csv'], IOError)
+        self.assertEqual(sorted(manifest), ['file%d.csv' % i
+                                            for i in range(7)])
+        self.assertIn('Fetched 8 files in', stdout.getvalue())
+        self.assertIn('(0.80s if fetched one at a time)', stdout.getvalue())
+
+    def test_store_error(self):
+        items = [{'id': '0', 'name': 'a.csv', 'size': 4}]
+
+        def worker(creds, item, local_dir, previous):
+            with open(os.path.join(local_dir, item['name']), 'wb') as f:
+                f.write(b'x' * item['size'])
+            return 'full', OSError(errno.EXDEV, 'cross-device link'), 0
+
+        manifest = {}
+        with mock.patch.multiple(blackrock_data_fetcher, DEBUG=False,
+                                 fetch_worker=worker), \
+                mock.patch('sys.stdout', io.StringIO()):
+            errors = fetch_all('creds', items, self.dir, manifest)
+        self.assertEqual(errors['a.csv'].errno, errno.EXDEV)
+        self.assertEqual(list(manifest), ['a.csv'])
+
+    def test_skipped_report(self):
+        path = os.path.join(self.dir, 'old.csv')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 40)
+        manifest = {'a.csv': {'id': 'a', 'size': 40, 'path': path},
+                    'b.csv': {'id': 'b', 'size': 40, 'path': path}}
+        items = [{'id': 'a', 'name': 'a.csv', 'size': 40},
+                 {'id': 'b', 'name': 'b.csv', 'size': 50},
+                 {'id': 'c', 'name': 'c.csv', 'size': 20}]
+        methods = {'a.csv': 'unchanged', 'b.csv': 'tail', 'c.csv': 'full'}
+
+        def worker(creds, item, local_dir, previous):
+            with open(os.path.join(local_dir, item['name']), 'wb') as f:
+                f.write(b'x' * item['size'])
+            return methods[item['name']], None, 0
+
+        stdout = io.StringIO()
+        with mock.patch.multiple(blackrock_data_fetcher, DEBUG=False,
+                                 fetch_worker=worker), \
+                mock.patch('sys.stdout', stdout), \
+                collecting('data') as run:
+            fetch_all('creds', items, self.dir, manifest)
+        self.assertIn('Skipped 1 requests and 80 bytes of unchanged data',
+                      stdout.getvalue())
+        counters = dict((name, value) for (name, labels), value in
+                        run.counters.items() if not labels)
+        self.assertEqual(counters, {'requests_skipped': 1,
+                                    'bytes_skipped': 80})
+
+    def test_thread_service(self):
+        services = []
+        creds = Credentials('token')
+
+        def worker():
+            services.append(get_thread_service(creds))
+            services.append(get_thread_service(creds))
+
+        with mock.patch.multiple(
+                blackrock_data_fetcher, AuthorizedHttp=mock.DEFAULT,
+                build=mock.Mock(side_effect=lambda *a, **kw: object())) \
+                as patched:
+            threads = [threading.Thread(target=worker) for i in range(2)]
+            for thread in threads:
+                thread.start()
+                thread.join()
+        # One service per thread, reused within the thread.
+        self.assertIs(services[0], services[1])
+        self.assertIs(services[2], services[3])
+        self.assertIsNot(services[0], services[2])
+        # Each with its own copy of the credentials.
+        thread_creds = [args[0] for args, kwargs in
+                        patched['AuthorizedHttp'].call_args_list]
+        self.assertEqual(len(thread_creds), 2)
+        self.assertIsNot(thread_creds[0], creds)
+        self.assertIsNot(thread_creds[0], thread_creds[1])
+        self.assertEqual(thread_creds[1].token, 'token')
+
+
+class TestFetchFiles(unittest.TestCase):
+
+    def test_files_are_picked_by_extension(self):
+        items = [
+            {'id': '1', 'name': 'Lowland.csv',
+             'mimeType': 'application/octet-stream'},
+            {'id': '2', 'name': 'White_Oak_Table20.csv',
+             'mimeType': 'text/plain'},
+            {'id': '3', 'name': 'OL_Baro-7Day.png', 'mimeType': 'image/png'},
+            {'id': '4', 'name': 'notes.docx',
+             'mimeType': 'application/octet-stream'},
+        ]
+        list_files = mock.Mock(return_value=items)
+        fetch_all = mock.Mock(return_value={})
+        with mock.patch.multiple(
+                blackrock_data_fetcher, DEBUG=False, build=mock.DEFAULT,
+                list_files=list_files, fetch_all=fetch_all,
+                load_manifest=mock.Mock(return_value={}),
+                save_manifest=mock.DEFAULT):
+            fetch_files('/tmp', creds='creds')
+        self.assertNotIn('mimeType =', list_files.call_args[0][1])
+        self.assertEqual([item['id'] for item in fetch_all.call_args[0][1]],
+                         ['1', '2', '3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
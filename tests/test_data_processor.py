@@ -1,11 +1,50 @@
+import io
+import os
+import shutil
+import statistics
+import tempfile
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
+from unittest import mock
+
 from blackrock_data_processor import (
-    calc_avg, calc_std_dev, filter_columns, filter_rows,
-    match_replace
+    calc_avg, calc_std_dev, dendrometer_names, dendrometer_rows,
+    filter_columns, filter_rows,
+    match_replace, iter_filter_columns, iter_filter_rows,
+    iter_match_replace, parse_timestamp, rdh_rows, RunningStats, TOA5Reader,
+    process_dendrometer_data, process_environmental_data,
+    apply_formula_to_processed_dendrometer_data,
+    process_dendrometer_data_with_formula, complete_lines
 )
 
 
+DENDROMETER_HEADER = ['TIMESTAMP', 'RECORD', 'Battery_Volt_MIN'] + [
+    'Red_Oak_%d_AVG' % i for i in range(1, 6)]
+ENVIRONMENTAL_HEADER = [
+    'TIMESTAMP', 'RECORD', 'AvgTEMP_C', 'AvgVP', 'TotalRain',
+    'SoilM_5cm', 'AvgPAR_Den']
+
+
+def toa5_lines(header, start, count, first_record=0):
+    """Returns TOA5-formatted rows with enough columns for either
+    header, with the 4-line preamble unless header is None."""
+    lines = []
+    if header is not None:
+        lines.append('"TOA5","Test","CR1000","1","CR1000.Std","x","1","T"')
+        lines.append(','.join('"%s"' % h for h in header))
+        lines.append(','.join('""' for h in header))
+        lines.append(','.join('"Avg"' for h in header))
+    for n in range(first_record, first_record + count):
+        ts = start + timedelta(minutes=20 * n)
+        values = [n] + [
+            round(100 + n * 0.25 + i * 3.5, 2)
+            for i in range(6)]
+        lines.append('"%s",%s' % (
+            ts.strftime('%Y-%m-%d %H:%M:%S'),
+            ','.join(str(v) for v in values)))
+    return ''.join(line + '\r\n' for line in lines)
+
+
 class TestCalculations(unittest.TestCase):
     def test_calc_avg(self):
         self.assertEqual(calc_avg([1]), 1)
@@ -22,6 +61,40 @@ class TestCalculations(unittest.TestCase):
             17.21162,
             places=5)
 
+    def test_running_stats(self):
+        values = [13, 23, 12, 44, 55, 2.5, -7, 1e6, 1e6 + 1]
+        stats = RunningStats(iter(values))
+        self.assertEqual(stats.count, 9)
+        self.assertEqual(stats.mean(), sum(values) / 9.0)
+        self.assertAlmostEqual(
+            stats.variance() / statistics.pvariance(values), 1)
+        self.assertAlmostEqual(stats.std() / statistics.pstdev(values), 1)
+        self.assertEqual((stats.min(), stats.max()), (-7, 1e6 + 1))
+        self.assertFalse(hasattr(stats, '__dict__'))
+
+        # Merging partitions gives the stats of the whole.
+        merged = RunningStats()
+        for part in (values[:4], [], values[4:]):
+            merged.merge(RunningStats(part))
+        self.assertEqual(merged.count, 9)
+        self.assertAlmostEqual(merged.mean() / stats.mean(), 1)
+        self.assertAlmostEqual(merged.variance() / stats.variance(), 1)
+        self.assertEqual((merged.min(), merged.max()), (-7, 1e6 + 1))
+
+        self.assertEqual(
+            RunningStats.from_list(stats.as_list()).as_list(),
+            stats.as_list())
+        self.assertEqual(RunningStats().min(), None)
+        self.assertRaises(ZeroDivisionError, calc_avg, [])
+
+    def test_rdh_rows_keep_non_numbers(self):
+        rows = [['2016-09-16 12:00:00', 21.9, 'NAN', 20.93, 316.5, 120.9,
+                 'NAN']]
+        self.assertEqual(
+            rdh_rows(rows, [48.0, 40.1, 42.1, 46.0, 42.4],
+                     [20.9, 19.23, 20.93, 316.5, 120.9]),
+            [['2016-09-16 12:00:00', 5.0, 'NAN', 0.0, 0.0, 0.0, 'NAN']])
+
 
 class TestFilterColumns(unittest.TestCase):
     def test_filter_columns(self):
@@ -89,6 +162,57 @@ class TestFilterRows(unittest.TestCase):
             ['2016-08-20 13:01:00', 5, 6, 1],
         ])
 
+    def test_unparseable_timestamps_are_kept(self):
+        rows = [['timestamp', 'b']] + [
+            [(datetime(2016, 8, 20) + timedelta(minutes=20 * n)).strftime(
+                '%Y-%m-%d %H:%M:%S'), n] for n in range(200)]
+        # Shaped like timestamps, but not valid ones, on either side of
+        # the window.
+        invalid = [['2016-02-30 13:01:00', -1], ['2016-08-20 13:01:+1', -2]]
+        rows.insert(20, invalid[0])
+        rows.insert(180, invalid[1])
+        start_dt = datetime(2016, 8, 21)
+        end_dt = datetime(2016, 8, 22)
+        expected = [rows[0], invalid[0]] + [
+            row for row in rows if row not in invalid and row[1] != 'b' and
+            start_dt <= parse_timestamp(row[0]) <= end_dt] + [invalid[1]]
+        self.assertEqual(filter_rows(rows, start_dt, end_dt), expected)
+        self.assertEqual(
+            list(iter_filter_rows(rows, start_dt, end_dt)), expected)
+
+    def test_out_of_order_rows(self):
+        rows = [['timestamp', 'b'],
+                ['2016-08-20 13:01:00', 1], ['2016-08-20 14:01:00', 2],
+                ['2016-08-20 12:01:00', 3], ['2016-08-20 15:01:00', 4]]
+        expected = [rows[0], rows[1], rows[2], rows[4]]
+        start_dt = datetime(2016, 8, 20, 13)
+        self.assertEqual(list(iter_filter_rows(rows, start_dt)), expected)
+        self.assertEqual(filter_rows(rows, start_dt), expected)
+
+    def test_parse_timestamp(self):
+        for value in ('2016-08-20 13:01:00', '2016-8-20 13:01:00',
+                      '2016-08-20 3:01:00'):
+            self.assertEqual(parse_timestamp(value),
+                             datetime.strptime(value, '%Y-%m-%d %H:%M:%S'))
+        for value in ('2016-02-30 13:01:00', 'timestamp',
+                      '2016-08-20 13:01:+1'):
+            with self.assertRaises(ValueError):
+                parse_timestamp(value)
+
+
+class TestDendrometerNames(unittest.TestCase):
+    def test_names_match_processed_header(self):
+        mailley_header = ['TIMESTAMP', 'RECORD'] + [
+            '%s_%d_AVG' % (tree, i)
+            for tree in ('Hemlock', 'Pine') for i in range(1, 4)]
+        for header, rename_trees, mailley in (
+                (DENDROMETER_HEADER, None, False),
+                (DENDROMETER_HEADER, 'White_Oak', False),
+                (mailley_header, None, True)):
+            rows = dendrometer_rows([header], None, rename_trees, mailley)
+            self.assertEqual(dendrometer_names(rename_trees, mailley),
+                             rows[0][1:])
+
 
 class TestMatchReplace(unittest.TestCase):
     def test_match_replace(self):
@@ -116,5 +240,262 @@ class TestMatchReplace(unittest.TestCase):
         self.assertEqual(newrows, [])
 
 
+class TestLazyPipeline(unittest.TestCase):
+    def test_pipeline_is_lazy(self):
+        def rows():
+            yield ['timestamp', 'Red_Oak_1', 'b']
+            yield ['2016-08-20 13:01:00', 5, 6]
+            raise AssertionError('read too far')
+
+        newrows = iter_filter_columns(['timestamp', 'Red_Oak_1'], rows())
+        newrows = iter_filter_rows(newrows, datetime(2016, 8, 20))
+        newrows = iter_match_replace(newrows, 'Red_Oak', 'White_Oak')
+        self.assertEqual(next(newrows), ['timestamp', 'White_Oak_1'])
+        self.assertEqual(next(newrows), ['2016-08-20 13:01:00', 5])
+
+    def test_empty(self):
+        self.assertEqual(list(iter_filter_columns(['a'], [])), [])
+
+
+class TestCompleteLines(unittest.TestCase):
+    def test_complete_lines(self):
+        f = io.BytesIO(b'a,1\r\nb,2\r\nc,3\r\nd,')
+        self.assertEqual(list(complete_lines(f, 0)), [
+            (0, b'a,1\r\n'), (5, b'b,2\r\n'), (10, b'c,3\r\n')])
+        self.assertEqual(list(complete_lines(f, 10)), [(10, b'c,3\r\n')])
+        self.assertEqual(list(complete_lines(f, 15)), [])
+
+
+class TestTOA5Reader(unittest.TestCase):
+    def setUp(self):
+        fd, self.fname = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.remove, self.fname)
+        header = ENVIRONMENTAL_HEADER + ['MaxPAR_Den']
+        lines = toa5_lines(header, datetime(2016, 9, 16), 30)
+        lines = [line.split(',') for line in lines.split('\r\n')]
+        # The logger writes "NAN" for missing readings.
+        lines[10][2] = '"NAN"'
+        lines[12][-1] = ''
+        lines = [','.join(fields) for fields in lines]
+        lines[14] = '"not a timestamp","a, b",1,2,3,4,5,6'
+        lines[15] = ''
+        with os.fdopen(fd, 'w', newline='') as f:
+            f.write('\r\n'.join(lines))
+
+    def test_projection(self):
+        keep = ['TIMESTAMP', 'AvgTEMP_C', 'MaxPAR_Den']
+        full = TOA5Reader(self.fname)
+        expected = filter_columns(keep, [full.header] + list(full))
+
+        reader = TOA5Reader(self.fname, keep_columns=keep)
+        self.assertEqual([reader.header] + list(reader), expected)
+        self.assertEqual(reader.position, full.position)
+        self.assertIn('NAN', expected[7])
+        self.assertEqual(expected[9][-1], '')
+
+    def test_start_dt(self):
+        for start_dt in (None, datetime(2016, 9, 16, 2),
+                         datetime(2016, 9, 16, 4, 10),
+                         datetime(2016, 9, 30)):
+            full = TOA5Reader(self.fname)
+            expected = filter_rows(list(full), start_dt)
+            reader = TOA5Reader(self.fname, start_dt=start_dt)
+            self.assertEqual(list(reader), expected)
+            self.assertEqual(reader.position, full.position)
+
+    def test_no_trailing_newline(self):
+        text = toa5_lines(ENVIRONMENTAL_HEADER, datetime(2016, 9, 16), 5)
+        with open(self.fname, 'w', newline='') as f:
+            f.write(text[:-2])
+        reader = TOA5Reader(self.fname)
+        rows = list(reader)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[-1][0], '2016-09-16 01:20:00')
+        self.assertEqual(reader.position['offset'],
+                         os.path.getsize(self.fname))
+
+
+class TestIncrementalProcessing(unittest.TestCase):
+    start = datetime(2016, 9, 16, 12)
+
+    def setUp(self):
+        self.src = tempfile.mkdtemp()
+        self.out = tempfile.mkdtemp()
+        patcher = mock.patch(
+            'blackrock_data_processor.PROCESSED_DATA_DIR', self.out)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.src)
+        self.addCleanup(shutil.rmtree, self.out)
+
+    def write_source(self, filename, text, mode='w'):
+        with open(os.path.join(self.src, filename), mode,
+                  newline='') as f:
+            f.write(text)
+
+    def read_output(self, filename):
+        with open(os.path.join(self.out, filename), 'rb') as f:
+            return f.read()
+
+    def process_white_oak(self, incremental):
+        process_dendrometer_data(
+            self.src, 'White_Oak_Table20.csv', rename_trees='White_Oak',
+            incremental=incremental)
+        apply_formula_to_processed_dendrometer_data(
+            'White_Oak_Table20.csv',
+            [32.1, 33.3, 46.7, 30.0, 26.7],
+            [160.8, 71.33, 100.4, 277.4, 456.6])
+
+    def test_dendrometer_matches_full_rebuild(self):
+        filename = 'White_Oak_Table20.csv'
+        self.write_source(
+            filename, toa5_lines(DENDROMETER_HEADER, self.start, 20))
+        self.process_white_oak(incremental=True)
+
+        # A partially written row isn't consumed until it's complete.
+        tail = toa5_lines(None, self.start, 15, first_record=20)
+        self.write_source(filename, tail[:-10], mode='a')
+        self.process_white_oak(incremental=True)
+        self.write_source(filename, tail[-10:], mode='a')
+        self.process_white_oak(incremental=True)
+        incremental = self.read_output(filename)
+
+        self.process_white_oak(incremental=False)
+        self.assertEqual(incremental, self.read_output(filename))
+        self.assertEqual(incremental.count(b'\n'), 26)
+
+    def test_unfinished_last_line(self):
+        filename = 'White_Oak_Table20.csv'
+        text = toa5_lines(DENDROMETER_HEADER, self.start, 20)
+        self.write_source(filename, text[:-2])
+        self.process_white_oak(incremental=True)
+        self.assertEqual(self.read_output(filename).count(b'\n'), 11)
+
+        # The last line is finished later, so the checkpoint after it
+        # no longer matches.
+        self.write_source(
+            filename, '\r\n' + toa5_lines(None, self.start, 5,
+                                          first_record=20), mode='a')
+        self.process_white_oak(incremental=True)
+        incremental = self.read_output(filename)
+        self.process_white_oak(incremental=False)
+        self.assertEqual(incremental, self.read_output(filename))
+        self.assertEqual(incremental.count(b'\n'), 16)
+
+    def test_mailley_defaults_to_filename(self):
+        filename = 'Mailley\'s_Mill_Table20Min.csv'
+        header = ['TIMESTAMP', 'RECORD'] + [
+            '%s_%d_AVG' % (tree, i)
+            for tree in ('Hemlock', 'Pine') for i in range(1, 4)]
+        self.write_source(filename, toa5_lines(header, self.start, 20))
+        process_dendrometer_data(self.src, filename)
+        output = self.read_output(filename)
+        self.assertTrue(output.startswith(
+            b'"TIMESTAMP","Hemlock_1_AVG","Hemlock_2_AVG","Hemlock_3_AVG",'
+            b'"Pine_1_AVG","Pine_2_AVG","Pine_3_AVG","Hemlock AVG",'
+            b'"Pine AVG"\r\n'))
+        self.assertEqual(output.count(b'\n'), 21)
+
+    def test_incremental_run_appends_in_place(self):
+        filename = 'White_Oak_Table20.csv'
+        self.write_source(
+            filename, toa5_lines(DENDROMETER_HEADER, self.start, 20))
+        self.process_white_oak_fused(incremental=True)
+        outfile = os.path.join(self.out, filename)
+        inode = os.stat(outfile).st_ino
+        published = self.read_output(filename)
+
+        # An interrupted run left rows past the checkpoint's output_size.
+        with open(outfile, 'ab') as f:
+            f.write(b'"2016-09-16 14:00:00",0.5\r\n')
+        self.write_source(
+            filename, toa5_lines(None, self.start, 10, first_record=20),
+            mode='a')
+        self.process_white_oak_fused(incremental=True)
+        incremental = self.read_output(filename)
+        self.assertEqual(os.stat(outfile).st_ino, inode)
+        self.assertTrue(incremental.startswith(published))
+
+        self.process_white_oak(incremental=False)
+        self.assertEqual(incremental, self.read_output(filename))
+
+    def test_formula_step_renames_into_place(self):
+        filename = 'White_Oak_Table20.csv'
+        self.write_source(
+            filename, toa5_lines(DENDROMETER_HEADER, self.start, 20))
+        self.process_white_oak(incremental=True)
+        published = self.read_output(filename)
+        self.write_source(
+            filename, toa5_lines(None, self.start, 10, first_record=20),
+            mode='a')
+        with mock.patch('os.truncate', side_effect=AssertionError):
+            self.process_white_oak(incremental=True)
+        incremental = self.read_output(filename)
+        self.assertTrue(incremental.startswith(published))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.out, filename + '.tmp')))
+
+        self.process_white_oak(incremental=False)
+        self.assertEqual(incremental, self.read_output(filename))
+
+    def process_white_oak_fused(self, incremental):
+        process_dendrometer_data_with_formula(
+            self.src, 'White_Oak_Table20.csv',
+            [32.1, 33.3, 46.7, 30.0, 26.7],
+            [160.8, 71.33, 100.4, 277.4, 456.6],
+            rename_trees='White_Oak', incremental=incremental)
+
+    def test_fused_pipeline_matches_two_passes(self):
+        filename = 'White_Oak_Table20.csv'
+        self.write_source(
+            filename, toa5_lines(DENDROMETER_HEADER, self.start, 20))
+        self.process_white_oak_fused(incremental=True)
+        fused = self.read_output(filename)
+        self.assertEqual(sorted(os.listdir(self.out)),
+                         [filename, filename + '.checkpoint'])
+
+        self.write_source(
+            filename, toa5_lines(None, self.start, 10, first_record=20),
+            mode='a')
+        self.process_white_oak_fused(incremental=True)
+        fused_incremental = self.read_output(filename)
+
+        self.process_white_oak(incremental=False)
+        self.assertEqual(fused_incremental, self.read_output(filename))
+        self.assertTrue(fused_incremental.startswith(fused))
+
+    def test_environmental_matches_full_rebuild(self):
+        filename = 'Lowland.csv'
+        start_dt = datetime(2016, 9, 16, 15)
+        self.write_source(
+            filename, toa5_lines(ENVIRONMENTAL_HEADER, self.start, 5))
+        process_environmental_data(
+            self.src, filename, start_dt=start_dt, incremental=True)
+        self.write_source(
+            filename, toa5_lines(None, self.start, 10, first_record=5),
+            mode='a')
+        process_environmental_data(
+            self.src, filename, start_dt=start_dt, incremental=True)
+        incremental = self.read_output(filename)
+
+        process_environmental_data(self.src, filename, start_dt=start_dt)
+        self.assertEqual(incremental, self.read_output(filename))
+
+    def test_rewritten_source_is_rebuilt(self):
+        filename = 'Lowland.csv'
+        self.write_source(
+            filename, toa5_lines(ENVIRONMENTAL_HEADER, self.start, 10))
+        process_environmental_data(self.src, filename, incremental=True)
+
+        self.write_source(filename, toa5_lines(
+            ENVIRONMENTAL_HEADER, self.start + timedelta(days=1), 3))
+        process_environmental_data(self.src, filename, incremental=True)
+        incremental = self.read_output(filename)
+
+        process_environmental_data(self.src, filename)
+        self.assertEqual(incremental, self.read_output(filename))
+        self.assertEqual(incremental.count(b'\n'), 4)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+from unittest import mock
+
+from blackrock_download import download_to_file
+from blackrock_scheduler import TokenBucket
+
+
+class FakeMediaDownload(object):
+    """Stands in for MediaIoBaseDownload, producing `request` bytes."""
+
+    def __init__(self, fd, request, chunksize):
+        self.fd = fd
+        self.remaining = request
+        self.chunksize = chunksize
+
+    def next_chunk(self):
+        n = min(self.chunksize, self.remaining)
+        self.fd.write(b'\x00' * n)
+        self.remaining -= n
+        return None, self.remaining == 0
+
+
+class FailingMediaDownload(FakeMediaDownload):
+    def next_chunk(self):
+        FakeMediaDownload.next_chunk(self)
+        raise IOError('connection reset')
+
+
+class CorruptedMediaDownload(FakeMediaDownload):
+    """Fails to decode the first `corrupted` chunks it's asked for."""
+    corrupted = 1
+
+    def next_chunk(self):
+        if self.corrupted:
+            self.corrupted -= 1
+            raise UnicodeDecodeError('utf-8', b'\xff', 0, 1, 'bad byte')
+        return FakeMediaDownload.next_chunk(self)
+
+
+class TestDownloadToFile(unittest.TestCase):
+    chunksize = 256 * 1024
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'Lowland.csv')
+        # Don't hold the fake chunks to Drive's rate.
+        for name, value in (
+                ('blackrock_scheduler.drive_bucket', TokenBucket(1e6, 1e6)),
+                ('blackrock_scheduler.DRIVE_BACKOFF_BASE', 0.001),
+                ('blackrock_scheduler.DRIVE_MAX_RETRIES', 3),
+                ('blackrock_scheduler.DEBUG', False)):
+            patcher = mock.patch(name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def peak_memory(self, size):
+        tracemalloc.start()
+        try:
+            download_to_file(size, self.path, chunksize=self.chunksize,
+                             downloader_class=FakeMediaDownload)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_download(self):
+        size = download_to_file(
+            3 * self.chunksize + 10, self.path, chunksize=self.chunksize,
+            downloader_class=FakeMediaDownload)
+        self.assertEqual(size, 3 * self.chunksize + 10)
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.assertEqual(os.listdir(self.dir), ['Lowland.csv'])
+
+    def test_peak_memory_is_flat(self):
+        small = self.peak_memory(2 * self.chunksize)
+        large = self.peak_memory(64 * self.chunksize)
+        self.assertLess(large, 2 * self.chunksize)
+        self.assertLess(large, small + self.chunksize / 4)
+
+    def test_failed_download_keeps_old_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'old')
+        with self.assertRaises(IOError):
+            download_to_file(
+                2 * self.chunksize, self.path, chunksize=self.chunksize,
+                downloader_class=FailingMediaDownload)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+        self.assertEqual(os.listdir(self.dir), ['Lowland.csv'])
+
+    def test_corrupted_chunk_is_retried(self):
+        size = download_to_file(
+            3 * self.chunksize, self.path, chunksize=self.chunksize,
+            downloader_class=CorruptedMediaDownload)
+        self.assertEqual(size, 3 * self.chunksize)
+
+    def test_corrupted_chunks_give_up(self):
+        with mock.patch.object(CorruptedMediaDownload, 'corrupted', 10):
+            with self.assertRaises(UnicodeDecodeError):
+                download_to_file(
+                    3 * self.chunksize, self.path, chunksize=self.chunksize,
+                    downloader_class=CorruptedMediaDownload)
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from blackrock_drive import (
+    build_query, list_files, load_file_id, save_file_id
+)
+
+
+class FakeFiles(object):
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def list(self, **kwargs):
+        self.calls.append(kwargs)
+        self.kwargs = kwargs
+        return self
+
+    def execute(self):
+        token = self.kwargs['pageToken']
+        page = 0 if token is None else int(token)
+        result = {'files': self.pages[page]}
+        if page + 1 < len(self.pages):
+            result['nextPageToken'] = str(page + 1)
+        return result
+
+
+class FakeService(object):
+    def __init__(self, pages):
+        self._files = FakeFiles(pages)
+
+    def files(self):
+        return self._files
+
+
+class TestBuildQuery(unittest.TestCase):
+    def test_build_query(self):
+        self.assertEqual(build_query(), 'trashed = false')
+        self.assertEqual(
+            build_query(mimetypes=['text/csv', 'image/png'],
+                        exclude_mimetype='application/folder'),
+            "trashed = false and mimeType != 'application/folder' and "
+            "(mimeType = 'text/csv' or mimeType = 'image/png')")
+        self.assertEqual(
+            build_query(names=["Mailley's_Mill_Table20Min.csv"]),
+            "trashed = false and "
+            "(name = 'Mailley\\'s_Mill_Table20Min.csv')")
+
+
+class TestListFiles(unittest.TestCase):
+    def test_list_files_follows_pages(self):
+        service = FakeService([
+            [{'id': '1'}, {'id': '2'}], [{'id': '3'}], [{'id': '4'}]])
+        items = list_files(service, 'trashed = false', page_size=2)
+        self.assertEqual([i['id'] for i in items], ['1', '2', '3', '4'])
+        calls = service.files().calls
+        self.assertEqual([c['pageToken'] for c in calls], [None, '1', '2'])
+        self.assertEqual(calls[0]['pageSize'], 2)
+        self.assertEqual(calls[0]['q'], 'trashed = false')
+
+
+class TestFileIdCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'ids.json')
+
+    def test_file_id_cache(self):
+        self.assertIsNone(load_file_id(self.path, 'Lodge.jpg', 60))
+        save_file_id(self.path, 'Lodge.jpg', 'abc')
+        self.assertEqual(load_file_id(self.path, 'Lodge.jpg', 60), 'abc')
+        self.assertIsNone(load_file_id(self.path, 'Lodge.jpg', -1))
+        save_file_id(self.path, 'Lodge.jpg', None)
+        self.assertIsNone(load_file_id(self.path, 'Lodge.jpg', 60))
+
+
+if __name__ == '__main__':
+    unittest.main()
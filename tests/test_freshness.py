@@ -0,0 +1,107 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import blackrock_freshness
+from blackrock_freshness import (
+    histogram, load_state, newest_timestamp, percentile, print_status,
+    record_fetched, record_published
+)
+from tests.test_data_processor import ENVIRONMENTAL_HEADER, toa5_lines
+
+
+class TestFreshness(unittest.TestCase):
+    start = datetime(2016, 9, 16, 12)
+
+    def setUp(self):
+        self.src = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.src)
+        self.path = os.path.join(self.src, 'freshness.json')
+
+    def write_source(self, count, text=''):
+        with open(os.path.join(self.src, 'Lowland.csv'), 'w',
+                  newline='') as f:
+            f.write(toa5_lines(ENVIRONMENTAL_HEADER, self.start, count) +
+                    text)
+
+    def run_fetcher(self, count, fetched, published):
+        self.write_source(count)
+        record_fetched(self.src, ['Lowland.csv', 'Missing.csv'], fetched,
+                       self.path)
+        if published:
+            record_published(['Lowland.csv', 'Missing.csv'], published,
+                             self.path)
+
+    def test_newest_timestamp(self):
+        self.write_source(3, '"2016-09-16 13:00:00",3,1.5')
+        # The last row isn't complete yet.
+        self.assertEqual(newest_timestamp(
+            os.path.join(self.src, 'Lowland.csv')), '2016-09-16 12:40:00')
+        self.write_source(0)
+        self.assertIsNone(newest_timestamp(
+            os.path.join(self.src, 'Lowland.csv')))
+        self.assertIsNone(newest_timestamp(
+            os.path.join(self.src, 'Missing.csv')))
+
+    def test_lags(self):
+        # The 12:40 row is fetched at 13:05 and published at 13:10.
+        self.run_fetcher(3, datetime(2016, 9, 16, 13, 5),
+                         datetime(2016, 9, 16, 13, 10))
+        # Nothing new in the next run.
+        self.run_fetcher(3, datetime(2016, 9, 16, 14, 5),
+                         datetime(2016, 9, 16, 14, 10))
+        # The 14:00 row is seen at 15:05, but the run fails, so it's
+        # only published by the next one.
+        self.run_fetcher(7, datetime(2016, 9, 16, 15, 5), None)
+        self.run_fetcher(7, datetime(2016, 9, 16, 16, 5),
+                         datetime(2016, 9, 16, 16, 10))
+
+        station = load_state(self.path)['Lowland.csv']
+        self.assertEqual(station['timestamp'], '2016-09-16 14:00:00')
+        self.assertEqual(station['fetched_at'], '2016-09-16 15:05:00')
+        self.assertEqual(station['published_at'], '2016-09-16 16:10:00')
+        self.assertEqual([s[1:] for s in station['samples']], [
+            [25 * 60, 30 * 60], [65 * 60, 130 * 60]])
+        self.assertEqual(load_state(self.path)['Missing.csv']['samples'], [])
+
+        # Samples older than the window are dropped.
+        with mock.patch.object(blackrock_freshness, 'FRESHNESS_WINDOW', 1):
+            self.run_fetcher(10, datetime(2016, 9, 17, 14, 5),
+                             datetime(2016, 9, 17, 14, 10))
+        self.assertEqual(
+            len(load_state(self.path)['Lowland.csv']['samples']), 2)
+
+    def test_status(self):
+        self.run_fetcher(3, datetime(2016, 9, 16, 13, 5),
+                         datetime(2016, 9, 16, 13, 10))
+        self.run_fetcher(7, datetime(2016, 9, 16, 14, 5),
+                         datetime(2016, 9, 16, 14, 10))
+        state = load_state(self.path)
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            stalled = print_status(state, datetime(2016, 9, 16, 15))
+        self.assertEqual(stalled, 1)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(lines[1].split(), [
+            'Lowland.csv', '1.0h', '5m', '25m', '10m', '30m', '2'])
+        self.assertEqual(lines[2].split()[3:5], ['<=15m:1', '<=30m:1'])
+        self.assertTrue(lines[3].endswith('STALLED'))
+
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            self.assertEqual(print_status(
+                state, datetime(2016, 9, 16, 14) + timedelta(hours=3)), 2)
+
+    def test_percentile(self):
+        self.assertIsNone(percentile([], 50))
+        self.assertEqual(percentile([3, 1, 2], 50), 2)
+        self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+        self.assertEqual(percentile([5], 95), 5)
+        self.assertEqual(histogram([60, 300, 301, 10 ** 6]),
+                         [2, 1, 0, 0, 0, 0, 0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import blackrock_metrics
+from blackrock_metrics import (
+    Run, collecting, count, counted, prometheus_lines, recording, stage,
+    timed
+)
+
+
+@timed
+def process(path, filename, rows=()):
+    return list(counted(rows, 'rows_written', station=filename))
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.out = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out)
+
+    def read_record(self, job):
+        with open(os.path.join(self.out, 'blackrock_%s.json' % job)) as f:
+            return json.load(f)
+
+    def read_prom(self, job):
+        with open(os.path.join(self.out, 'blackrock_%s.prom' % job)) as f:
+            return f.read().splitlines()
+
+    def test_disabled(self):
+        rows = iter([1, 2])
+        with mock.patch.object(blackrock_metrics, 'METRICS_DIR', None):
+            with recording('data') as run:
+                self.assertIsNone(run)
+                with stage('list'):
+                    count('retries')
+                self.assertIs(counted(rows, 'rows_written'), rows)
+                self.assertEqual(process('src', 'Lowland.csv', [1]), [1])
+        self.assertEqual(os.listdir(self.out), [])
+
+    def test_run_record(self):
+        with recording('data', self.out):
+            with stage('list'):
+                count('retries', operation='download')
+                count('retries', operation='download')
+            process('src', 'Lowland.csv', [1, 2, 3])
+            process('src', filename='Lowland.csv')
+        record = self.read_record('data')
+        self.assertIsNone(record['error'])
+        self.assertEqual(
+            [(s['stage'], s.get('station')) for s in record['stages']],
+            [('list', None), ('process', 'Lowland.csv'),
+             ('process', 'Lowland.csv')])
+        self.assertEqual(sorted(
+            (c['name'], c['value']) for c in record['counters']),
+            [('retries', 2), ('rows_written', 3)])
+
+        prom = self.read_prom('data')
+        self.assertIn('blackrock_run_success{job="data"} 1', prom)
+        self.assertIn('blackrock_retries{job="data",operation="download"} 2',
+                      prom)
+        self.assertIn(
+            'blackrock_rows_written{job="data",station="Lowland.csv"} 3',
+            prom)
+        # The two calls are summed.
+        self.assertEqual(len([
+            line for line in prom if line.startswith(
+                'blackrock_stage_seconds{job="data",stage="process"')]), 1)
+
+    def test_failed_run(self):
+        with self.assertRaises(ValueError):
+            with recording('photo', self.out):
+                raise ValueError('no photo')
+        self.assertEqual(self.read_record('photo')['error'], 'no photo')
+        self.assertIn('blackrock_run_success{job="photo"} 0',
+                      self.read_prom('photo'))
+
+    def test_worker_snapshot(self):
+        with recording('data', self.out) as run:
+            with collecting('data') as worker:
+                count('rows_read', 5, station='Lowland.csv')
+                with stage('index', station='Lowland.csv'):
+                    pass
+            self.assertEqual(run.counters, {})
+            run.merge(json.loads(json.dumps(worker.snapshot())))
+            count('rows_read', 1, station='Lowland.csv')
+        record = self.read_record('data')
+        self.assertEqual(record['counters'], [
+            {'name': 'rows_read', 'station': 'Lowland.csv', 'value': 6}])
+        self.assertEqual(record['stages'][0]['stage'], 'index')
+
+        with collecting(None) as worker:
+            self.assertIsNone(worker)
+
+    def test_threads(self):
+        # The daemon records the two jobs at once.
+        started = threading.Barrier(2)
+
+        def job(name):
+            with recording(name, self.out):
+                started.wait()
+                count('files_fetched')
+
+        threads = [threading.Thread(target=job, args=(name,))
+                   for name in ('data', 'photo')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for name in ('data', 'photo'):
+            self.assertEqual(self.read_record(name)['counters'], [
+                {'name': 'files_fetched', 'value': 1}])
+
+    def test_escaping(self):
+        run = Run('data')
+        run.add('bytes_downloaded', 10, {'file': 'Mailley\'s "Mill"\\'})
+        self.assertIn(
+            'blackrock_bytes_downloaded{job="data",'
+            'file="Mailley\'s \\"Mill\\"\\\\"} 10',
+            prometheus_lines(run.record()))
+
+
+if __name__ == '__main__':
+    unittest.main()
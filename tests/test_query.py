@@ -0,0 +1,112 @@
+import csv
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import blackrock_query
+from blackrock_data_processor import filter_rows
+from blackrock_query import (
+    load_index, main, query, read_header, seek_offset, update_index
+)
+
+
+class TestQuery(unittest.TestCase):
+    start = datetime(2016, 9, 16, 12)
+    header = ['TIMESTAMP', 'White_Oak_1_AVG', 'Site AVG']
+
+    def setUp(self):
+        self.out = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out)
+        for name, value in (('PROCESSED_DATA_DIR', self.out),
+                            ('INDEX_INTERVAL', 16)):
+            patcher = mock.patch.object(blackrock_query, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.rows = []
+
+    def write_rows(self, first, count, header=True, mode='a'):
+        rows = [[(self.start + timedelta(minutes=20 * n)).strftime(
+            '%Y-%m-%d %H:%M:%S'), n * 0.5, 'NAN'] for n in
+            range(first, first + count)]
+        with open(os.path.join(self.out, 'White_Oak.csv'), mode) as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
+            if header:
+                writer.writerow(self.header)
+            writer.writerows(rows)
+        self.rows += rows
+
+    def assertQueries(self):
+        for start_dt, end_dt in (
+                (None, None),
+                (datetime(2016, 9, 17, 3, 10), None),
+                (None, datetime(2016, 9, 17, 3, 20)),
+                (datetime(2016, 9, 17, 3, 20), datetime(2016, 9, 18, 8)),
+                (datetime(2016, 9, 30), None)):
+            self.assertEqual(
+                list(query('White_Oak.csv', start_dt, end_dt)),
+                filter_rows(self.rows, start_dt, end_dt),
+                (start_dt, end_dt))
+
+    def test_query(self):
+        self.write_rows(0, 100)
+        self.assertQueries()
+        update_index('White_Oak.csv')
+        self.assertEqual(len(load_index('White_Oak.csv')['entries']), 7)
+        self.assertQueries()
+
+        with open(os.path.join(self.out, 'White_Oak.csv'), 'rb') as f:
+            index = load_index('White_Oak.csv')
+            self.assertEqual(seek_offset(f, index, ''), 0)
+            f.seek(seek_offset(f, index, '2016-09-17 06:00:00'))
+            self.assertEqual(next(csv.reader(io.TextIOWrapper(f)))[0],
+                             '2016-09-17 04:00:00')
+
+        # Rows added after the index was updated are found too.
+        self.write_rows(100, 50, header=False)
+        self.assertQueries()
+        update_index('White_Oak.csv')
+        self.assertEqual(len(load_index('White_Oak.csv')['entries']), 10)
+        self.assertQueries()
+
+    def test_rewritten_file(self):
+        self.write_rows(0, 100)
+        update_index('White_Oak.csv')
+
+        # Rewrite the file with longer rows, so the indexed offsets are
+        # wrong.
+        self.rows = []
+        self.write_rows(1000, 100, mode='w')
+        self.assertQueries()
+
+        update_index('White_Oak.csv')
+        self.assertEqual(
+            load_index('White_Oak.csv')['entries'][0][0],
+            self.rows[0][0])
+        self.assertQueries()
+
+    def test_header(self):
+        self.write_rows(0, 3)
+        self.assertEqual(read_header('White_Oak.csv'), self.header)
+        self.rows = []
+        self.write_rows(0, 3, header=False, mode='w')
+        self.assertIsNone(read_header('White_Oak.csv'))
+
+    def test_cli(self):
+        self.write_rows(0, 10)
+        update_index('White_Oak.csv')
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            main(['White_Oak.csv', '--start', '2016-09-16 13:00:00',
+                  '--end', '2016-09-16 13:40:00'])
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            '"TIMESTAMP","White_Oak_1_AVG","Site AVG"',
+            '"2016-09-16 13:00:00",1.5,"NAN"',
+            '"2016-09-16 13:20:00",2.0,"NAN"',
+            '"2016-09-16 13:40:00",2.5,"NAN"'])
+
+
+if __name__ == '__main__':
+    unittest.main()
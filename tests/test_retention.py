@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from blackrock_retention import period_end, purge_tree
+
+
+class TestRetention(unittest.TestCase):
+    now = datetime(2016, 10, 14, 12, 30)
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base)
+
+    def make_hours(self, start, count, step=timedelta(hours=1)):
+        paths = []
+        for n in range(count):
+            d = os.path.join(self.base, (start + n * step).strftime(
+                '%Y/%m/%d/%H'))
+            os.makedirs(d)
+            with open(os.path.join(d, 'Lowland.csv'), 'w') as f:
+                f.write('x')
+            paths.append(d)
+        return paths
+
+    def remaining(self):
+        return sorted(
+            os.path.relpath(dirpath, self.base)
+            for dirpath, dirnames, filenames in os.walk(self.base)
+            if 'Lowland.csv' in filenames)
+
+    def test_period_end(self):
+        self.assertEqual(period_end([2016]), datetime(2017, 1, 1))
+        self.assertEqual(period_end([2016, 12]), datetime(2017, 1, 1))
+        self.assertEqual(period_end([2016, 2]), datetime(2016, 3, 1))
+        self.assertEqual(period_end([2016, 2, 29]), datetime(2016, 3, 1))
+        self.assertEqual(period_end([2016, 2, 29, 23]),
+                         datetime(2016, 3, 1))
+        for fields in ([2016, 13], [2016, 2, 30], [2016, 1, 1, 24]):
+            self.assertRaises(ValueError, period_end, fields)
+
+    def test_purge_tree(self):
+        self.make_hours(datetime(2015, 12, 31, 22), 4)
+        self.make_hours(datetime(2016, 9, 14, 10), 4)
+        # Leftovers and things that aren't dates are kept.
+        os.makedirs(os.path.join(self.base, 'misc', '01'))
+        os.makedirs(os.path.join(self.base, '2016', '13'))
+
+        removed = purge_tree(self.base, 4, '+30', dry_run=True,
+                             now=self.now)
+        self.assertEqual(len(self.remaining()), 8)
+        self.assertEqual(removed, purge_tree(self.base, 4, '+30',
+                                             now=self.now))
+
+        # The whole of 2015 goes at once, then what's left of 2016
+        # hour by hour.
+        self.assertEqual(
+            [os.path.relpath(p, self.base) for p in removed],
+            ['2015', '2016/01', '2016/09/14/10', '2016/09/14/11'])
+        self.assertEqual(self.remaining(),
+                         ['2016/09/14/12', '2016/09/14/13'])
+        self.assertTrue(os.path.isdir(os.path.join(self.base, 'misc')))
+        self.assertTrue(os.path.isdir(os.path.join(self.base, '2016/13')))
+
+    def test_current_is_kept(self):
+        old = self.make_hours(datetime(2016, 8, 1), 2)
+        os.symlink(old[1], os.path.join(self.base, 'current'))
+        purge_tree(self.base, 4, 30, now=self.now)
+        self.assertEqual(self.remaining(), ['2016/08/01/01'])
+        self.assertEqual(os.listdir(os.path.join(self.base, '2016')),
+                         ['08'])
+
+    def test_missing_base(self):
+        self.assertEqual(purge_tree('', 3, 30), [])
+        self.assertEqual(
+            purge_tree(os.path.join(self.base, 'nope'), 3, 30), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from blackrock_data_processor import (
+    calc_avg, calc_std_dev, process_environmental_data,
+    process_dendrometer_data_with_formula
+)
+from blackrock_rollup import update_rollups
+from blackrock_stations import STATIONS, column_names
+from tests.test_data_processor import (
+    DENDROMETER_HEADER, ENVIRONMENTAL_HEADER, toa5_lines
+)
+
+
+class TestRollups(unittest.TestCase):
+    start = datetime(2016, 9, 16, 12)
+
+    def setUp(self):
+        self.src = tempfile.mkdtemp()
+        self.out = tempfile.mkdtemp()
+        self.rollups = os.path.join(self.out, 'rollups')
+        for name, value in (
+                ('blackrock_data_processor.PROCESSED_DATA_DIR', self.out),
+                ('blackrock_rollup.PROCESSED_DATA_DIR', self.out),
+                ('blackrock_rollup.ROLLUP_DATA_DIR', self.rollups)):
+            patcher = mock.patch(name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.src)
+        self.addCleanup(shutil.rmtree, self.out)
+
+    def write_source(self, filename, text, mode='w'):
+        with open(os.path.join(self.src, filename), mode,
+                  newline='') as f:
+            f.write(text)
+
+    def read_rollup(self, name):
+        with open(os.path.join(self.rollups, name), 'rb') as f:
+            return f.read()
+
+    def rows(self, name, quoting=csv.QUOTE_NONNUMERIC):
+        with open(os.path.join(self.rollups, name), newline='') as f:
+            return list(csv.reader(f, quoting=quoting))
+
+    def test_hourly_and_daily(self):
+        self.write_source(
+            'Lowland.csv', toa5_lines(ENVIRONMENTAL_HEADER, self.start, 40))
+        process_environmental_data(self.src, 'Lowland.csv')
+        update_rollups('Lowland.csv')
+
+        with open(os.path.join(self.out, 'Lowland.csv'), newline='') as f:
+            processed = list(csv.reader(f, quoting=csv.QUOTE_NONNUMERIC))
+
+        hourly = self.rows('Lowland_hourly.csv')
+        self.assertEqual(hourly[0][:6], [
+            'TIMESTAMP', 'COUNT', 'AvgTEMP_C_MIN', 'AvgTEMP_C_MAX',
+            'AvgTEMP_C_MEAN', 'AvgTEMP_C_STD'])
+        self.assertEqual(len(hourly[0]), 2 + 4 * (len(processed[0]) - 1))
+        # 20-minute data starts at noon, so three rows an hour.
+        self.assertEqual(len(hourly), 1 + 14)
+        values = [row[1] for row in processed[4:7]]
+        self.assertEqual(hourly[2][:6], [
+            '2016-09-16 13:00:00', 3, min(values), max(values),
+            calc_avg(values), calc_std_dev(values)])
+
+        daily = self.rows('Lowland_daily.csv')
+        self.assertEqual([row[:2] for row in daily[1:]], [
+            ['2016-09-16 00:00:00', 36], ['2016-09-17 00:00:00', 4]])
+
+    def test_incremental_matches_full_rebuild(self):
+        self.write_source(
+            'Lowland.csv', toa5_lines(ENVIRONMENTAL_HEADER, self.start, 10))
+        process_environmental_data(self.src, 'Lowland.csv', incremental=True)
+        update_rollups('Lowland.csv')
+        # Add a row, then most of a day, then a couple of days.
+        for first, count in ((10, 1), (11, 19), (30, 150)):
+            self.write_source(
+                'Lowland.csv', toa5_lines(None, self.start, count, first),
+                mode='a')
+            process_environmental_data(
+                self.src, 'Lowland.csv', incremental=True)
+            update_rollups('Lowland.csv')
+        hourly = self.read_rollup('Lowland_hourly.csv')
+        daily = self.read_rollup('Lowland_daily.csv')
+
+        shutil.rmtree(self.rollups)
+        update_rollups('Lowland.csv')
+        self.assertEqual(hourly, self.read_rollup('Lowland_hourly.csv'))
+        self.assertEqual(daily, self.read_rollup('Lowland_daily.csv'))
+
+    def test_rewritten_file_is_rebuilt(self):
+        self.write_source(
+            'Lowland.csv', toa5_lines(ENVIRONMENTAL_HEADER, self.start, 10))
+        process_environmental_data(self.src, 'Lowland.csv')
+        update_rollups('Lowland.csv')
+
+        self.write_source('Lowland.csv', toa5_lines(
+            ENVIRONMENTAL_HEADER, datetime(2016, 10, 1), 4))
+        process_environmental_data(self.src, 'Lowland.csv')
+        update_rollups('Lowland.csv')
+        daily = self.rows('Lowland_daily.csv')
+        self.assertEqual([row[:2] for row in daily],
+                         [['TIMESTAMP', 'COUNT'], ['2016-10-01 00:00:00', 4]])
+
+    def test_headerless_formula_output(self):
+        self.write_source('White_Oak_Table20.csv',
+                          toa5_lines(DENDROMETER_HEADER, self.start, 20))
+        process_dendrometer_data_with_formula(
+            self.src, 'White_Oak_Table20.csv',
+            [32.1, 33.3, 46.7, 30.0, 26.7],
+            [160.8, 71.33, 100.4, 277.4, 456.6],
+            rename_trees='White_Oak')
+        station = STATIONS[1]
+        self.assertEqual(station['filename'], 'White_Oak_Table20.csv')
+        update_rollups('White_Oak_Table20.csv', column_names(station))
+        hourly = self.rows('White_Oak_Table20_hourly.csv')
+        self.assertEqual(hourly[0][:3],
+                         ['TIMESTAMP', 'COUNT', 'White_Oak_1_AVG_MIN'])
+        self.assertEqual(hourly[0][-4:], ['Site AVG_MIN', 'Site AVG_MAX',
+                                          'Site AVG_MEAN', 'Site AVG_STD'])
+        self.assertEqual(len(hourly[0]), 2 + 4 * 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from googleapiclient.errors import HttpError
+
+from blackrock_data_fetcher import tail_fetch_file
+from blackrock_download import download_to_file
+from blackrock_drive import list_files
+from blackrock_metrics import collecting
+from blackrock_photo_fetcher import REMOTE_FILENAME, fetch_image
+from blackrock_scheduler import (
+    DeadlineExceeded, TokenBucket, call, retry_after, run_deadline
+)
+from tests.fake_drive import FILES_PATH, FakeDrive
+
+
+def retries(run):
+    return dict((dict(labels)['operation'], value)
+                for (name, labels), value in run.counters.items()
+                if name == 'retries')
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_rate(self):
+        bucket = TokenBucket(100, 1)
+        started = time.monotonic()
+        for i in range(11):
+            self.assertTrue(bucket.acquire())
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    def test_deadline(self):
+        bucket = TokenBucket(1, 1)
+        self.assertTrue(bucket.acquire())
+        started = time.monotonic()
+        self.assertFalse(bucket.acquire(started + 0.1))
+        self.assertLess(time.monotonic() - started, 0.1)
+
+    def test_adapts_to_throttling(self):
+        bucket = TokenBucket(16, 1)
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 8)
+        for i in range(10):
+            bucket.throttled()
+        self.assertEqual(bucket.rate, 1)
+        for i in range(20):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 16)
+
+
+class TestCall(unittest.TestCase):
+    content = bytes(range(256)) * 40
+
+    def setUp(self):
+        self.drive = FakeDrive({
+            'a': ('Lowland.csv', self.content),
+            'b': ('White_Oak_Table20.csv', b'"TOA5"\r\n'),
+            'c': (REMOTE_FILENAME, b'\xff\xd8 photo'),
+        }).start()
+        self.addCleanup(self.drive.stop)
+        self.service = self.drive.service()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.bucket = TokenBucket(1000, 10)
+        for name, value in (
+                ('blackrock_scheduler.drive_bucket', self.bucket),
+                ('blackrock_scheduler.DRIVE_BACKOFF_BASE', 0.01),
+                ('blackrock_scheduler.DEBUG', False)):
+            patcher = mock.patch(name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def list(self, page_size=2):
+        return [f['id'] for f in list_files(
+            self.service, 'trashed = false', page_size=page_size)]
+
+    def test_retries_throttling_and_errors(self):
+        self.drive.fail(429)
+        self.drive.fail(403, reason='rateLimitExceeded')
+        self.drive.fail(503, after=1)
+        with collecting('data') as run:
+            self.assertEqual(self.list(), ['a', 'b', 'c'])
+        self.assertEqual(self.drive.statuses(), [429, 403, 200, 503, 200])
+        self.assertEqual(retries(run), {'list': 3})
+        # Throttled twice, and won back a little since.
+        self.assertEqual(self.bucket.rate, 1000 / 4 + 2 * 1000 / 20)
+
+    def test_not_retried(self):
+        self.drive.fail(403, reason='insufficientFilePermissions')
+        with self.assertRaises(HttpError):
+            self.list()
+        with self.assertRaises(HttpError):
+            call(self.service.files().get_media(fileId='x').execute, 'tail')
+        self.assertEqual(self.drive.statuses(), [403, 404])
+
+    def test_retry_after(self):
+        self.drive.fail(429, retry_after=3)
+        with mock.patch('blackrock_scheduler.time.sleep') as sleep:
+            self.list(page_size=10)
+        sleep.assert_called_once_with(3.0)
+
+        error = mock.Mock(resp={'retry-after': time.strftime(
+            '%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 60))})
+        self.assertAlmostEqual(retry_after(error), 60, delta=2)
+        self.assertIsNone(retry_after(mock.Mock(resp={})))
+
+    def test_max_retries(self):
+        self.drive.fail(500, times=5)
+        with mock.patch('blackrock_scheduler.DRIVE_MAX_RETRIES', 2):
+            with self.assertRaises(HttpError):
+                self.list()
+        self.assertEqual(self.drive.statuses(), [500, 500, 500])
+
+    def test_deadline(self):
+        self.drive.fail(503, times=1000)
+        started = time.monotonic()
+        with mock.patch('blackrock_scheduler.DRIVE_BACKOFF_BASE', 0.05), \
+                run_deadline(0.5):
+            with self.assertRaises(HttpError):
+                self.list()
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertGreater(len(self.drive.statuses()), 1)
+
+        with run_deadline(0.1):
+            with mock.patch.object(self.bucket, 'rate', 1), \
+                    mock.patch.object(self.bucket, 'tokens', 0):
+                with self.assertRaises(DeadlineExceeded):
+                    self.list()
+
+    def test_download(self):
+        path = os.path.join(self.dir, 'Lowland.csv')
+        media_path = FILES_PATH + '/a'
+        self.drive.fail(500, path=media_path, after=3)
+        self.drive.fail(429, path=media_path, retry_after=0)
+        with collecting('data') as run:
+            size = download_to_file(
+                self.service.files().get_media(fileId='a'), path,
+                chunksize=1024)
+        self.assertEqual(size, len(self.content))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(self.drive.statuses(media_path).count(206), 10)
+        self.assertEqual(retries(run), {'download': 2})
+
+    def test_tail_fetch(self):
+        previous_path = os.path.join(self.dir, 'previous.csv')
+        with open(previous_path, 'wb') as f:
+            f.write(self.content[:1000])
+        local_dir = os.path.join(self.dir, 'new')
+        os.mkdir(local_dir)
+        self.drive.fail(502)
+        self.assertTrue(tail_fetch_file(self.service, {
+            'id': 'a', 'name': 'Lowland.csv', 'size': len(self.content),
+            'md5Checksum': hashlib.md5(self.content).hexdigest(),
+        }, local_dir, {'id': 'a', 'path': previous_path, 'size': 1000}))
+        with open(os.path.join(local_dir, 'Lowland.csv'), 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_photo_fetcher(self):
+        path = os.path.join(self.dir, 'Black_Rock_12_30.jpg')
+        self.drive.fail(429, path=FILES_PATH)
+        self.drive.fail(503, path=FILES_PATH + '/c')
+        with mock.patch('blackrock_photo_fetcher.PHOTO_ID_CACHE',
+                        os.path.join(self.dir, 'ids.json')):
+            fetch_image(path, self.service)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'\xff\xd8 photo')
+
+    def test_shared_quota(self):
+        # Four threads asking for more than the quota allows, between
+        # them, all get through.
+        self.drive.quota = 40
+        bucket = TokenBucket(80, 5)
+        errors = []
+
+        def worker():
+            service = self.drive.service()
+            try:
+                for i in range(12):
+                    call(service.files().list(pageSize=10).execute,
+                         'list', bucket)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.drive.statuses().count(200), 48)
+        self.assertIn(403, self.drive.statuses())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import contextlib
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import blackrock_data_fetcher
+from blackrock_columnar import np
+from blackrock_metrics import recording
+from blackrock_data_processor import process_environmental_data
+from blackrock_stations import STATIONS, process_stations
+from tests.test_data_processor import (
+    DENDROMETER_HEADER, ENVIRONMENTAL_HEADER, toa5_lines
+)
+
+
+def station(filename):
+    return [s for s in STATIONS if s['filename'] == filename][0]
+
+
+class TestStations(unittest.TestCase):
+    start = datetime(2016, 9, 16, 12)
+
+    def setUp(self):
+        self.src = tempfile.mkdtemp()
+        self.out = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.src)
+        self.addCleanup(shutil.rmtree, self.out)
+        for name, value in (
+                ('blackrock_data_processor.PROCESSED_DATA_DIR', self.out),
+                ('blackrock_query.PROCESSED_DATA_DIR', self.out),
+                ('blackrock_column_cache.PROCESSED_DATA_DIR', self.out),
+                ('blackrock_rollup.PROCESSED_DATA_DIR', self.out),
+                ('blackrock_rollup.ROLLUP_DATA_DIR',
+                 os.path.join(self.out, 'rollups')),
+                ('blackrock_stations.DEBUG', False)):
+            patcher = mock.patch(name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.write_source('Lowland.csv', ENVIRONMENTAL_HEADER)
+        self.write_source('White_Oak_Table20.csv', DENDROMETER_HEADER)
+
+    def write_source(self, filename, header):
+        with open(os.path.join(self.src, filename), 'w', newline='') as f:
+            f.write(toa5_lines(header, self.start, 30))
+
+    def read(self, filename):
+        with open(os.path.join(self.out, filename), 'rb') as f:
+            return f.read()
+
+    def test_process_stations(self):
+        stations = [station('Lowland.csv'), station('White_Oak_Table20.csv')]
+        self.assertEqual(process_stations(self.src, stations, workers=1), {})
+        for filename in ('Lowland.csv', 'White_Oak_Table20.csv'):
+            self.assertTrue(os.path.exists(os.path.join(
+                self.out, filename + '.index')))
+            self.assertTrue(os.path.exists(os.path.join(
+                self.out, filename + '.columns', 'header.json')))
+            self.assertTrue(os.path.exists(os.path.join(
+                self.out, 'rollups', filename + '.rollup')))
+        processed = self.read('Lowland.csv')
+
+        os.remove(os.path.join(self.out, 'Lowland.csv'))
+        process_environmental_data(self.src, 'Lowland.csv',
+                                   start_dt=datetime(2016, 9, 10, 17))
+        self.assertEqual(processed, self.read('Lowland.csv'))
+
+    def test_failed_station_in_pool(self):
+        # The workers import the modules afresh, so they don't see this
+        # test's patched directories. Both stations fail on their input
+        # before writing anything: Mailley's Mill's file is missing, and
+        # Lowland's is a directory.
+        src = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, src)
+        os.mkdir(os.path.join(src, 'Lowland.csv'))
+        stations = [station('Lowland.csv'),
+                    station('Mailley\'s_Mill_Table20Min.csv')]
+        with recording('data', self.out) as run:
+            errors = process_stations(src, stations, workers=2)
+        self.assertEqual(sorted(errors), [
+            'Lowland.csv', 'Mailley\'s_Mill_Table20Min.csv'])
+        self.assertIn('IsADirectoryError', errors['Lowland.csv'])
+        self.assertIn('FileNotFoundError', errors[
+            'Mailley\'s_Mill_Table20Min.csv'])
+        # Each worker's stages come back to the parent's run.
+        self.assertEqual(
+            sorted((s['stage'], s['station']) for s in run.stages),
+            [('process_dendrometer_data', 'Mailley\'s_Mill_Table20Min.csv'),
+             ('process_environmental_data', 'Lowland.csv')])
+
+    def test_mailley_averages(self):
+        header = ['TIMESTAMP', 'RECORD'] + [
+            '%s_%d_AVG' % (tree, i)
+            for tree in ('Hemlock', 'Pine') for i in range(1, 4)]
+        self.write_source('Mailley\'s_Mill_Table20Min.csv', header)
+        self.assertEqual(process_stations(
+            self.src, [station('Mailley\'s_Mill_Table20Min.csv')],
+            workers=1), {})
+        processed = self.read('Mailley\'s_Mill_Table20Min.csv')
+        self.assertTrue(processed.startswith(
+            b'"TIMESTAMP","Hemlock_1_AVG","Hemlock_2_AVG","Hemlock_3_AVG",'
+            b'"Pine_1_AVG","Pine_2_AVG","Pine_3_AVG","Hemlock AVG",'
+            b'"Pine AVG"\r\n'))
+
+    def test_metrics(self):
+        stations = [station('Lowland.csv'), station('White_Oak_Table20.csv')]
+        # The rows are counted by TOA5Reader, whichever backend
+        # transforms them.
+        backends = ['python'] if np is None else ['python', 'numpy']
+        for backend in backends:
+            with recording('data', self.out) as run, mock.patch(
+                    'blackrock_data_processor.PROCESSING_BACKEND', backend):
+                self.assertEqual(process_stations(self.src, stations, 1), {})
+            counters = dict(
+                ((name, dict(labels)['station']), value)
+                for (name, labels), value in run.counters.items())
+            # Lowland's rows all start after its start date, and
+            # White_Oak's first 9 rows are before its.
+            self.assertEqual(counters, {
+                ('rows_read', 'Lowland.csv'): 30,
+                ('rows_kept', 'Lowland.csv'): 30,
+                ('rows_written', 'Lowland.csv'): 30,
+                ('rows_read', 'White_Oak_Table20.csv'): 30,
+                ('rows_kept', 'White_Oak_Table20.csv'): 21,
+                ('rows_written', 'White_Oak_Table20.csv'): 21,
+            })
+            self.assertEqual(
+                set(s['stage'] for s in run.stages),
+                set(['process_environmental_data',
+                     'process_dendrometer_data_with_formula',
+                     'index', 'cache', 'rollup']))
+            os.remove(os.path.join(self.out, 'Lowland.csv'))
+            os.remove(os.path.join(self.out, 'White_Oak_Table20.csv'))
+
+    def test_failure_leaves_current_alone(self):
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base)
+        os.symlink(self.src, os.path.join(base, 'current'))
+        errors = {'Lowland.csv': 'Traceback ...'}
+        with mock.patch.multiple(
+                blackrock_data_fetcher, LOCAL_DIRECTORY_BASE=base,
+                OL_EXPECTED_FILES_SET=set(), RT_EXPECTED_FILES_SET=set(),
+                fetch_files=mock.DEFAULT, purge_all=mock.DEFAULT,
+                record_fetched=mock.DEFAULT, record_published=mock.DEFAULT,
+                process_stations=mock.Mock(return_value=errors)) as mocks:
+            with self.assertRaisesRegex(Exception, 'Lowland.csv failed'):
+                blackrock_data_fetcher.main()
+        self.assertFalse(mocks['record_published'].called)
+        self.assertEqual(os.readlink(os.path.join(base, 'current')),
+                         self.src)
+
+    def test_published_once_current_is_linked(self):
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base)
+        current = os.path.join(base, 'current')
+        for fails in (True, False):
+            with mock.patch.multiple(
+                    blackrock_data_fetcher, LOCAL_DIRECTORY_BASE=base,
+                    OL_EXPECTED_FILES_SET=set(), RT_EXPECTED_FILES_SET=set(),
+                    fetch_files=mock.DEFAULT, purge_all=mock.DEFAULT,
+                    record_fetched=mock.DEFAULT,
+                    record_published=mock.DEFAULT,
+                    process_stations=mock.Mock(return_value={})) as mocks, \
+                    mock.patch('os.symlink', side_effect=OSError) \
+                    if fails else contextlib.nullcontext():
+                blackrock_data_fetcher.main()
+            self.assertEqual(mocks['record_published'].called, not fails)
+            self.assertEqual(os.path.islink(current), not fails)
+
+
+if __name__ == '__main__':
+    unittest.main()
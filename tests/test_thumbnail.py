@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from blackrock_thumbnail import fit_size, make_thumbnails, Image
+
+
+class TestFitSize(unittest.TestCase):
+    def test_fit_size(self):
+        self.assertEqual(fit_size((1920, 1080), (207, 207)), (207, 116))
+        self.assertEqual(fit_size((1080, 1920), (207, 207)), (116, 207))
+        self.assertEqual(fit_size((100, 50), (207, 207)), (100, 50))
+
+
+@unittest.skipIf(Image is None, 'Pillow is not installed')
+class TestMakeThumbnails(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.src = os.path.join(self.dir, 'Lodge.jpg')
+        Image.new('RGB', (1920, 1080), (20, 80, 40)).save(self.src)
+
+    def test_make_thumbnails(self):
+        thumb = os.path.join(self.dir, 'thumb.jpg')
+        medium = os.path.join(self.dir, 'medium.jpg')
+        make_thumbnails(self.src, [(thumb, (207, 207)),
+                                   (medium, (640, 640))], backend='pillow')
+
+        with Image.open(thumb) as im:
+            self.assertEqual(im.size, (207, 116))
+        with Image.open(medium) as im:
+            self.assertEqual(im.size, (640, 360))
+
+
+if __name__ == '__main__':
+    unittest.main()